@@ -12,7 +12,19 @@ CORS(APP)
 APP.config.update(
     REMOTE_HOSTS=['192.168.1.11', '192.168.1.12', '192.168.1.13'],
     REMOTE_HOST_USERNAME='pi',
-    REMOTE_IMAGE_DIRECTORY='~/elephant_vending_machine/images'
+    REMOTE_IMAGE_DIRECTORY='~/elephant_vending_machine/images',
+    RIGS={},
+    IMAGE_WORKERS=2,
+    SCREEN_RESOLUTION=(1920, 1080),
+    NORMALIZE_UPLOADS=False,
+    DUPLICATE_DISTANCE=6,
+    ASGI_THREADS=32,
+    RETENTION_POLICIES={},
+    RETENTION_INTERVAL=3600,
+    COMPRESS_LOGS=True,
+    RECORD_SENSOR_TRACES=False,
+    SENSOR_TRACE_CAPACITY=1 << 20,
+    HOST_MONITOR_INTERVAL=0
 )
 
 # Circular imports are bad, but views are not used here, only imported, so it's OK
@@ -0,0 +1,33 @@
+"""ASGI entry point for the behavioral experiment server.
+
+Synchronous gunicorn workers handle one request at a time, so a slow request,
+such as an upload copied to every Pi, holds up a whole worker. This module
+serves the same Flask application over ASGI with asgiref's WSGI adapter:
+connections are accepted by an event loop, and the blocking Flask views, along
+with the SSH and hardware calls they make, run on a thread pool. Many dashboard
+clients can then be connected at once, and only requests actually doing work
+use a thread.
+
+asgiref sizes its pool from the ASGI_THREADS environment variable, which
+defaults to the ASGI_THREADS setting of the Flask config when it isn't set.
+
+Workers are separate processes, each with its own rig registry. Rigs lock a
+file while they run, so two workers never drive the same rig at once.
+
+Run it with uvicorn workers, for example::
+
+    gunicorn -k uvicorn.workers.UvicornWorker -w 2 -b 0.0.0.0:8000 \\
+        elephant_vending_machine.asgi:application
+"""
+
+import os
+
+from elephant_vending_machine import APP
+
+# asgiref reads the variable when it is imported
+os.environ.setdefault('ASGI_THREADS', str(APP.config['ASGI_THREADS']))
+
+# pylint: disable=wrong-import-position
+from asgiref.wsgi import WsgiToAsgi
+
+application = WsgiToAsgi(APP)
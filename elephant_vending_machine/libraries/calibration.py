@@ -0,0 +1,102 @@
+"""Per-pin sensor thresholds computed from the readings of an empty enclosure.
+
+Each IR sensor has its own baseline reading and noise, so a single
+SENSOR_THRESHOLD is either too low for some sensors, which then detect an
+elephant late, or too high for others, which trigger on noise. Calibration
+samples every pin while nothing is in front of the sensors and sets the
+threshold of each pin just under the range of readings it produced.
+
+Thresholds are stored per rig in a JSON file, so they survive restarts::
+
+    {"north": {"0": 612, "1": 580, "2": 655}}
+"""
+
+import json
+import os
+import statistics
+
+# Number of standard deviations of the noise kept between the baseline and the threshold
+NOISE_MULTIPLIER = 5
+# Fraction of the limit left as headroom under the lowest reading of the empty enclosure
+MARGIN = 0.1
+DEFAULT_DURATION = 5.0
+# Calibration runs within a request, which gunicorn aborts after 30 seconds by
+# default, so sampling leaves time for connecting to the Pis and saving
+MAX_DURATION = 20.0
+
+
+def compute_thresholds(pins, samples, noise_multiplier=NOISE_MULTIPLIER, margin=MARGIN):
+    """Returns the statistics and threshold of each pin from samples of an empty enclosure.
+
+    The threshold of a pin is the lower of its baseline minus noise_multiplier
+    standard deviations and its lowest reading, less margin. Readings of 0,
+    which wait_for_input ignores, are left out. A pin which only read 0, or
+    whose threshold would be under 1, gets no threshold.
+
+    Parameters:
+        pins (list): The sensor pins.
+        samples (list): The readings of every pin, one list per sample.
+        noise_multiplier (float): The number of standard deviations of noise kept.
+        margin (float): The fraction of the limit left as headroom.
+
+    Returns:
+        list: A dict per pin with its pin, number of samples, baseline (mean
+        reading), noise (standard deviation), minimum reading and threshold.
+    """
+    results = []
+    # Each column holds the readings of one pin
+    for pin, column in zip(pins, zip(*samples) if samples else [()] * len(pins)):
+        readings = [reading for reading in column if reading > 0]
+        result = {'pin': pin, 'samples': len(readings), 'baseline': None, 'noise': None,
+                  'minimum': None, 'threshold': None}
+        if readings:
+            baseline = statistics.mean(readings)
+            noise = statistics.pstdev(readings, baseline)
+            minimum = min(readings)
+            threshold = int(min(baseline - noise_multiplier * noise, minimum) * (1 - margin))
+            result.update(baseline=baseline, noise=noise, minimum=minimum,
+                          threshold=threshold if threshold >= 1 else None)
+        results.append(result)
+    return results
+
+
+def thresholds_by_pin(results):
+    """Returns the thresholds of compute_thresholds results as a dict keyed by pin."""
+    return {result['pin']: result['threshold'] for result in results
+            if result['threshold'] is not None}
+
+
+def load_calibrations(path):
+    """Returns the thresholds saved for each rig.
+
+    Parameters:
+        path (str): The path of the calibration file.
+
+    Returns:
+        dict: Maps each rig name to a dict of thresholds keyed by pin, empty if
+        the file doesn't exist.
+    """
+    try:
+        with open(path) as calibration_file:
+            calibrations = json.load(calibration_file)
+    except FileNotFoundError:
+        return {}
+    return {rig: {int(pin): threshold for pin, threshold in thresholds.items()}
+            for rig, thresholds in calibrations.items()}
+
+
+def save_calibration(path, rig_name, thresholds):
+    """Saves the thresholds of a rig, keeping those of the other rigs.
+
+    Parameters:
+        path (str): The path of the calibration file, created if it doesn't exist.
+        rig_name (str): The name of the calibrated rig.
+        thresholds (dict): The threshold of each pin.
+    """
+    calibrations = load_calibrations(path)
+    calibrations[rig_name] = thresholds
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as calibration_file:
+        json.dump({rig: {str(pin): threshold for pin, threshold in pins.items()}
+                   for rig, pins in calibrations.items()}, calibration_file, indent=2)
+    os.replace(temporary_path, path)
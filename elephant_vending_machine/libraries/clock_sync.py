@@ -0,0 +1,128 @@
+"""Estimation of the offset between the clocks of the Pis and of the controller.
+
+Times reported by the agents running on the Pis, such as the time an image was
+displayed, are on the Pi's clock. ClockSync exchanges time requests with an
+agent, NTP style, over a persistent connection of its own, so that background
+exchanges never hold up a display command waiting on the same connection:
+
+    t0: the controller sends the request, on the controller's clock
+    t1: the agent receives it, on the Pi's clock
+    t2: the agent sends its acknowledgement, on the Pi's clock
+    t3: the controller receives the acknowledgement, on the controller's clock
+
+Each exchange gives a round trip time, (t3 - t0) - (t2 - t1), and an offset,
+((t1 - t0) + (t2 - t3)) / 2, whose error is at most half the round trip time.
+The offset of the exchange with the smallest round trip time among the recent
+ones is used, and exchanges are repeated in the background to follow drift.
+Controller times are time.perf_counter() values, as in the experiment logs.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+SAMPLES_PER_UPDATE = 5
+WINDOW_SIZE = 30
+SYNC_INTERVAL = 10
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ClockSync:
+    """Tracks the offset of the clock of the agent on one Pi.
+
+    Parameters:
+        client (AgentClient): The client connected to the agent, used for nothing else.
+        window_size (int): The number of recent exchanges the estimate is chosen from.
+    """
+
+    def __init__(self, client, window_size=WINDOW_SIZE):
+        self.client = client
+        self._samples = collections.deque(maxlen=window_size)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        """Exchanges one time request with the agent and records the result.
+
+        Returns:
+            tuple: The round trip time and offset of the exchange, in seconds.
+
+        Raises:
+            OSError: If the agent could not be reached.
+        """
+        sent = time.perf_counter()
+        response = self.client.send('time')
+        received = time.perf_counter()
+        round_trip = (received - sent) - (response['sent'] - response['received'])
+        offset = ((response['received'] - sent) + (response['sent'] - received)) / 2
+        with self._lock:
+            self._samples.append((round_trip, offset))
+        return round_trip, offset
+
+    def update(self, samples=SAMPLES_PER_UPDATE):
+        """Exchanges several time requests with the agent.
+
+        Raises:
+            OSError: If the agent could not be reached.
+        """
+        for _ in range(samples):
+            self.sample()
+
+    def _best_sample(self):
+        with self._lock:
+            return min(self._samples) if self._samples else None
+
+    @property
+    def offset(self):
+        """float: The Pi's clock minus the controller's, in seconds, None before any exchange."""
+        best = self._best_sample()
+        return None if best is None else best[1]
+
+    @property
+    def round_trip(self):
+        """float: The round trip time of the exchange the offset comes from, in seconds."""
+        best = self._best_sample()
+        return None if best is None else best[0]
+
+    def to_local(self, remote_time):
+        """Converts a time on the Pi's clock to the controller's clock.
+
+        Returns:
+            float: The time.perf_counter() value corresponding to *remote_time*, or
+            None if the offset isn't known yet.
+        """
+        offset = self.offset
+        return None if offset is None else remote_time - offset
+
+    def _run(self, interval):
+        # Without an offset yet, the first exchanges are made right away
+        wait = 0 if self.offset is None else interval
+        while not self._stop.wait(wait):
+            try:
+                self.update()
+            except OSError:
+                LOGGER.warning('Clock sync with %s failed', self.client.address)
+            wait = interval
+
+    def start(self, interval=SYNC_INTERVAL):
+        """Starts exchanging time requests every *interval* seconds on a daemon thread.
+
+        The first exchanges are made immediately if the offset isn't known yet.
+        Does nothing if the exchanges are already running.
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,),
+                                        name=f'clock-sync-{self.client.address}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background exchanges."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
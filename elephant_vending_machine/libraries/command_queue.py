@@ -0,0 +1,193 @@
+"""Prioritized, pipelined queue of the commands sent to the agent on a Pi.
+
+AgentClient sends a command and waits for its acknowledgement before the next
+one can be sent, so every command costs a full round trip and a slow command
+holds up the next stimulus. A CommandQueue returns a Future as soon as a command
+is queued. A sender thread writes queued commands to a dedicated connection,
+most urgent first, without waiting for the acknowledgements of the previous
+ones, and a receiver thread resolves each Future when its acknowledgement
+arrives. Experiments can then issue commands without blocking and only wait on
+the Futures they need.
+
+Commands are sent in order of priority: stimulus swaps first, then LED cues,
+then housekeeping such as turning the strip off. The agent applies the commands
+of a connection in the order it receives them, so at most PIPELINE_DEPTH
+commands are sent ahead of their acknowledgements. This bounds how long an
+urgent command can wait behind commands already sent.
+"""
+
+from concurrent.futures import CancelledError, Future
+import heapq
+import itertools
+import json
+import socket
+import threading
+import time
+
+from .pi_agent_client import AgentError, AGENT_PORT, AGENT_TIMEOUT
+
+STIMULUS = 0
+LED = 1
+HOUSEKEEPING = 2
+PIPELINE_DEPTH = 4
+
+
+class CommandQueue:
+    """Sends commands to the agent on a single Pi by priority, over a pipelined connection.
+
+    The connection is opened when the first command is sent, and reopened for
+    the next command if it is lost. Commands in flight when a connection is lost
+    fail with the OSError which broke it.
+
+    Parameters:
+        address (str): The local IP address of the Pi running the agent.
+        port (int): The port the agent listens on.
+        timeout (float): The number of seconds to wait when connecting.
+        depth (int): The maximum number of commands sent but not acknowledged yet.
+    """
+
+    def __init__(self, address, port=AGENT_PORT, timeout=AGENT_TIMEOUT, depth=PIPELINE_DEPTH):
+        self.address = address
+        self.port = port
+        self.timeout = timeout
+        self.depth = depth
+        self._queue = []
+        self._order = itertools.count()
+        self._next_id = 0
+        self._in_flight = {}
+        self._socket = None
+        self._sender = None
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def submit(self, priority, command, **arguments):
+        """Queues a command for the agent.
+
+        Parameters:
+            priority (int): STIMULUS, LED or HOUSEKEEPING, lower values being sent first.
+                Commands of the same priority are sent in the order they were queued.
+            command (str): The name of the command, see pi_agent.py.
+            **arguments: The arguments of the command.
+
+        Returns:
+            Future: Resolves to the acknowledgement of the agent, with the
+            time.perf_counter() times the command was sent, in sent_at, and its
+            acknowledgement received, in acknowledged_at. Fails with an AgentError
+            if the agent couldn't apply the command, or with an OSError if the
+            agent couldn't be reached.
+
+        Raises:
+            RuntimeError: If the queue was closed.
+        """
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('The command queue is closed')
+            request = dict(arguments, command=command)
+            heapq.heappush(self._queue, (priority, next(self._order), request, future))
+            if self._sender is None:
+                self._sender = threading.Thread(
+                    target=self._send_loop, name=f'commands-{self.address}', daemon=True)
+                self._sender.start()
+            self._condition.notify_all()
+        return future
+
+    def display(self, path):
+        """Queues the display of an image, with STIMULUS priority."""
+        return self.submit(STIMULUS, 'display', path=path)
+
+    def set_color(self, red, green, blue, display_time):
+        """Queues a color for the LED strip, with LED priority."""
+        return self.submit(LED, 'color', red=red, green=green, blue=blue, duration=display_time)
+
+    def show_pattern(self, name, red, green, blue, display_time):
+        """Queues a named LED pattern, with LED priority."""
+        return self.submit(LED, 'pattern', name=name, red=red, green=green, blue=blue,
+                           duration=display_time)
+
+    def _send_loop(self):
+        while True:
+            with self._condition:
+                while not self._closed and (not self._queue or len(self._in_flight) >= self.depth):
+                    self._condition.wait()
+                if self._closed:
+                    return
+                _, _, request, future = heapq.heappop(self._queue)
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self._next_id += 1
+                request['id'] = self._next_id
+                self._in_flight[self._next_id] = (future, time.perf_counter())
+                connection = self._socket
+            try:
+                if connection is None:
+                    connection = self._connect()
+                connection.sendall(json.dumps(request).encode() + b'\n')
+            except OSError as error:
+                self._fail(connection, error)
+
+    def _connect(self):
+        connection = socket.create_connection((self.address, self.port), self.timeout)
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Acknowledgements may be far apart, reads wait for them indefinitely
+        connection.settimeout(None)
+        with self._condition:
+            self._socket = connection
+        threading.Thread(target=self._receive_loop, args=(connection,),
+                         name=f'acks-{self.address}', daemon=True).start()
+        return connection
+
+    def _receive_loop(self, connection):
+        try:
+            with connection.makefile('rb') as reader:
+                for line in reader:
+                    acknowledged_at = time.perf_counter()
+                    response = json.loads(line)
+                    with self._condition:
+                        future, sent_at = self._in_flight.pop(response.get('id'), (None, None))
+                        self._condition.notify_all()
+                    if future is None:
+                        continue
+                    if response.get('status') != 'ok':
+                        future.set_exception(AgentError(response.get('message', 'Unknown error')))
+                        continue
+                    response['sent_at'] = sent_at
+                    response['acknowledged_at'] = acknowledged_at
+                    future.set_result(response)
+        except (OSError, ValueError) as error:
+            self._fail(connection, error if isinstance(error, OSError) else
+                       ConnectionResetError(f'Invalid acknowledgement: {error}'))
+            return
+        self._fail(connection, ConnectionResetError('Connection closed by agent'))
+
+    def _fail(self, connection, error):
+        """Fails the commands in flight and drops the connection, if it is still the current one."""
+        with self._condition:
+            if connection is not None and connection is not self._socket:
+                return
+            in_flight = list(self._in_flight.values())
+            self._in_flight.clear()
+            self._socket = None
+            self._condition.notify_all()
+        if connection is not None:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            connection.close()
+        for future, _ in in_flight:
+            future.set_exception(error)
+
+    def close(self):
+        """Stops sending commands, cancelling queued ones, and closes the connection."""
+        with self._condition:
+            self._closed = True
+            queued = [future for _, _, _, future in self._queue]
+            self._queue = []
+            sender = self._sender
+            self._condition.notify_all()
+        for future in queued:
+            future.cancel()
+        if sender is not None:
+            sender.join()
+        self._fail(self._socket, CancelledError('The command queue was closed'))
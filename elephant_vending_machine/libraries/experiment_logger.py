@@ -2,6 +2,13 @@
 
 This module contains functionality required to create a custom logger
 which writes messages and the corresponding UTC timestamp to csv files.
+
+Each row holds the UTC wall clock time of the logging call, the message and
+the time.perf_counter() value at the same moment, in seconds. Differences
+between monotonic times aren't affected by clock adjustments, so latencies
+should be computed from them. Events which happened before the logging call,
+such as a sensor sample, can be logged with their own monotonic time, passed
+as extra={'monotonic': time}; their wall clock time is adjusted to match.
 """
 
 import csv
@@ -9,6 +16,24 @@ import io
 import logging
 from logging import FileHandler
 from datetime import datetime
+import time
+
+class MonotonicTimeFilter(logging.Filter):
+    """Stamps log records with the monotonic time of the logging call.
+
+    Records which already have a monotonic time, given through extra, keep it,
+    and their creation time is moved back to the moment of that monotonic time.
+    A monotonic time of None, such as the display time of a stimulus shown
+    without the Pi agent, is replaced by the time of the logging call.
+    """
+
+    def filter(self, record):
+        now = time.perf_counter()
+        if getattr(record, 'monotonic', None) is not None:
+            record.created -= now - record.monotonic
+        else:
+            record.monotonic = now
+        return True
 
 class CsvFormatter(logging.Formatter):
     """Instances of CsvFormatter are used to convert a LogRecord instance to text.
@@ -34,30 +59,38 @@ class CsvFormatter(logging.Formatter):
         """ Format the specified record as text formatted for csv file.
 
         The specified record is formatted as csv compatible text containing
-        the current UTC timestamp and the record message.
+        the UTC timestamp of the record, the record message and the monotonic
+        time of the record if it has one.
 
         Parameters:
             record (LogRecord): The log record to be formatted
 
         Returns:
             str: a string formatted as an entry for a csv file containing
-            current UTC timestamp and record text
+            the UTC timestamp, record text and monotonic time
         """
 
-        self.writer.writerow([datetime.utcnow(), record.getMessage()])
+        timestamp = datetime.utcfromtimestamp(record.created)
+        monotonic = getattr(record, 'monotonic', None)
+        self.writer.writerow([timestamp.isoformat(' ', timespec='microseconds'),
+                              record.getMessage(),
+                              '' if monotonic is None else f'{monotonic:.6f}'])
         data = self.output.getvalue()
         self.output.truncate(0)
         self.output.seek(0)
         return data.strip()
 
-def create_experiment_logger(file_name):
+def create_experiment_logger(file_name, rig_name=None):
     """ Create experiment logger to log record to csv file.
 
-    The specified record is formatted as csv compatible text containing
-    the current UTC timestamp and the record message.
+    Records are formatted as csv compatible text containing the UTC
+    timestamp, the record message and the monotonic time of the record.
 
     Parameters:
         file_name (str): The name of the file to which the logs will be written
+        rig_name (str): The name of the rig running the experiment. Each rig
+            gets its own logger, so experiments running in parallel on different
+            rigs don't write to each other's files.
 
     Returns:
         Logger: experiment_logger instance configured to write INFO level logs
@@ -66,10 +99,33 @@ def create_experiment_logger(file_name):
 
     log_level = logging.INFO
     experiment_log_path = 'elephant_vending_machine/static/log/'
-    logger = logging.getLogger('experiment_logger')
+    logger = logging.getLogger(_logger_name(rig_name))
     logger.setLevel(log_level)
+    logger.propagate = False
+    if not any(isinstance(log_filter, MonotonicTimeFilter) for log_filter in logger.filters):
+        logger.addFilter(MonotonicTimeFilter())
     experiment_log_file_handler = FileHandler(experiment_log_path + file_name)
     experiment_log_file_handler.setLevel(log_level)
     experiment_log_file_handler.setFormatter(CsvFormatter())
     logger.addHandler(experiment_log_file_handler)
     return logger
+
+def close_experiment_logger(rig_name=None):
+    """ Close the log files of the experiment logger of a rig.
+
+    Must be called once the experiment is finished, so that the next
+    experiment on the rig doesn't also write to the previous log file.
+
+    Parameters:
+        rig_name (str): The name of the rig which ran the experiment
+    """
+
+    logger = logging.getLogger(_logger_name(rig_name))
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+def _logger_name(rig_name):
+    if rig_name is None:
+        return 'experiment_logger'
+    return 'experiment_logger.' + rig_name
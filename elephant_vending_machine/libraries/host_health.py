@@ -0,0 +1,294 @@
+"""Health of the Raspberry Pis and circuit breakers for the commands sent to them.
+
+A Pi which is down makes every SSH or agent command sent to it block for the
+whole connection timeout, so an upload or a trial touching it stalls. Each host
+gets a circuit breaker: after FAILURE_THRESHOLD consecutive connection failures,
+or as soon as the health monitor finds the host unreachable, the breaker opens
+and commands to the host fail immediately with a HostDownError. Once
+RESET_TIMEOUT seconds have passed, a single command is let through as a probe
+while the others keep failing fast: its success, or the next successful health
+probe, closes the breaker, and its failure opens it again.
+
+The health monitor probes every host in the background by opening a TCP
+connection to its SSH port, which costs a single round trip and no
+authentication, and records the latency of each probe.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+import socket
+from subprocess import CalledProcessError
+import threading
+import time
+
+import spur.ssh
+
+FAILURE_THRESHOLD = 3
+RESET_TIMEOUT = 30.0
+PROBE_PORT = 22
+PROBE_TIMEOUT = 1.0
+# Exit status of ssh and scp when the connection itself failed
+SSH_CONNECTION_FAILED = 255
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class HostDownError(OSError):
+    """Raised instead of sending a command to a host whose circuit breaker is open."""
+
+
+def is_connection_failure(error):
+    """Returns whether an error means the host couldn't be reached, rather than the command failed.
+
+    Parameters:
+        error (Exception): The error raised by a command sent to the host.
+    """
+    if isinstance(error, CalledProcessError):
+        return error.returncode == SSH_CONNECTION_FAILED
+    # spur raises its own ConnectionError, which isn't an OSError
+    return isinstance(error, (OSError, spur.ssh.ConnectionError))
+
+
+class CircuitBreaker:
+    """Tracks the failures of the commands sent to a host and stops sending them while it is down.
+
+    Parameters:
+        host (str): The address of the host.
+        failure_threshold (int): The number of consecutive failures opening the breaker.
+        reset_timeout (float): The number of seconds the breaker stays open before
+            a command is let through again, and the number of seconds after which
+            a command let through without reporting its outcome is given up on.
+        clock (callable): Returns the current time in seconds, time.monotonic by default.
+    """
+
+    def __init__(self, host, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT,
+                 clock=time.monotonic):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self._opened_at = None
+        self._probe_started_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """str: 'closed', 'open', or 'half-open' once the reset timeout has passed."""
+        opened_at = self._opened_at
+        if opened_at is None:
+            return CLOSED
+        if self.clock() - opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def allow(self):
+        """Returns whether a command may be sent to the host.
+
+        While half-open, only the first caller is allowed, as a probe of the host,
+        and the others are turned away until its outcome is recorded.
+        """
+        with self._lock:
+            state = self.state
+            if state == CLOSED:
+                return True
+            if state == OPEN:
+                return False
+            now = self.clock()
+            probe_started_at = self._probe_started_at
+            if probe_started_at is not None and now - probe_started_at < self.reset_timeout:
+                return False
+            self._probe_started_at = now
+            return True
+
+    def check(self):
+        """Raises a HostDownError if commands to the host should fail fast."""
+        if not self.allow():
+            raise HostDownError(f'Host {self.host} is down')
+
+    def record_success(self):
+        """Closes the breaker, the host answered."""
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._probe_started_at = None
+
+    def record_failure(self):
+        """Counts a failure, opening the breaker at the threshold or if it was half-open."""
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold or self._opened_at is not None:
+                self._opened_at = self.clock()
+                self._probe_started_at = None
+
+    def trip(self):
+        """Opens the breaker immediately, the host is known to be down."""
+        with self._lock:
+            self.failures = max(self.failures, self.failure_threshold)
+            self._opened_at = self.clock()
+            self._probe_started_at = None
+
+
+_BREAKERS = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def get_breaker(host):
+    """Returns the circuit breaker of a host, shared by every command sent to it."""
+    with _BREAKERS_LOCK:
+        if host not in _BREAKERS:
+            _BREAKERS[host] = CircuitBreaker(host)
+        return _BREAKERS[host]
+
+
+@contextmanager
+def host_call(host):
+    """Guards the commands sent to a host by its circuit breaker.
+
+    Connection failures raised in the block are counted against the host, and
+    any other outcome shows the host is up. Usage::
+
+        with host_call(address):
+            subprocess.run(ssh_command, check=True, shell=True)
+
+    Raises:
+        HostDownError: If the breaker of the host is open, before running the block.
+    """
+    breaker = get_breaker(host)
+    breaker.check()
+    try:
+        yield
+    # Every error is re-raised, it is only inspected to update the breaker
+    # pylint: disable=broad-except
+    except Exception as error:
+        if is_connection_failure(error):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        raise
+    breaker.record_success()
+
+
+def record_future(host, future):
+    """Updates the circuit breaker of a host with the outcome of a command, once it completes.
+
+    Parameters:
+        host (str): The address of the host the command was sent to.
+        future (Future): The pending result of the command.
+
+    Returns:
+        Future: The future, for chaining.
+    """
+    def record(completed):
+        if completed.cancelled():
+            return
+        error = completed.exception()
+        if error is not None and is_connection_failure(error):
+            get_breaker(host).record_failure()
+        else:
+            get_breaker(host).record_success()
+    future.add_done_callback(record)
+    return future
+
+
+def probe(host, port=PROBE_PORT, timeout=PROBE_TIMEOUT):
+    """Returns the number of seconds taken to open a TCP connection to a host.
+
+    Raises:
+        OSError: If the connection couldn't be opened within timeout seconds.
+    """
+    start = time.perf_counter()
+    with socket.create_connection((host, port), timeout):
+        return time.perf_counter() - start
+
+
+class HostMonitor:
+    """Probes hosts at a regular interval, keeping their state and circuit breakers up to date.
+
+    Parameters:
+        hosts (iterable): The addresses of the hosts.
+        interval (float): The number of seconds between probes of every host.
+        port (int): The TCP port probed, the SSH port by default.
+        timeout (float): The number of seconds after which a host is considered down.
+    """
+
+    def __init__(self, hosts, interval, port=PROBE_PORT, timeout=PROBE_TIMEOUT):
+        self.hosts = list(dict.fromkeys(hosts))
+        self.interval = interval
+        self.port = port
+        self.timeout = timeout
+        self._status = {host: {'host': host, 'up': None, 'latency_ms': None, 'checked_at': None}
+                        for host in self.hosts}
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        """bool: Whether hosts are being probed in the background."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def probe_host(self, host):
+        """Probes a host, updating its state and circuit breaker.
+
+        Returns:
+            dict: The state of the host, as returned by status.
+        """
+        breaker = get_breaker(host)
+        try:
+            latency = probe(host, self.port, self.timeout)
+        except OSError:
+            breaker.trip()
+            status = {'host': host, 'up': False, 'latency_ms': None}
+        else:
+            breaker.record_success()
+            status = {'host': host, 'up': True, 'latency_ms': round(latency * 1000, 3)}
+        status['checked_at'] = datetime.utcnow().isoformat(' ')
+        self._status[host] = status
+        return self._host_status(host)
+
+    def probe_all(self):
+        """Probes every host in parallel.
+
+        Returns:
+            list: The state of each host, as returned by status.
+        """
+        if not self.hosts:
+            return []
+        with ThreadPoolExecutor(max_workers=len(self.hosts)) as executor:
+            return list(executor.map(self.probe_host, self.hosts))
+
+    def _host_status(self, host):
+        breaker = get_breaker(host)
+        return dict(self._status[host], breaker=breaker.state, failures=breaker.failures)
+
+    def status(self):
+        """Returns the state of every host from the latest probes.
+
+        Returns:
+            list: A dict per host with its address, whether it is up, the latency
+            of the latest probe in milliseconds, the UTC time of that probe, the
+            state of its circuit breaker and its number of consecutive failures.
+            Hosts which were never probed are neither up nor down.
+        """
+        return [self._host_status(host) for host in self.hosts]
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.probe_all()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Starts probing the hosts on a daemon thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='host-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops probing and waits for the current probes to finish."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
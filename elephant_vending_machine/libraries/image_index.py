@@ -0,0 +1,306 @@
+"""Searchable index of the uploaded stimulus images.
+
+The index is an embedded SQLite database holding the size, dimensions, format,
+content hash, perceptual hash, upload time and tags of every image, so searches
+never have to touch the image directory. Filename prefix, tag and dimension
+queries are all answered from indexes, near-duplicate queries from a BK-tree of
+the perceptual hashes kept in memory. Every change to the images is counted in
+the database, so the tree is only rebuilt when another connection made changes
+it hasn't seen.
+"""
+
+from datetime import datetime
+import os
+import sqlite3
+import threading
+
+from PIL import Image
+
+from .image_variants import content_hash
+from .perceptual_hash import BKTree, difference_hash
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS images (
+    filename TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    format TEXT,
+    hash TEXT NOT NULL,
+    uploaded_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS image_tags (
+    tag TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    PRIMARY KEY (tag, filename)
+);
+CREATE INDEX IF NOT EXISTS image_tags_filename ON image_tags (filename);
+CREATE INDEX IF NOT EXISTS images_dimensions ON images (width, height);
+CREATE INDEX IF NOT EXISTS images_hash ON images (hash);
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    count INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO changes (id, count) VALUES (0, 0);
+'''
+
+# Statements upgrading a database from the version at their index to the next one
+MIGRATIONS = (
+    'ALTER TABLE images ADD COLUMN phash TEXT',
+)
+
+COLUMNS = ('filename', 'size', 'width', 'height', 'format', 'hash', 'phash', 'uploaded_at')
+SEARCH_LIMIT = 100
+
+
+def read_image_metadata(path):
+    """Returns the size, dimensions, format, content hash and perceptual hash of an image file.
+
+    Dimensions, format and perceptual hash are None for files Pillow can't read,
+    such as SVGs. The perceptual hash is stored as 16 hexadecimal digits.
+
+    Parameters:
+        path (str): The path of the image file.
+
+    Returns:
+        dict: The metadata, keyed by column name.
+    """
+    metadata = {'size': os.path.getsize(path), 'hash': content_hash(path),
+                'width': None, 'height': None, 'format': None, 'phash': None}
+    try:
+        with Image.open(path) as image:
+            metadata.update(width=image.width, height=image.height, format=image.format)
+            metadata['phash'] = format(difference_hash(image), '016x')
+    except OSError:
+        pass
+    return metadata
+
+
+class ImageIndex:
+    """SQLite backed index of image metadata and tags.
+
+    Each thread uses its own connection to the database. The BK-tree of perceptual
+    hashes is shared by all threads and updated in place by add and remove. It is
+    rebuilt when the change count shows another index, possibly in another
+    process, has modified the database since.
+
+    Parameters:
+        path (str): The path of the database file, created if it doesn't exist.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._tree = None
+        self._tree_change = None
+        self._tree_lock = threading.Lock()
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript(SCHEMA)
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        with connection:
+            for statement in MIGRATIONS[version:]:
+                connection.execute(statement)
+            connection.execute(f'PRAGMA user_version = {len(MIGRATIONS)}')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path)
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+        return connection
+
+    def add(self, filename, path, tags=(), uploaded_at=None, metadata=None):
+        """Adds an image to the index, replacing any previous entry with the same filename.
+
+        Parameters:
+            filename (str): The name the image was uploaded as.
+            path (str): The path of the image file.
+            tags (iterable): The tags of the image.
+            uploaded_at (datetime): The upload time, the current UTC time by default.
+            metadata (dict): The metadata of the file as returned by read_image_metadata,
+                read from the file if None.
+        """
+        metadata = dict(metadata or read_image_metadata(path))
+        metadata['filename'] = filename
+        metadata['uploaded_at'] = (uploaded_at or datetime.utcnow()).isoformat(' ')
+        connection = self._connection()
+        with connection:
+            previous = self._phash(connection, filename)
+            connection.execute(
+                f'INSERT OR REPLACE INTO images ({", ".join(COLUMNS)}) '
+                f'VALUES ({", ".join("?" * len(COLUMNS))})',
+                [metadata[column] for column in COLUMNS])
+            connection.execute('DELETE FROM image_tags WHERE filename = ?', (filename,))
+            connection.executemany('INSERT OR IGNORE INTO image_tags (tag, filename) VALUES (?, ?)',
+                                   [(tag, filename) for tag in tags])
+            change = self._count_change(connection)
+        self._update_tree(change, filename, previous, metadata['phash'])
+
+    def remove(self, filename):
+        """Removes an image and its tags from the index."""
+        connection = self._connection()
+        with connection:
+            previous = self._phash(connection, filename)
+            connection.execute('DELETE FROM images WHERE filename = ?', (filename,))
+            connection.execute('DELETE FROM image_tags WHERE filename = ?', (filename,))
+            change = self._count_change(connection)
+        self._update_tree(change, filename, previous, None)
+
+    def get(self, filename):
+        """Returns the metadata of an indexed image, without its tags.
+
+        Parameters:
+            filename (str): The filename of the image.
+
+        Returns:
+            dict: The metadata keyed by column name, None if the image isn't indexed.
+        """
+        row = self._connection().execute(
+            f'SELECT {", ".join(COLUMNS)} FROM images WHERE filename = ?', (filename,)).fetchone()
+        return {column: row[column] for column in COLUMNS} if row else None
+
+    @staticmethod
+    def _phash(connection, filename):
+        row = connection.execute('SELECT phash FROM images WHERE filename = ?',
+                                 (filename,)).fetchone()
+        return row['phash'] if row else None
+
+    @staticmethod
+    def _count_change(connection):
+        """Counts a change within the transaction making it, returning the new count."""
+        connection.execute('UPDATE changes SET count = count + 1')
+        return connection.execute('SELECT count FROM changes').fetchone()[0]
+
+    def _update_tree(self, change, filename, previous, phash):
+        """Moves an image from its previous perceptual hash to its new one in the tree.
+
+        The tree is dropped instead if it hasn't seen every change before this one.
+        """
+        with self._tree_lock:
+            if self._tree is None or self._tree_change != change - 1:
+                self._tree = None
+                return
+            if previous:
+                self._tree.remove(int(previous, 16), filename)
+            if phash:
+                self._tree.add(int(phash, 16), filename)
+            self._tree_change = change
+
+    def _perceptual_hash_tree(self):
+        connection = self._connection()
+        change = connection.execute('SELECT count FROM changes').fetchone()[0]
+        with self._tree_lock:
+            if self._tree is None or self._tree_change != change:
+                # Changes committed while the tree is read are applied again by
+                # _update_tree, or make it rebuild the tree, either of which is harmless
+                self._tree = BKTree()
+                self._tree_change = change
+                for row in connection.execute(
+                        'SELECT filename, phash FROM images WHERE phash IS NOT NULL'):
+                    self._tree.add(int(row['phash'], 16), row['filename'])
+            return self._tree
+
+    def find_similar(self, phash, max_distance, exclude=None):
+        """Returns the indexed images whose perceptual hash is close to the specified one.
+
+        Parameters:
+            phash (str): The perceptual hash, as returned by read_image_metadata.
+            max_distance (int): The maximum number of differing bits.
+            exclude (str): A filename to leave out of the results.
+
+        Returns:
+            list: (distance, filename) tuples, closest first.
+        """
+        matches = self._perceptual_hash_tree().search(int(phash, 16), max_distance)
+        return [(distance, filename) for distance, filename in matches if filename != exclude]
+
+    def sync(self, directory, ignored=('.gitignore',)):
+        """Makes the index match the image files in a directory.
+
+        Files missing from the index are added without tags, entries whose file no
+        longer exists are removed and images indexed before perceptual hashes were
+        recorded get one. Meant to be run once when the index is opened, possibly in
+        the background while images are uploaded and deleted: files added or
+        removed since the directory was listed are left to those requests.
+
+        Parameters:
+            directory (str): The image directory.
+            ignored (tuple): Filenames which are not images.
+        """
+        files = {entry.name: entry.path for entry in os.scandir(directory)
+                 if entry.is_file() and entry.name not in ignored}
+        indexed = {row['filename'] for row in self._connection().execute(
+            'SELECT filename FROM images')}
+        for filename in indexed - files.keys():
+            if not os.path.exists(os.path.join(directory, filename)):
+                self.remove(filename)
+        for filename in files.keys() - indexed:
+            if self.get(filename) is not None:
+                continue
+            try:
+                modified = datetime.utcfromtimestamp(os.path.getmtime(files[filename]))
+                self.add(filename, files[filename], uploaded_at=modified)
+            except FileNotFoundError:
+                pass
+        connection = self._connection()
+        unhashed = [row['filename'] for row in connection.execute(
+            'SELECT filename FROM images WHERE phash IS NULL AND format IS NOT NULL')]
+        with connection:
+            for filename in unhashed:
+                try:
+                    phash = read_image_metadata(files[filename])['phash']
+                except (KeyError, FileNotFoundError):
+                    continue
+                connection.execute('UPDATE images SET phash = ? WHERE filename = ?',
+                                   (phash, filename))
+            if unhashed:
+                self._count_change(connection)
+
+    def search(self, prefix=None, tags=(), min_width=None, max_width=None,
+               min_height=None, max_height=None, limit=SEARCH_LIMIT):
+        """Returns the images matching every specified criterion, sorted by filename.
+
+        Parameters:
+            prefix (str): The filenames must start with this prefix.
+            tags (iterable): The images must have all of these tags.
+            min_width (int): The minimum width, in pixels.
+            max_width (int): The maximum width, in pixels.
+            min_height (int): The minimum height, in pixels.
+            max_height (int): The maximum height, in pixels.
+            limit (int): The maximum number of images returned.
+
+        Returns:
+            list: A dict of metadata per image, including a list of its tags.
+        """
+        conditions = []
+        parameters = []
+        if prefix:
+            # A range on the primary key, unlike LIKE, is answered from its index
+            conditions.append('filename >= ? AND filename < ?')
+            parameters += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+        tags = list(tags)
+        if tags:
+            conditions.append(
+                'filename IN (SELECT filename FROM image_tags WHERE tag IN '
+                f'({", ".join("?" * len(tags))}) GROUP BY filename HAVING COUNT(*) = ?)')
+            parameters += tags + [len(tags)]
+        for column, operator, value in (('width', '>=', min_width), ('width', '<=', max_width),
+                                        ('height', '>=', min_height), ('height', '<=', max_height)):
+            if value is not None:
+                conditions.append(f'{column} {operator} ?')
+                parameters.append(value)
+        query = (f'SELECT {", ".join(COLUMNS)}, '
+                 '(SELECT group_concat(tag, char(0)) FROM image_tags t '
+                 'WHERE t.filename = images.filename) AS tags FROM images')
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY filename LIMIT ?'
+        parameters.append(limit)
+        results = []
+        for row in self._connection().execute(query, parameters):
+            result = {column: row[column] for column in COLUMNS}
+            result['tags'] = sorted(row['tags'].split('\0')) if row['tags'] else []
+            results.append(result)
+        return results
@@ -0,0 +1,186 @@
+"""Resized variants of uploaded stimulus images.
+
+Variants are stored in a content addressed cache: the variants of an image are
+kept in a directory named after the SHA-256 hash of the original file, along with
+a manifest describing the dimensions of the original and of each variant. Since
+the content of a cached file never changes, the cache can be served by nginx with
+long expiry times. A small pointer file maps each uploaded filename to its hash.
+
+This module also produces display copies of stimuli, pre-scaled to the native
+resolution of a rig's screens, so the Pis don't rescale full size uploads every
+time a stimulus is displayed.
+"""
+
+import hashlib
+import json
+import os
+
+from PIL import Image
+
+VARIANT_SIZES = {'thumbnail': 256, 'preview': 1024}
+VARIANT_FORMAT = 'WEBP'
+VARIANT_EXTENSION = 'webp'
+MANIFEST_NAME = 'manifest.json'
+NAMES_FOLDER = 'names'
+# Save options favouring decoding speed on the Pis, by format of the original
+DISPLAY_SAVE_OPTIONS = {
+    'JPEG': {'quality': 90, 'progressive': False, 'optimize': False, 'subsampling': 2},
+    'PNG': {'compress_level': 1},
+}
+
+
+def content_hash(path):
+    """Returns the SHA-256 hex digest of a file, read in chunks.
+
+    Parameters:
+        path (str): The path of the file to hash.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_atomically(path, write):
+    temporary_path = path + '.tmp'
+    write(temporary_path)
+    os.replace(temporary_path, path)
+
+
+def _write_json(path, data):
+    def write(temporary_path):
+        with open(temporary_path, 'w') as destination:
+            json.dump(data, destination)
+    _write_atomically(path, write)
+
+
+def generate_variants(source_path, cache_directory, filename, sizes=None):
+    """Generates the resized variants of an image and records them under its filename.
+
+    Variants are only generated once per distinct file content.
+
+    Parameters:
+        source_path (str): The path of the uploaded image.
+        cache_directory (str): The root directory of the variant cache.
+        filename (str): The name the image was uploaded as.
+        sizes (dict): Maps each variant name to the maximum width and height of
+            the variant, VARIANT_SIZES by default.
+
+    Returns:
+        dict: The manifest of the image, or None if the file is not an image
+        Pillow can read, such as an SVG.
+    """
+    sizes = VARIANT_SIZES if sizes is None else sizes
+    digest = content_hash(source_path)
+    relative_directory = os.path.join(digest[:2], digest)
+    directory = os.path.join(cache_directory, relative_directory)
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        manifest = read_json(manifest_path)
+    else:
+        try:
+            manifest = _render_variants(source_path, directory, relative_directory, sizes)
+        except OSError:
+            return None
+        manifest['hash'] = digest
+        _write_json(manifest_path, manifest)
+    names_directory = os.path.join(cache_directory, NAMES_FOLDER)
+    os.makedirs(names_directory, exist_ok=True)
+    _write_json(os.path.join(names_directory, filename + '.json'), {'hash': digest})
+    return manifest
+
+
+def _render_variants(source_path, directory, relative_directory, sizes):
+    os.makedirs(directory, exist_ok=True)
+    with Image.open(source_path) as image:
+        manifest = {'width': image.width, 'height': image.height,
+                    'format': image.format, 'variants': {}}
+        image.load()
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        for name, size in sizes.items():
+            variant = image.copy()
+            variant.thumbnail((size, size))
+            variant_name = f'{name}.{VARIANT_EXTENSION}'
+            _write_atomically(os.path.join(directory, variant_name),
+                              lambda path, variant=variant: variant.save(path, VARIANT_FORMAT))
+            manifest['variants'][name] = {
+                'path': os.path.join(relative_directory, variant_name).replace(os.sep, '/'),
+                'width': variant.width,
+                'height': variant.height,
+            }
+    return manifest
+
+
+def read_json(path):
+    """Returns the decoded content of a JSON file."""
+    with open(path) as source:
+        return json.load(source)
+
+
+def find_manifest(cache_directory, filename):
+    """Returns the manifest of an uploaded image, or None if it has no variants yet.
+
+    Parameters:
+        cache_directory (str): The root directory of the variant cache.
+        filename (str): The name the image was uploaded as.
+    """
+    try:
+        pointer = read_json(os.path.join(cache_directory, NAMES_FOLDER, filename + '.json'))
+        digest = pointer['hash']
+        return read_json(os.path.join(cache_directory, digest[:2], digest, MANIFEST_NAME))
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def forget_variants(cache_directory, filename):
+    """Removes the mapping from a deleted image's filename to its variants.
+
+    The variants themselves are kept, since other uploads may share the same content.
+
+    Parameters:
+        cache_directory (str): The root directory of the variant cache.
+        filename (str): The name the image was uploaded as.
+    """
+    try:
+        os.remove(os.path.join(cache_directory, NAMES_FOLDER, filename + '.json'))
+    except FileNotFoundError:
+        pass
+
+
+def normalize_for_display(source_path, destination_path, resolution):
+    """Writes a copy of an image scaled down to fit within a screen resolution.
+
+    feh -F shrinks images larger than the screen every time they are displayed.
+    The copy is already the size feh would display it at, and is saved in the
+    format of the original with options favouring decoding speed, so it can be
+    shipped under the original filename.
+
+    Parameters:
+        source_path (str): The path of the uploaded image.
+        destination_path (str): The path the display copy should be written to.
+        resolution (tuple): The width and height of the screens, in pixels.
+
+    Returns:
+        bool: True if a display copy was written. False if the original is not
+        a JPEG or PNG image, or already fits on the screen, in which case the
+        original should be displayed as is.
+    """
+    try:
+        with Image.open(source_path) as image:
+            if image.format not in DISPLAY_SAVE_OPTIONS:
+                return False
+            if image.width <= resolution[0] and image.height <= resolution[1]:
+                return False
+            image_format = image.format
+            image.load()
+            if image_format == 'JPEG' and image.mode != 'RGB':
+                image = image.convert('RGB')
+            image.thumbnail(tuple(resolution), Image.LANCZOS)
+            os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+            _write_atomically(destination_path, lambda path: image.save(
+                path, image_format, **DISPLAY_SAVE_OPTIONS[image_format]))
+    except OSError:
+        return False
+    return True
@@ -0,0 +1,237 @@
+"""Trial level analytics across experiment logs.
+
+Experiment logs are ingested into an embedded SQLite database holding one row
+per trial: the side the correct stimulus was displayed on, the side picked and
+the reaction time. Ingestion is incremental: a log is only parsed again when its
+size or modification time changed, so keeping the table up to date costs one
+directory scan. Aggregations over the whole history are then answered by SQLite
+from an index on experiment and day, without reading any log.
+
+Trials are recognized from the messages logged by experiments such as
+example_experiment.py::
+
+    Trial 3 correct stimuli displayed on left
+    Trial 3 picked right
+    Trial 3 no selection made.
+"""
+
+from datetime import datetime
+import csv
+import os
+import re
+import sqlite3
+import threading
+
+from .log_archive import log_name, open_log
+from .retention import ARCHIVE_FOLDER
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS log_files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS trials (
+    log TEXT NOT NULL,
+    experiment TEXT NOT NULL,
+    trial INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    displayed_at TEXT NOT NULL,
+    correct_side TEXT NOT NULL,
+    picked_side TEXT,
+    correct INTEGER,
+    reaction_ms REAL,
+    PRIMARY KEY (log, trial)
+);
+CREATE INDEX IF NOT EXISTS trials_experiment_day ON trials (experiment, day);
+'''
+
+LOG_NAME_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2} [\d:.]+) (.+)\.csv$')
+DISPLAYED_PATTERN = re.compile(r'^Trial (\d+) correct stimuli displayed on (\w+)$')
+PICKED_PATTERN = re.compile(r'^Trial (\d+) picked (\w+)$')
+NO_SELECTION_PATTERN = re.compile(r'^Trial (\d+) no selection made\.?$')
+TIMESTAMP_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S')
+
+
+def parse_timestamp(value):
+    """Returns the datetime of a log timestamp, with or without microseconds.
+
+    Raises:
+        ValueError: If the value isn't a log timestamp.
+    """
+    for timestamp_format in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(value, timestamp_format)
+        except ValueError:
+            pass
+    raise ValueError(f'Invalid timestamp {value}')
+
+
+def parse_trials(log, experiment, rows):
+    """Returns the trials recorded in the rows of an experiment log.
+
+    Rows which aren't trial events, and trials which never had their correct
+    stimulus displayed, are ignored. Reaction times are computed from the
+    monotonic times of the rows, or from their wall clock times in older logs.
+
+    Parameters:
+        log (str): The name of the log.
+        experiment (str): The filename of the experiment which wrote the log.
+        rows (iterable): The rows of the log, as lists of strings.
+
+    Returns:
+        list: A dict per trial, keyed by trials column.
+    """
+    trials = {}
+    for row in rows:
+        if len(row) < 2:
+            continue
+        try:
+            timestamp = parse_timestamp(row[0])
+            # Logs written since monotonic times were recorded have them in a third column
+            event_time = float(row[2]) if len(row) > 2 and row[2] else timestamp.timestamp()
+        except ValueError:
+            continue
+        message = row[1]
+        match = DISPLAYED_PATTERN.match(message)
+        if match:
+            trials[int(match.group(1))] = {
+                'log': log, 'experiment': experiment, 'trial': int(match.group(1)),
+                'day': timestamp.date().isoformat(), 'displayed_at': str(timestamp),
+                'correct_side': match.group(2), 'picked_side': None, 'correct': None,
+                'reaction_ms': None, '_displayed': event_time,
+            }
+            continue
+        match = PICKED_PATTERN.match(message) or NO_SELECTION_PATTERN.match(message)
+        trial = trials.get(int(match.group(1))) if match else None
+        # Only the first response after the stimulus was displayed counts
+        if trial is None or trial['correct'] is not None:
+            continue
+        if match.re is PICKED_PATTERN:
+            trial['picked_side'] = match.group(2)
+            trial['correct'] = int(match.group(2) == trial['correct_side'])
+            trial['reaction_ms'] = (event_time - trial['_displayed']) * 1000
+        else:
+            trial['correct'] = 0
+    for trial in trials.values():
+        del trial['_displayed']
+    return [trials[number] for number in sorted(trials)]
+
+
+class LogAnalytics:
+    """SQLite backed table of the trials recorded in experiment logs.
+
+    Each thread uses its own connection to the database.
+
+    Parameters:
+        path (str): The path of the database file, created if it doesn't exist.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._ingest_lock = threading.Lock()
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript(SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path)
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+        return connection
+
+    def ingest(self, directory, active=()):
+        """Brings the trials table up to date with the logs of a directory.
+
+        Logs in the archive subdirectory are included. New and modified logs are
+        parsed, and the trials of logs which no longer exist are removed.
+
+        Parameters:
+            directory (str): The log directory.
+            active (iterable): Names of logs still being written, which are skipped.
+
+        Returns:
+            int: The number of logs parsed.
+        """
+        active = set(active)
+        files = {}
+        for scanned in (directory, os.path.join(directory, ARCHIVE_FOLDER)):
+            try:
+                entries = list(os.scandir(scanned))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                name = log_name(entry.name)
+                if LOG_NAME_PATTERN.match(name) and name not in active and entry.is_file():
+                    stat = entry.stat()
+                    files[entry.path] = (stat.st_size, stat.st_mtime)
+        with self._ingest_lock:
+            connection = self._connection()
+            known = {row['path']: (row['size'], row['mtime'])
+                     for row in connection.execute('SELECT path, size, mtime FROM log_files')}
+            parsed = 0
+            for path in known.keys() - files.keys():
+                with connection:
+                    self._forget(connection, path)
+            for path, signature in files.items():
+                if known.get(path) != signature:
+                    self._ingest_file(connection, path, signature)
+                    parsed += 1
+        return parsed
+
+    @staticmethod
+    def _forget(connection, path):
+        connection.execute('DELETE FROM log_files WHERE path = ?', (path,))
+        connection.execute('DELETE FROM trials WHERE log = ?', (log_name(os.path.basename(path)),))
+
+    def _ingest_file(self, connection, path, signature):
+        name = log_name(os.path.basename(path))
+        experiment = LOG_NAME_PATTERN.match(name).group(2)
+        try:
+            with open_log(path) as log:
+                trials = parse_trials(name, experiment, csv.reader(log))
+        except (OSError, EOFError, csv.Error):
+            # Compressed or removed while being read, picked up again by the next ingestion
+            return
+        with connection:
+            self._forget(connection, path)
+            connection.executemany(
+                'INSERT OR REPLACE INTO trials VALUES (:log, :experiment, :trial, :day, '
+                ':displayed_at, :correct_side, :picked_side, :correct, :reaction_ms)', trials)
+            connection.execute('INSERT INTO log_files VALUES (?, ?, ?)', (path,) + signature)
+
+    def accuracy(self, experiment=None, since=None, until=None):
+        """Returns the accuracy of the trials of each day.
+
+        Parameters:
+            experiment (str): Only include the trials of this experiment.
+            since (str): Only include trials from this YYYY-MM-DD day, in UTC, onwards.
+            until (str): Only include trials up to this YYYY-MM-DD day, included.
+
+        Returns:
+            list: A dict per day, oldest first, with the number of trials, the
+            number of correct trials, the accuracy, the number of trials without
+            a selection and the mean reaction time of the selections.
+        """
+        conditions = []
+        parameters = []
+        for column, operator, value in (('experiment', '=', experiment), ('day', '>=', since),
+                                        ('day', '<=', until)):
+            if value is not None:
+                conditions.append(f'{column} {operator} ?')
+                parameters.append(value)
+        query = ('SELECT day, COUNT(*) AS trials, SUM(correct) AS correct, '
+                 'SUM(picked_side IS NULL) AS no_selection, AVG(reaction_ms) AS mean_reaction_ms '
+                 'FROM trials WHERE correct IS NOT NULL')
+        if conditions:
+            query += ' AND ' + ' AND '.join(conditions)
+        query += ' GROUP BY day ORDER BY day'
+        results = []
+        for row in self._connection().execute(query, parameters):
+            result = dict(row)
+            result['accuracy'] = row['correct'] / row['trials']
+            results.append(result)
+        return results
@@ -0,0 +1,164 @@
+"""Compression of finished experiment logs.
+
+Experiment logs are quoted CSV text, which gzip shrinks by an order of
+magnitude. Once an experiment is finished its log is replaced by a gzipped copy
+named after it, with a .gz suffix. Logs keep being identified by their original
+name: the functions here find either form of a log, so clients never see the
+suffix, and compressed logs can be served as is with a gzip Content-Encoding.
+
+Several logs can be exported as a zip built on the fly: stream_zip yields the
+bytes of the archive as each chunk of a log is compressed, so memory use
+doesn't grow with the size of the export and the first bytes are ready at once.
+"""
+
+import gzip
+import io
+import os
+import shutil
+import time
+import zipfile
+
+COMPRESSED_SUFFIX = '.gz'
+CHUNK_SIZE = 64 * 1024
+
+
+def compress_log(path):
+    """Replaces a log file by a gzipped copy, keeping its modification time.
+
+    Parameters:
+        path (str): The path of the log file.
+
+    Returns:
+        str: The path of the compressed log, or None if there was no log to compress.
+    """
+    compressed_path = path + COMPRESSED_SUFFIX
+    temporary_path = compressed_path + '.tmp'
+    try:
+        with open(path, 'rb') as source, gzip.open(temporary_path, 'wb') as destination:
+            shutil.copyfileobj(source, destination)
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    os.utime(temporary_path, (stat.st_atime, stat.st_mtime))
+    os.replace(temporary_path, compressed_path)
+    os.remove(path)
+    return compressed_path
+
+
+def decompress_log(path):
+    """Replaces a gzipped log by its decompressed content, so it can be appended to again.
+
+    Parameters:
+        path (str): The path of the compressed log, ending with .gz.
+
+    Returns:
+        str: The path of the decompressed log.
+    """
+    decompressed_path = path[:-len(COMPRESSED_SUFFIX)]
+    temporary_path = decompressed_path + '.tmp'
+    with gzip.open(path, 'rb') as source, open(temporary_path, 'wb') as destination:
+        shutil.copyfileobj(source, destination)
+    stat = os.stat(path)
+    os.utime(temporary_path, (stat.st_atime, stat.st_mtime))
+    os.replace(temporary_path, decompressed_path)
+    os.remove(path)
+    return decompressed_path
+
+
+def log_name(filename):
+    """Returns the name of a log from the name of its file, compressed or not."""
+    if filename.endswith(COMPRESSED_SUFFIX):
+        return filename[:-len(COMPRESSED_SUFFIX)]
+    return filename
+
+
+def find_log(directory, name):
+    """Returns the path of the file holding a log, preferring the uncompressed file.
+
+    Parameters:
+        directory (str): The log directory.
+        name (str): The name of the log, without any .gz suffix.
+
+    Returns:
+        str: The path of the log file, ending with .gz if it is compressed, or
+        None if the log doesn't exist.
+    """
+    for path in (os.path.join(directory, name), os.path.join(directory, name + COMPRESSED_SUFFIX)):
+        if os.path.lexists(path):
+            return path
+    return None
+
+
+def open_log(path):
+    """Opens a log file for reading as text, decompressing it if needed.
+
+    Parameters:
+        path (str): The path of the log file, as returned by find_log.
+
+    Returns:
+        file: The log, opened in text mode with universal newlines disabled as
+        expected by the csv module.
+    """
+    if path.endswith(COMPRESSED_SUFFIX):
+        return gzip.open(path, 'rt', newline='')
+    return io.open(path, 'r', newline='')
+
+
+class _ChunkWriter:
+    """Unseekable file collecting the bytes written by a ZipFile until they are taken."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        """Does nothing, bytes are kept until taken."""
+
+    def take(self):
+        """Returns and forgets the bytes written since the last call."""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(logs, chunk_size=CHUNK_SIZE):
+    """Yields the bytes of a zip of logs, as it is built.
+
+    Compressed logs are stored decompressed, under their name without the .gz
+    suffix. Only one chunk of a log is held in memory at a time.
+
+    Parameters:
+        logs (iterable): (name, path) tuples, with the name of each log in the
+            archive and the path of its file as returned by find_log. Logs
+            whose path is None or whose file no longer exists are skipped.
+        chunk_size (int): The number of bytes of a log read at once.
+
+    Yields:
+        bytes: The next part of the archive.
+    """
+    writer = _ChunkWriter()
+    with zipfile.ZipFile(writer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, path in logs:
+            if path is None:
+                continue
+            opener = gzip.open if path.endswith(COMPRESSED_SUFFIX) else io.open
+            try:
+                log = opener(path, 'rb')
+            except FileNotFoundError:
+                continue
+            info = zipfile.ZipInfo(name, time.localtime(os.fstat(log.fileno()).st_mtime)[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with log, archive.open(info, 'w') as entry:
+                for chunk in iter(lambda: log.read(chunk_size), b''):
+                    entry.write(chunk)
+                    # The compressor buffers its output, it isn't flushed after every chunk
+                    data = writer.take()
+                    if data:
+                        yield data
+            # Closing the entry writes the rest of its data and its descriptor
+            yield writer.take()
+    # Closing the archive writes its central directory
+    yield writer.take()
@@ -0,0 +1,106 @@
+"""Perceptual hashing of images for near-duplicate detection.
+
+Images are hashed with a difference hash: a 64 bit value which changes little when
+an image is resized, recompressed or slightly edited. Near-duplicates are found
+by Hamming distance between hashes, using a BK-tree so lookups only visit a small
+part of the indexed hashes.
+"""
+
+from PIL import Image
+
+HASH_SIZE = 8
+
+
+def difference_hash(image):
+    """Returns the 64 bit difference hash of an image.
+
+    The image is reduced to a 9x8 grayscale thumbnail, each bit of the hash tells
+    whether a pixel is brighter than its right neighbour.
+
+    Parameters:
+        image (Image): An open Pillow image.
+
+    Returns:
+        int: The hash.
+    """
+    pixels = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS).tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for column in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + column] > pixels[offset + column + 1])
+    return value
+
+
+def hamming_distance(first, second):
+    """Returns the number of bits which differ between two hashes."""
+    return bin(first ^ second).count('1')
+
+
+class BKTree:
+    """Metric tree of hashes supporting searches by maximum Hamming distance.
+
+    Each node holds a hash, the items added with that hash, and its children
+    keyed by their distance to the node's hash. Removing an item leaves its
+    node in place, possibly without items, to route searches to its children.
+    """
+
+    def __init__(self):
+        self._root = None
+
+    def _node(self, value):
+        """Returns the node holding a hash, None if it isn't in the tree."""
+        node = self._root
+        while node is not None:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                return node
+            node = node[2].get(distance)
+        return None
+
+    def add(self, value, item):
+        """Adds an item with the specified hash to the tree, unless it is already there."""
+        if self._root is None:
+            self._root = (value, [item], {})
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                if item not in node[1]:
+                    node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, [item], {})
+                return
+            node = child
+
+    def remove(self, value, item):
+        """Removes an item added with the specified hash, if it is in the tree."""
+        node = self._node(value)
+        if node is not None and item in node[1]:
+            node[1].remove(item)
+
+    def search(self, value, max_distance):
+        """Returns the items whose hash is within *max_distance* of *value*.
+
+        Parameters:
+            value (int): The hash to search for.
+            max_distance (int): The maximum Hamming distance of the results.
+
+        Returns:
+            list: (distance, item) tuples, closest first.
+        """
+        results = []
+        nodes = [self._root] if self._root is not None else []
+        while nodes:
+            node_value, items, children = nodes.pop()
+            distance = hamming_distance(value, node_value)
+            if distance <= max_distance:
+                results.extend((distance, item) for item in items)
+            # By the triangle inequality, matches can only be in these subtrees
+            nodes.extend(child for child_distance, child in children.items()
+                         if distance - max_distance <= child_distance <= distance + max_distance)
+        results.sort()
+        return results
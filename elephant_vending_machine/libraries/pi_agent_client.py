@@ -0,0 +1,150 @@
+"""Client for the resident agent running on each Raspberry Pi.
+
+This module keeps a persistent TCP connection to the agent started by pi_agent.py
+on a Pi, sending newline delimited JSON commands and reading their acknowledgements.
+"""
+
+import json
+import logging
+import socket
+import threading
+
+AGENT_PORT = 8765
+AGENT_TIMEOUT = 1.0
+
+LOGGER = logging.getLogger(__name__)
+
+
+class AgentError(Exception):
+    """Raised when the agent acknowledges a command with an error status."""
+
+
+class AgentClient:
+    """Sends commands to the agent on a single Pi over a persistent connection.
+
+    The connection is opened on the first command, and reopened if it was dropped
+    since the previous command, such as by a restart of the agent. A command is
+    sent again only if it couldn't be sent: once it was written, the agent may
+    have applied it, so a missing acknowledgement is raised rather than retried.
+
+    Parameters:
+        address (str): The local IP address of the Pi running the agent.
+        port (int): The port the agent listens on.
+        timeout (float): The number of seconds to wait when connecting or for an
+            acknowledgement before raising an OSError.
+    """
+
+    def __init__(self, address, port=AGENT_PORT, timeout=AGENT_TIMEOUT):
+        self.address = address
+        self.port = port
+        self.timeout = timeout
+        self._socket = None
+        self._reader = None
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._socket = socket.create_connection((self.address, self.port), self.timeout)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._socket.makefile('rb')
+
+    def close(self):
+        """Closes the connection to the agent, if open."""
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._socket is not None:
+            self._reader.close()
+            self._socket.close()
+        self._socket = None
+        self._reader = None
+
+    def _closed_by_agent(self):
+        """Returns whether the agent closed the connection, without waiting for data."""
+        self._socket.setblocking(False)
+        try:
+            return self._socket.recv(1, socket.MSG_PEEK) == b''
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+        finally:
+            self._socket.settimeout(self.timeout)
+
+    def _write(self, request):
+        if self._socket is not None and self._closed_by_agent():
+            self._close()
+        if self._socket is None:
+            self._connect()
+        self._socket.sendall(json.dumps(request).encode() + b'\n')
+
+    def _read(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionResetError('Connection closed by agent')
+        return json.loads(line)
+
+    def send(self, command, **arguments):
+        """Sends a command to the agent and waits for its acknowledgement.
+
+        Parameters:
+            command (str): The name of the command, see pi_agent.py.
+            **arguments: The arguments of the command.
+
+        Returns:
+            dict: The acknowledgement sent by the agent.
+
+        Raises:
+            OSError: If the agent could not be reached.
+            AgentError: If the agent could not apply the command.
+        """
+        with self._lock:
+            self._next_id += 1
+            request = dict(arguments, id=self._next_id, command=command)
+            try:
+                self._write(request)
+            except OSError:
+                # The command wasn't sent, so it can be sent again on a new connection
+                self._close()
+                try:
+                    self._write(request)
+                except OSError:
+                    self._close()
+                    raise
+            try:
+                response = self._read()
+            except OSError:
+                self._close()
+                raise
+        if response.get('status') != 'ok':
+            raise AgentError(response.get('message', 'Unknown error'))
+        return response
+
+    def set_color(self, red, green, blue, display_time):
+        """Displays a color on the LED strip for *display_time* milliseconds."""
+        return self.send('color', red=red, green=green, blue=blue, duration=display_time)
+
+    def show_pattern(self, name, red, green, blue, display_time):
+        """Displays a named pattern on the LED strip for *display_time* milliseconds."""
+        return self.send('pattern', name=name, red=red, green=green, blue=blue,
+                         duration=display_time)
+
+    def display(self, path):
+        """Displays an image on the Pi's screen.
+
+        The agent acknowledges once the viewer was spawned. Viewers of previous
+        images which exited right away, leaving the image before them displayed,
+        are reported with the acknowledgement and logged as warnings.
+
+        Returns:
+            float: The time the image viewer was started, on the Pi's clock.
+        """
+        response = self.send('display', path=path)
+        for failure in response.get('failed', []):
+            LOGGER.warning('Pi %s: %s', self.address, failure)
+        return response['displayed']
+
+    def display_failures(self):
+        """Returns the viewer failures the agent didn't report yet, as messages."""
+        return self.send('display_status')['failed']
@@ -0,0 +1,209 @@
+"""On-demand profiling of experiment runs and requests.
+
+A Profiler records where the thread which started it spends its time, with one
+of two modes:
+
+* sampling: a background thread records the call stack of the profiled thread
+  every few milliseconds. Time spent waiting, on an SSH command or between two
+  sensor samples, shows up as much as time spent computing, and the overhead
+  doesn't depend on the number of calls. The stacks are saved in the folded
+  format read by flamegraph.pl, speedscope and most flame graph tools, one
+  line per distinct stack with the number of samples it was seen in::
+
+      run_experiment (example_experiment.py:5);wait_for_input (vending_machine.py:196) 812
+
+* cprofile: cProfile records every call, saved as pstats data for pstats,
+  snakeviz or flameprof.
+
+Either way, tracemalloc snapshots taken when profiling starts and stops are
+compared, and the lines which allocated the most memory in between are saved
+as text, with the peak memory traced. tracemalloc is shared by the whole
+process, so profilers running at the same time, such as a profiled request
+during a profiled run, share its tracing: it is started by the first of them
+and only stopped once the last one stops, unless something else started it.
+"""
+
+import cProfile
+import os
+import sys
+import threading
+import tracemalloc
+
+SAMPLING = 'sampling'
+CPROFILE = 'cprofile'
+MODES = (SAMPLING, CPROFILE)
+SAMPLE_INTERVAL = 0.005
+MEMORY_FRAMES = 5
+MEMORY_TOP = 30
+SUFFIXES = {'folded': '.folded', 'prof': '.prof', 'memory': '.memory.txt'}
+
+_TRACING_LOCK = threading.Lock()
+_tracing_users = 0
+_started_tracing = False
+
+
+def frame_name(code):
+    """Returns the name of a function in a folded stack, with its file and first line."""
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def _start_tracing():
+    """Registers a user of tracemalloc, starting it if nothing is tracing yet."""
+    global _tracing_users, _started_tracing  # pylint: disable=global-statement
+    with _TRACING_LOCK:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(MEMORY_FRAMES)
+            _started_tracing = True
+        _tracing_users += 1
+
+
+def _stop_tracing():
+    """Unregisters a user of tracemalloc, stopping it after the last one if profiling started it."""
+    global _tracing_users, _started_tracing  # pylint: disable=global-statement
+    with _TRACING_LOCK:
+        _tracing_users -= 1
+        if _tracing_users == 0 and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+
+class Profiler:
+    """Profiles the thread which starts it, until it is stopped.
+
+    Usage::
+
+        with Profiler(SAMPLING) as profiler:
+            run_experiment(experiment_logger, vending_machine)
+        profiler.save(path)
+
+    Parameters:
+        mode (str): SAMPLING or CPROFILE.
+        interval (float): The number of seconds between samples, in SAMPLING mode.
+        memory (bool): Whether to trace memory allocations with tracemalloc.
+
+    Raises:
+        ValueError: If the mode is unknown.
+    """
+
+    def __init__(self, mode=SAMPLING, interval=SAMPLE_INTERVAL, memory=True):
+        if mode not in MODES:
+            raise ValueError(f'Unknown profiling mode {mode}, expected one of {", ".join(MODES)}')
+        self.mode = mode
+        self.interval = interval
+        self.memory = memory
+        self.stacks = {}
+        self.samples = 0
+        self._profile = None
+        self._sampler = None
+        self._stop = threading.Event()
+        self._tracing = False
+        self._snapshots = []
+        self._peak = None
+
+    def start(self):
+        """Starts profiling the calling thread.
+
+        Raises:
+            ValueError: If another cProfile profiler is already running, on Python
+                versions which allow only one at a time.
+        """
+        if self.memory:
+            _start_tracing()
+            self._tracing = True
+            self._snapshots = [tracemalloc.take_snapshot()]
+        if self.mode == CPROFILE:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                self.stop()
+                raise
+            self._profile = profile
+        else:
+            self._stop.clear()
+            self._sampler = threading.Thread(target=self._sample, args=(threading.get_ident(),),
+                                             name='profiler', daemon=True)
+            self._sampler.start()
+
+    def _sample(self, thread_id):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)  # pylint: disable=protected-access
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            folded = ';'.join(reversed(stack))
+            self.stacks[folded] = self.stacks.get(folded, 0) + 1
+            self.samples += 1
+
+    def stop(self):
+        """Stops profiling, taking the last memory snapshot."""
+        if self._profile is not None:
+            self._profile.disable()
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+        if self._tracing:
+            self._tracing = False
+            try:
+                # Tracing may have been stopped by code other than the profilers
+                if tracemalloc.is_tracing():
+                    self._snapshots.append(tracemalloc.take_snapshot())
+                    self._peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                _stop_tracing()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def folded(self):
+        """Returns the sampled stacks in the folded format, most frequent first."""
+        return ''.join(f'{stack} {count}\n' for stack, count in
+                       sorted(self.stacks.items(), key=lambda item: -item[1]))
+
+    def memory_report(self):
+        """Returns the lines which allocated the most memory while profiling, as text."""
+        if len(self._snapshots) < 2:
+            return ''
+        first, last = self._snapshots
+        # Allocations of tracemalloc itself are left out
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        differences = last.filter_traces(filters).compare_to(
+            first.filter_traces(filters), 'lineno')
+        lines = [f'Peak traced memory: {self._peak / 1024:.1f} KiB',
+                 f'Top {MEMORY_TOP} allocations since profiling started:']
+        lines.extend(str(difference) for difference in differences[:MEMORY_TOP])
+        return '\n'.join(lines) + '\n'
+
+    def save(self, prefix):
+        """Saves the results of the profile to files named after a prefix.
+
+        Sampled stacks are saved to prefix.folded, cProfile statistics to
+        prefix.prof and the memory report to prefix.memory.txt.
+
+        Parameters:
+            prefix (str): The path of the files, without their suffix.
+
+        Returns:
+            list: The paths of the saved files.
+        """
+        paths = []
+        if self.mode == CPROFILE:
+            self._profile.dump_stats(prefix + SUFFIXES['prof'])
+            paths.append(prefix + SUFFIXES['prof'])
+        else:
+            with open(prefix + SUFFIXES['folded'], 'w') as folded_file:
+                folded_file.write(self.folded())
+            paths.append(prefix + SUFFIXES['folded'])
+        if self.memory:
+            with open(prefix + SUFFIXES['memory'], 'w') as memory_file:
+                memory_file.write(self.memory_report())
+            paths.append(prefix + SUFFIXES['memory'])
+        return paths
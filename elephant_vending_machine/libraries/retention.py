@@ -0,0 +1,260 @@
+"""Selection, deletion and archiving of old files in the upload and log directories.
+
+Files are selected with a single scan of their directory, by name, glob pattern
+and modification time, so cleaning up many files costs one pass over the
+directory rather than one listing per file.
+
+A retention job applies configured policies in the background. Each policy
+names the directory it applies to, the maximum age of the files it keeps, an
+optional glob pattern and whether older files are removed, archived or
+compressed. Archived files are gzipped into an ``archive`` subdirectory, out of
+the listings. Compressed files are gzipped in place the way finished logs are,
+so the log routes still list, serve and analyse them. Files are matched by their
+name without any .gz suffix, so patterns select logs whether or not they were
+compressed.
+"""
+
+from datetime import datetime
+import fnmatch
+import gzip
+import logging
+import os
+import shutil
+import threading
+import time
+
+from .log_archive import COMPRESSED_SUFFIX, compress_log
+
+ARCHIVE_FOLDER = 'archive'
+ACTIONS = ('archive', 'compress', 'delete')
+DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S')
+IGNORED_FILES = ('.gitignore',)
+
+LOGGER = logging.getLogger(__name__)
+
+
+def parse_date(value):
+    """Returns the timestamp of a date given as YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS, in local time.
+
+    Raises:
+        ValueError: If the date doesn't match any of the accepted formats.
+    """
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).timestamp()
+        except ValueError:
+            pass
+    raise ValueError(f'Invalid date {value}')
+
+
+def select_files(directory, names=None, pattern=None, before=None, ignored=IGNORED_FILES,
+                 suffixes=()):
+    """Returns the files of a directory matching every specified criterion.
+
+    Parameters:
+        directory (str): The directory to scan.
+        names (iterable): The files must have one of these names.
+        pattern (str): The names of the files must match this glob pattern.
+        before (float): The files must have been modified before this timestamp.
+        ignored (tuple): Names of files which are never selected.
+        suffixes (tuple): Suffixes stripped from the names of the files before
+            matching them against names and pattern, such as .gz for compressed logs.
+
+    Returns:
+        list: The os.DirEntry of each selected file, sorted by name.
+    """
+    names = None if names is None else set(names)
+    selected = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name in ignored or not entry.is_file():
+                continue
+            name = entry.name
+            for suffix in suffixes:
+                if name.endswith(suffix):
+                    name = name[:-len(suffix)]
+                    break
+            if names is not None and name not in names:
+                continue
+            if pattern is not None and not fnmatch.fnmatch(name, pattern):
+                continue
+            if before is not None and entry.stat().st_mtime >= before:
+                continue
+            selected.append(entry)
+    selected.sort(key=lambda entry: entry.name)
+    return selected
+
+
+def delete_files(entries, on_delete=None):
+    """Deletes files, continuing past the ones which can't be deleted.
+
+    Parameters:
+        entries (list): The os.DirEntry of each file, as returned by select_files.
+        on_delete (callable): Called with the name of each deleted file, to clean
+            up anything derived from it.
+
+    Returns:
+        tuple: The names of the deleted files and the names of the files which
+        couldn't be deleted.
+    """
+    deleted = []
+    failed = []
+    for entry in entries:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            failed.append(entry.name)
+            continue
+        deleted.append(entry.name)
+        if on_delete is not None:
+            on_delete(entry.name)
+    return deleted, failed
+
+
+def archive_files(entries, on_delete=None):
+    """Moves files to gzipped copies in the archive subdirectory of their directory.
+
+    Files which are already gzipped are moved as is.
+
+    Parameters:
+        entries (list): The os.DirEntry of each file, as returned by select_files.
+        on_delete (callable): Called with the name of each archived file.
+
+    Returns:
+        tuple: The names of the archived files and the names of the files which
+        couldn't be archived.
+    """
+    archived = []
+    failed = []
+    for entry in entries:
+        archive_directory = os.path.join(os.path.dirname(entry.path), ARCHIVE_FOLDER)
+        compressed = entry.name.endswith('.gz')
+        archive_path = os.path.join(archive_directory,
+                                    entry.name if compressed else entry.name + '.gz')
+        temporary_path = archive_path + '.tmp'
+        try:
+            os.makedirs(archive_directory, exist_ok=True)
+            if compressed:
+                os.replace(entry.path, archive_path)
+            else:
+                with open(entry.path, 'rb') as source, gzip.open(temporary_path, 'wb') as archive:
+                    shutil.copyfileobj(source, archive)
+                os.replace(temporary_path, archive_path)
+                os.remove(entry.path)
+        except OSError:
+            failed.append(entry.name)
+            continue
+        archived.append(entry.name)
+        if on_delete is not None:
+            on_delete(entry.name)
+    return archived, failed
+
+
+def compress_files(entries):
+    """Replaces files by gzipped copies in place, as log_archive.compress_log does.
+
+    Files which are already gzipped are left as is.
+
+    Parameters:
+        entries (list): The os.DirEntry of each file, as returned by select_files.
+
+    Returns:
+        tuple: The names of the compressed files and the names of the files which
+        couldn't be compressed.
+    """
+    compressed = []
+    failed = []
+    for entry in entries:
+        if entry.name.endswith(COMPRESSED_SUFFIX):
+            continue
+        try:
+            if compress_log(entry.path) is None:
+                continue
+        except OSError:
+            failed.append(entry.name)
+            continue
+        compressed.append(entry.name)
+    return compressed, failed
+
+
+def apply_policy(directory, policy, on_delete=None, now=None):
+    """Archives, compresses or deletes the files of a directory older than a policy allows.
+
+    Parameters:
+        directory (str): The directory the policy applies to.
+        policy (dict): The policy, with max_age_days and optionally pattern and
+            action, which is 'archive', 'compress' or 'delete' and defaults to 'archive'.
+        on_delete (callable): Called with the name of each file removed from the
+            directory, which compressed files are not.
+        now (float): The current timestamp, time.time() by default.
+
+    Returns:
+        tuple: The names of the files acted on and the names of the files which
+        couldn't be.
+
+    Raises:
+        ValueError: If the action of the policy is unknown.
+    """
+    action = policy.get('action', 'archive')
+    if action not in ACTIONS:
+        raise ValueError(f'Unknown retention action {action}')
+    before = (time.time() if now is None else now) - policy['max_age_days'] * 86400
+    entries = select_files(directory, pattern=policy.get('pattern'), before=before,
+                           suffixes=(COMPRESSED_SUFFIX,))
+    if action == 'archive':
+        return archive_files(entries, on_delete)
+    if action == 'compress':
+        return compress_files(entries)
+    return delete_files(entries, on_delete)
+
+
+class RetentionJob:
+    """Background thread applying retention policies at a regular interval.
+
+    Parameters:
+        targets (list): A (directory, policy, on_delete) tuple per policy, as
+            expected by apply_policy.
+        interval (float): The number of seconds between runs.
+    """
+
+    def __init__(self, targets, interval):
+        self.targets = list(targets)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        """Applies every policy once, logging rather than raising failures.
+
+        Returns:
+            dict: Maps each directory to the names of the files removed from it.
+        """
+        removed = {}
+        for directory, policy, on_delete in self.targets:
+            try:
+                removed[directory], failed = apply_policy(directory, policy, on_delete)
+            except (OSError, ValueError):
+                LOGGER.exception('Retention policy for %s failed', directory)
+                continue
+            if failed:
+                LOGGER.warning('Retention could not remove %s from %s', ', '.join(failed),
+                               directory)
+        return removed
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Starts applying the policies on a daemon thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='retention', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the job and waits for the current run to finish."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,200 @@
+"""Registry of the vending machine rigs driven by this server.
+
+A rig is one enclosure with its own three Raspberry Pis, Maestro serial port and
+configuration. Each rig runs at most one experiment at a time on its own thread,
+so experiments on different rigs run in parallel without sharing hardware.
+
+Server workers each have their own registry, so a rig given a lock file also
+holds an exclusive flock on it while it runs. A worker can then neither start
+an experiment on a rig running one in another worker nor report it idle. The
+lock file holds the name of the log of the running experiment.
+"""
+
+import fcntl
+import os
+import threading
+
+DEFAULT_RIG = 'default'
+
+
+class RigBusyError(Exception):
+    """Raised when starting an experiment on a rig which is already running one."""
+
+
+class Rig:
+    """A single vending machine and the experiment currently running on it.
+
+    Parameters:
+        name (str): The name identifying the rig.
+        hosts (list): The local IP addresses of the left, middle and right Pis.
+        config (dict): Configuration values passed to the rig's VendingMachine,
+            such as MAESTRO_PORT or SENSOR_THRESHOLD.
+        lock_path (str): The lock file shared with the other workers, created
+            with its directory if needed. Runs are only isolated within this
+            process if None.
+    """
+
+    def __init__(self, name, hosts, config=None, lock_path=None):
+        self.name = name
+        self.hosts = list(hosts)
+        self.config = dict(config) if config else {}
+        self.lock_path = lock_path
+        self.log_file = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._lock_file = None
+
+    @property
+    def busy(self):
+        """bool: Whether an experiment is currently running on the rig, in any worker."""
+        return self._running_here() or self._running_elsewhere() is not None
+
+    @property
+    def current_log_file(self):
+        """str: The log file of the experiment running on the rig in any worker, if any."""
+        if self._running_here():
+            return self.log_file
+        return self._running_elsewhere() or None
+
+    def _running_here(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _running_elsewhere(self):
+        """Returns the content of the lock file if another process holds it, None otherwise."""
+        if self.lock_path is None or self._lock_file is not None:
+            return None
+        try:
+            lock_file = open(self.lock_path)
+        except FileNotFoundError:
+            return None
+        with lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return lock_file.read()
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            return None
+
+    def _acquire(self, log_file):
+        """Takes the lock file, returning False if another process holds it."""
+        if self.lock_path is None:
+            return True
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        lock_file = open(self.lock_path, 'a+')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        lock_file.truncate(0)
+        lock_file.write(log_file or '')
+        lock_file.flush()
+        self._lock_file = lock_file
+        return True
+
+    def _release(self):
+        if self._lock_file is not None:
+            self._lock_file.truncate(0)
+            # Closing the file releases the lock
+            self._lock_file.close()
+            self._lock_file = None
+
+    def vending_machine_config(self):
+        """Returns a copy of the rig config, for a new VendingMachine to fill in defaults."""
+        return dict(self.config)
+
+    def start(self, target, log_file):
+        """Runs *target* on a new thread, unless the rig is already running an experiment.
+
+        Parameters:
+            target (callable): The function running the experiment, called without arguments.
+            log_file (str): The name of the log file of the experiment.
+
+        Raises:
+            RigBusyError: If an experiment is already running on the rig, in any worker.
+        """
+        with self._lock:
+            if self.busy or not self._acquire(log_file):
+                raise RigBusyError(f'Rig {self.name} is already running {self.current_log_file}')
+            self.log_file = log_file
+
+            def run():
+                try:
+                    target()
+                finally:
+                    self._release()
+
+            self._thread = threading.Thread(target=run, name=f'rig-{self.name}', daemon=True)
+            self._thread.start()
+
+    def wait(self, timeout=None):
+        """Blocks until the running experiment, if any, has finished.
+
+        Parameters:
+            timeout (float): The maximum number of seconds to wait.
+        """
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def status(self):
+        """Returns a JSON serializable description of the rig."""
+        log_file = self.current_log_file
+        return {
+            'name': self.name,
+            'hosts': self.hosts,
+            'busy': self.busy,
+            'log_file': log_file,
+        }
+
+
+class RigRegistry:
+    """Holds the rigs configured for the server, by name."""
+
+    def __init__(self):
+        self._rigs = {}
+
+    @classmethod
+    def from_config(cls, config, lock_directory=None):
+        """Creates a registry from the Flask configuration.
+
+        Rigs are read from RIGS, a dict mapping each rig name to its config, which
+        must include REMOTE_HOSTS. When RIGS is empty, a single rig named 'default'
+        is created from REMOTE_HOSTS.
+
+        Parameters:
+            config (dict): The Flask configuration.
+            lock_directory (str): The directory of the lock file of each rig,
+                <name>.lock, shared by the workers of the server.
+
+        Returns:
+            RigRegistry: The registry holding the configured rigs.
+        """
+        registry = cls()
+        rigs = config.get('RIGS') or {DEFAULT_RIG: {'REMOTE_HOSTS': config['REMOTE_HOSTS']}}
+        for name, rig_config in rigs.items():
+            rig_config = dict(rig_config)
+            hosts = rig_config.pop('REMOTE_HOSTS')
+            lock_path = os.path.join(lock_directory, f'{name}.lock') if lock_directory else None
+            registry.add(Rig(name, hosts, rig_config, lock_path))
+        return registry
+
+    def add(self, rig):
+        """Adds a rig to the registry, replacing any rig with the same name."""
+        self._rigs[rig.name] = rig
+
+    def get(self, name=None):
+        """Returns the rig with the specified name.
+
+        Parameters:
+            name (str): The name of the rig, the first configured rig if None.
+
+        Raises:
+            KeyError: If there is no rig with the specified name.
+        """
+        if name is None:
+            return next(iter(self._rigs.values()))
+        return self._rigs[name]
+
+    def __iter__(self):
+        return iter(self._rigs.values())
@@ -0,0 +1,203 @@
+"""Single owner of the Maestro serial port, publishing sensor readings in shared memory.
+
+With several server workers or experiment processes, each VendingMachine would
+open the Maestro serial port itself and their requests would interleave on the
+wire. The sensor broker is the only process opening the port: it polls the
+sensor channels in a loop and publishes each sample to a small file in a RAM
+backed directory such as /dev/shm. Readers map the file and read the latest
+sample without locks, serial traffic or system calls.
+
+The file holds a header followed by one unsigned 16 bit reading per Maestro
+channel::
+
+    sequence (uint64) | sample time (double) | readings (24 x uint16)
+
+The sequence is a seqlock: the broker makes it odd before writing a sample and
+even again once the sample is complete. A reader retries while the sequence is
+odd or changed during its read, so it never returns a partially written sample.
+The sample time is the time.perf_counter() value at which the sample was
+requested. perf_counter uses the system wide monotonic clock, so it can be
+compared with the perf_counter values of other processes on the same machine.
+
+Run the broker with::
+
+    python -m elephant_vending_machine.libraries.sensor_broker --port /dev/ttyACM0
+
+and set SENSOR_BROKER_PATH in the vending machine config to the path it publishes to.
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import time
+
+HEADER = struct.Struct('<Qd')
+CHANNEL_COUNT = 24
+READINGS = struct.Struct(f'<{CHANNEL_COUNT}H')
+SIZE = HEADER.size + READINGS.size
+DEFAULT_PATH = '/dev/shm/elephant_vending_machine_sensors'
+DEFAULT_CHANNELS = (0, 1, 2)
+# A sample older than this means the broker isn't running
+STALE_AFTER = 1.0
+
+
+class SensorBrokerError(OSError):
+    """Raised when the sensor broker isn't publishing samples."""
+
+
+class SensorBroker:
+    """Polls sensor channels and publishes each sample to a shared memory file.
+
+    Parameters:
+        controller (maestro.Controller): The controller reading the sensors.
+        path (str): The path of the file samples are published to, created if needed.
+        channels (iterable): The Maestro channels which are polled.
+    """
+
+    def __init__(self, controller, path=DEFAULT_PATH, channels=DEFAULT_CHANNELS):
+        self.controller = controller
+        self.path = path
+        self.channels = list(channels)
+        self._readings = [0] * CHANNEL_COUNT
+        file_descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(file_descriptor, SIZE)
+            self._map = mmap.mmap(file_descriptor, SIZE)
+        finally:
+            os.close(file_descriptor)
+        # Continue the sequence of a previous broker, so readers don't mistake samples for old ones
+        self._sequence = HEADER.unpack_from(self._map)[0] & ~1
+
+    def publish(self, positions, sample_time):
+        """Writes a sample to the shared memory file.
+
+        Parameters:
+            positions (list): The readings of the polled channels, in order.
+            sample_time (float): The time.perf_counter() value the sample was requested at.
+        """
+        for channel, position in zip(self.channels, positions):
+            self._readings[channel] = position
+        self._sequence += 1
+        HEADER.pack_into(self._map, 0, self._sequence, sample_time)
+        READINGS.pack_into(self._map, HEADER.size, *self._readings)
+        self._sequence += 1
+        HEADER.pack_into(self._map, 0, self._sequence, sample_time)
+
+    def poll(self):
+        """Reads every polled channel with a single request and publishes the sample."""
+        sample_time = time.perf_counter()
+        self.publish(self.controller.getPositions(self.channels), sample_time)
+
+    def run(self, interval=0):
+        """Polls the sensors until interrupted.
+
+        Parameters:
+            interval (float): The number of seconds to sleep between samples. The
+                serial round trip already paces the loop, so the default is none.
+        """
+        while True:
+            self.poll()
+            if interval:
+                time.sleep(interval)
+
+    def close(self):
+        """Unmaps the shared memory file, leaving it in place for the next broker."""
+        self._map.close()
+
+
+class SensorBrokerReader:
+    """Reads the samples published by a sensor broker, as a drop-in for maestro.Controller.
+
+    Parameters:
+        path (str): The path of the file the broker publishes to.
+        stale_after (float): The number of seconds after which the latest sample
+            is considered stale, meaning the broker stopped.
+
+    Raises:
+        OSError: If the broker has never published to the path.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, stale_after=STALE_AFTER):
+        self.path = path
+        self.stale_after = stale_after
+        self.sample_time = None
+        self._last_sequence = None
+        with open(path, 'rb') as shared:
+            self._map = mmap.mmap(shared.fileno(), SIZE, access=mmap.ACCESS_READ)
+
+    def read(self):
+        """Returns the latest complete sample.
+
+        Returns:
+            tuple: The sequence number, the sample time and the readings of every channel.
+        """
+        while True:
+            sequence, sample_time = HEADER.unpack_from(self._map)
+            if sequence & 1:
+                continue
+            readings = READINGS.unpack_from(self._map, HEADER.size)
+            if HEADER.unpack_from(self._map)[0] == sequence:
+                return sequence, sample_time, readings
+
+    def getPositions(self, chans):  # pylint: disable=invalid-name
+        """Returns the readings of a sample published since the previous call.
+
+        Waits for the broker to publish a new sample, so each call returns a
+        distinct sample like a serial read would. The time the sample was
+        requested by the broker is stored in sample_time.
+
+        Parameters:
+            chans (list): The channels to return the readings of.
+
+        Returns:
+            list: The reading of each channel, in order.
+
+        Raises:
+            SensorBrokerError: If no new sample was published for stale_after seconds.
+        """
+        deadline = time.perf_counter() + self.stale_after
+        while True:
+            sequence, sample_time, readings = self.read()
+            if sequence != self._last_sequence and sequence:
+                break
+            if time.perf_counter() > deadline:
+                raise SensorBrokerError(f'No sensor samples published to {self.path}')
+            # Yield to other threads, samples come every few milliseconds
+            time.sleep(0.0005)
+        self._last_sequence = sequence
+        self.sample_time = sample_time
+        return [readings[channel] for channel in chans]
+
+    def close(self):
+        """Unmaps the shared memory file."""
+        self._map.close()
+
+
+def main(arguments=None):
+    """Runs a sensor broker reading the Maestro on the specified serial port."""
+    parser = argparse.ArgumentParser(
+        description='Publishes the vending machine sensor readings in shared memory.')
+    parser.add_argument('--port', default='/dev/ttyACM0', help='The Maestro serial port.')
+    parser.add_argument('--path', default=DEFAULT_PATH, help='The file samples are published to.')
+    parser.add_argument('--channels', type=int, nargs='+', default=list(DEFAULT_CHANNELS),
+                        help='The Maestro channels the sensors are wired to.')
+    parser.add_argument('--interval', type=float, default=0,
+                        help='Seconds to sleep between samples.')
+    arguments = parser.parse_args(arguments)
+    # maestro.py is a top level module, only needed by the broker process
+    # pylint: disable=import-outside-toplevel
+    import maestro
+    controller = maestro.Controller(arguments.port)
+    broker = SensorBroker(controller, arguments.path, arguments.channels)
+    try:
+        broker.run(arguments.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.close()
+        controller.close()
+
+
+if __name__ == '__main__':
+    main()
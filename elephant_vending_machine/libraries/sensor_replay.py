@@ -0,0 +1,158 @@
+"""Replay of recorded or synthetic sensor samples through the selection logic.
+
+A ReplayController stands in for maestro.Controller: each getPositions call
+returns the next sample of a trace, recorded by a TraceRecorder during a session
+or built with synthetic_samples. It also provides the clock wait_for_input
+measures timeouts with, which reads the times of the samples rather than the
+wall clock. A replayed session therefore makes the same selections and timeouts
+as the recorded one, as fast as the samples can be read.
+
+Replay a recorded trace, for example to check a new threshold, with::
+
+    python -m elephant_vending_machine.libraries.sensor_replay session.trace --threshold 40
+"""
+
+import argparse
+import time
+
+from .sensor_trace import TraceReader
+
+
+class ReplayController:
+    """Returns the samples of a trace, one per getPositions call, in place of the Maestro.
+
+    Parameters:
+        pins (list): The sensor pins of the samples, in order.
+        samples (iterable): (time, readings) tuples, oldest first, with the reading of
+            each pin. Times are in seconds, in the time.perf_counter() clock of the
+            recording.
+
+    Raises:
+        ValueError: If there are no samples.
+    """
+
+    def __init__(self, pins, samples):
+        self.pins = list(pins)
+        self._samples = list(samples)
+        if not self._samples:
+            raise ValueError('A replay needs at least one sample')
+        self._next = 0
+        self._indices = {}
+        self.sample_time = None
+
+    @classmethod
+    def from_trace(cls, path, start=None, end=None):
+        """Creates a replay of the samples of a trace file taken between two times.
+
+        Parameters:
+            path (str): The path of the trace file.
+            start (float): The time of the first replayed sample, the oldest kept if None.
+            end (float): The time of the last replayed sample, the latest if None.
+
+        Returns:
+            ReplayController: The replay of the samples.
+        """
+        with TraceReader(path) as trace:
+            return cls(trace.pins, trace.samples(start, end))
+
+    @property
+    def remaining(self):
+        """int: The number of samples which haven't been replayed yet."""
+        return len(self._samples) - self._next
+
+    def clock(self):
+        """Returns the time of the next sample, or of the last one once all were replayed.
+
+        This is the time at which the next sample was requested in the recording,
+        so it plays the role of time.perf_counter() in wait_for_input.
+        """
+        return self._samples[min(self._next, len(self._samples) - 1)][0]
+
+    def getPositions(self, chans):  # pylint: disable=invalid-name
+        """Returns the readings of the next sample, storing its time in sample_time.
+
+        Parameters:
+            chans (list): The pins to return the readings of, which must be in pins.
+
+        Returns:
+            list: The reading of each pin, in order.
+
+        Raises:
+            EOFError: If every sample has been replayed.
+        """
+        if self._next >= len(self._samples):
+            raise EOFError('Every sample of the trace was replayed')
+        indices = self._indices.get(tuple(chans))
+        if indices is None:
+            indices = self._indices[tuple(chans)] = [self.pins.index(chan) for chan in chans]
+        self.sample_time, readings = self._samples[self._next]
+        self._next += 1
+        return [readings[index] for index in indices]
+
+    def close(self):
+        """Does nothing, there is no hardware to release."""
+
+
+def synthetic_samples(pins, duration, events=(), period=0.002, baseline=1000, start=0.0):
+    """Returns evenly spaced samples in which pins read a value for a while.
+
+    Parameters:
+        pins (list): The sensor pins of the samples.
+        duration (float): The number of seconds covered by the samples.
+        events (iterable): (start, end, pin, reading) tuples: *pin* reads *reading*
+            from *start* seconds, included, to *end* seconds, excluded, after the
+            first sample.
+        period (float): The number of seconds between samples.
+        baseline (int): The reading of the pins outside of events, nothing in range.
+        start (float): The time of the first sample.
+
+    Returns:
+        list: (time, readings) tuples, as expected by ReplayController.
+    """
+    events = list(events)
+    samples = []
+    for index in range(int(round(duration / period))):
+        offset = index * period
+        readings = [baseline] * len(pins)
+        for event_start, event_end, pin, reading in events:
+            if event_start <= offset < event_end:
+                readings[pins.index(pin)] = reading
+        samples.append((start + offset, tuple(readings)))
+    return samples
+
+
+def main(arguments=None):
+    """Replays a recorded trace through wait_for_input and prints the selections."""
+    # Imported here so the replay classes can be used without the hardware libraries
+    # pylint: disable=import-outside-toplevel
+    from .vending_machine import VendingMachine
+    parser = argparse.ArgumentParser(
+        description='Replays a sensor trace through the selection logic.')
+    parser.add_argument('trace', help='The trace file recorded during a session.')
+    parser.add_argument('--threshold', type=int, help='The SENSOR_THRESHOLD to replay with.')
+    parser.add_argument('--timeout', type=float, default=10000,
+                        help='The timeout of each wait, in milliseconds.')
+    arguments = parser.parse_args(arguments)
+    replay = ReplayController.from_trace(arguments.trace)
+    config = {'LEFT_SENSOR_PIN': replay.pins[0], 'MIDDLE_SENSOR_PIN': replay.pins[1],
+              'RIGHT_SENSOR_PIN': replay.pins[2]}
+    if arguments.threshold is not None:
+        config['SENSOR_THRESHOLD'] = arguments.threshold
+    vending_machine = VendingMachine(['left', 'middle', 'right'], config, replay)
+    groups = [vending_machine.left_group, vending_machine.middle_group,
+              vending_machine.right_group]
+    samples = replay.remaining
+    started = time.perf_counter()
+    while replay.remaining:
+        try:
+            selection = vending_machine.wait_for_input(groups, arguments.timeout)
+        except EOFError:
+            break
+        selection_time = vending_machine.last_input_time or replay.clock()
+        print(f'{selection_time:.6f} {selection}')
+    elapsed = time.perf_counter() - started
+    print(f'Replayed {samples} samples in {elapsed:.3f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""Recording of every raw sensor sample read while waiting for input.
+
+wait_for_input only keeps the readings which ended the wait, so what the sensors
+reported during a disputed trial is lost. A trace recorder keeps every sample:
+its time.perf_counter() time and the reading of each sensor pin. Samples are
+written to a memory-mapped file preallocated for a fixed number of samples and
+used as a ring, so recording a sample is a couple of struct.pack_into calls into
+the mapping, without any system call, and a long session overwrites its oldest
+samples rather than filling the disk.
+
+A trace file starts with a header::
+
+    magic (4 bytes) | capacity (uint32) | pin count (uint8) | pins (8 x uint8) | padding
+
+followed by the number of samples written so far (uint64) and the ring of
+samples, each a time (double) followed by one uint16 reading per pin. Sample
+times are perf_counter values, like the monotonic times of the experiment log,
+so the samples around any logged event can be sliced out of the trace.
+"""
+
+import bisect
+import mmap
+import os
+import struct
+
+MAGIC = b'EVMT'
+HEADER = struct.Struct('<4sIB8s3x')
+COUNT = struct.Struct('<Q')
+SAMPLES_OFFSET = HEADER.size + COUNT.size
+MAX_PINS = 8
+# About 17 minutes of continuous sampling at 1 kHz, 14 MB with three pins
+DEFAULT_CAPACITY = 1 << 20
+TRACE_SUFFIX = '.trace'
+
+
+def sample_struct(pin_count):
+    """Returns the struct of a sample of the specified number of pins."""
+    return struct.Struct(f'<d{pin_count}H')
+
+
+class TraceRecorder:
+    """Appends sensor samples to a preallocated ring in a memory-mapped file.
+
+    Parameters:
+        path (str): The path of the trace file, replaced if it exists.
+        pins (list): The sensor pins of the samples, in order.
+        capacity (int): The number of samples kept before the oldest are overwritten.
+        resume (bool): Whether to keep appending to an existing trace of the same
+            pins and capacity, such as the trace of a resumed experiment, rather
+            than replacing it.
+
+    Raises:
+        ValueError: If there are more than MAX_PINS pins.
+    """
+
+    def __init__(self, path, pins, capacity=DEFAULT_CAPACITY, resume=False):
+        if len(pins) > MAX_PINS:
+            raise ValueError(f'A trace records at most {MAX_PINS} pins')
+        self.path = path
+        self.pins = list(pins)
+        self.capacity = capacity
+        self.written = 0
+        self._sample = sample_struct(len(self.pins))
+        size = SAMPLES_OFFSET + capacity * self._sample.size
+        if resume and self._resume(size):
+            return
+        with open(path, 'wb+') as trace:
+            # The file is sparse until samples are written
+            trace.truncate(size)
+            self._map = mmap.mmap(trace.fileno(), size)
+        HEADER.pack_into(self._map, 0, MAGIC, capacity, len(self.pins), bytes(self.pins))
+        COUNT.pack_into(self._map, HEADER.size, 0)
+
+    def _resume(self, size):
+        try:
+            trace = open(self.path, 'rb+')
+        except FileNotFoundError:
+            return False
+        with trace:
+            if os.fstat(trace.fileno()).st_size != size:
+                return False
+            self._map = mmap.mmap(trace.fileno(), size)
+        magic, capacity, pin_count, pins = HEADER.unpack_from(self._map)
+        if (magic, capacity, list(pins[:pin_count])) != (MAGIC, self.capacity, self.pins):
+            self._map.close()
+            return False
+        self.written = COUNT.unpack_from(self._map, HEADER.size)[0]
+        return True
+
+    def record(self, sample_time, readings):
+        """Appends a sample, overwriting the oldest one once the ring is full.
+
+        Parameters:
+            sample_time (float): The time.perf_counter() value the sample was requested at.
+            readings (list): The reading of each pin, in the order of pins.
+        """
+        offset = SAMPLES_OFFSET + (self.written % self.capacity) * self._sample.size
+        self._sample.pack_into(self._map, offset, sample_time, *readings)
+        self.written += 1
+        # The count is updated last, so a reader never sees an unwritten sample
+        COUNT.pack_into(self._map, HEADER.size, self.written)
+
+    def close(self):
+        """Flushes the samples to the file and unmaps it."""
+        self._map.flush()
+        self._map.close()
+
+
+class _SampleTimes:
+    """Sequence of the times of the samples of a trace, oldest first, for bisect."""
+
+    def __init__(self, trace):
+        self.trace = trace
+
+    def __len__(self):
+        return len(self.trace)
+
+    def __getitem__(self, index):
+        return self.trace.sample(index)[0]
+
+
+class TraceReader:
+    """Reads the samples of a trace file, which may still be recorded to.
+
+    Parameters:
+        path (str): The path of the trace file.
+
+    Raises:
+        ValueError: If the file isn't a trace.
+        OSError: If the file can't be read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as trace:
+            self._map = mmap.mmap(trace.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < SAMPLES_OFFSET:
+            self._map.close()
+            raise ValueError(f'{path} is not a sensor trace')
+        magic, self.capacity, pin_count, pins = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError(f'{path} is not a sensor trace')
+        self.pins = list(pins[:pin_count])
+        self._sample = sample_struct(pin_count)
+        self._written = COUNT.unpack_from(self._map, HEADER.size)[0]
+
+    def __len__(self):
+        return min(self._written, self.capacity)
+
+    def sample(self, index):
+        """Returns a sample as a (time, readings) tuple, index 0 being the oldest kept sample."""
+        position = (self._written - len(self) + index) % self.capacity
+        sample = self._sample.unpack_from(self._map, SAMPLES_OFFSET + position * self._sample.size)
+        return sample[0], sample[1:]
+
+    def samples(self, start=None, end=None):
+        """Returns the samples taken between two times, both included.
+
+        Parameters:
+            start (float): The perf_counter time of the first sample, the oldest kept if None.
+            end (float): The perf_counter time of the last sample, the latest if None.
+
+        Returns:
+            list: A (time, readings) tuple per sample, oldest first.
+        """
+        self._written = COUNT.unpack_from(self._map, HEADER.size)[0]
+        times = _SampleTimes(self)
+        first = 0 if start is None else bisect.bisect_left(times, start)
+        last = len(self) if end is None else bisect.bisect_right(times, end)
+        return [self.sample(index) for index in range(first, last)]
+
+    def around(self, event_time, window):
+        """Returns the samples taken within *window* seconds before or after an event."""
+        return self.samples(event_time - window, event_time + window)
+
+    def close(self):
+        """Unmaps the trace file."""
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,193 @@
+"""Checkpoints of running experiments, so a session cut short by a crash can be resumed.
+
+An experiment runs for hours on the thread of its rig. If the server worker is
+restarted partway through, the run is lost and used to be repeated from its
+first trial. Instead, each run gets a journal, keyed by the name of its log,
+which the experiment appends a checkpoint to after every trial: the index of
+the completed trial, the counters it keeps in the session state and the state
+of the session's random number generator. Each checkpoint is synced to disk
+before the next trial starts, so a crash loses at most the trial in progress.
+Resuming a run restores the latest checkpoint and starts again at the next
+trial, drawing the same random numbers the interrupted run would have drawn.
+
+A journal is a file of JSON lines: a header, the checkpoints, then a final
+line once the run is finished::
+
+    {"experiment": "example_experiment.py", "rig": "default", "seed": 1234, "started": "..."}
+    {"trial": 0, "state": {"correct": 1}, "random": {"version": 3, "state": "...", "gauss": null}}
+    {"finished": true}
+"""
+
+import base64
+from datetime import datetime
+import json
+import os
+import random
+import struct
+
+JOURNAL_SUFFIX = '.journal'
+
+
+def encode_random_state(state):
+    """Returns a compact JSON serializable form of a random.Random state.
+
+    The Mersenne Twister state is 625 integers, packed into base64 rather than
+    written as a JSON list, which keeps each checkpoint to a few kilobytes.
+    """
+    version, internal, gauss = state
+    packed = struct.pack(f'<{len(internal)}I', *internal)
+    return {'version': version, 'state': base64.b64encode(packed).decode('ascii'),
+            'gauss': gauss}
+
+
+def decode_random_state(encoded):
+    """Returns the random.Random state encoded by encode_random_state."""
+    packed = base64.b64decode(encoded['state'])
+    internal = struct.unpack(f'<{len(packed) // 4}I', packed)
+    return encoded['version'], internal, encoded['gauss']
+
+
+def read_journal(path):
+    """Returns the header, latest checkpoint and completion of a journal.
+
+    A last line cut short by a crash is ignored.
+
+    Parameters:
+        path (str): The path of the journal.
+
+    Returns:
+        tuple: The header dict, the latest checkpoint dict, or None if no trial
+        was completed, and whether the run finished.
+
+    Raises:
+        FileNotFoundError: If the journal doesn't exist.
+        ValueError: If the file isn't a journal.
+    """
+    with open(path) as journal:
+        lines = journal.read().splitlines()
+    entries = []
+    for number, line in enumerate(lines):
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            if number < len(lines) - 1:
+                raise ValueError(f'Line {number + 1} of {path} is corrupt') from None
+    if not entries or 'experiment' not in entries[0]:
+        raise ValueError(f'{path} is not a session journal')
+    checkpoints = [entry for entry in entries[1:] if 'trial' in entry]
+    finished = any(entry.get('finished') for entry in entries[1:])
+    return entries[0], checkpoints[-1] if checkpoints else None, finished
+
+
+class ExperimentSession:
+    """The resumable progress of an experiment run, checkpointed to a journal.
+
+    Experiments accepting a session as the third argument of run_experiment
+    should draw their random numbers from session.random, keep their counters in
+    session.state and iterate over their trials with session.trials, which
+    checkpoints each trial once it completes and skips those completed before a
+    resume::
+
+        def run_experiment(experiment_logger, vending_machine, session):
+            for trial_index in session.trials(NUM_TRIALS):
+                white_on_left = session.random.random() < 0.5
+                ...
+                session.state['correct'] = session.state.get('correct', 0) + 1
+
+    Sessions are created with create or resume rather than directly.
+
+    Parameters:
+        path (str): The path of the journal.
+        header (dict): The header of the journal.
+        checkpoint (dict): The latest checkpoint, None if no trial was completed.
+        finished (bool): Whether the run finished.
+    """
+
+    def __init__(self, path, header, checkpoint=None, finished=False):
+        self.path = path
+        self.experiment = header['experiment']
+        self.rig = header.get('rig')
+        self.seed = header['seed']
+        self.random = random.Random(self.seed)
+        self.trial = 0
+        self.state = {}
+        self.resumed = checkpoint is not None
+        self.finished = finished
+        if checkpoint is not None:
+            self.trial = checkpoint['trial'] + 1
+            self.state = checkpoint['state']
+            self.random.setstate(decode_random_state(checkpoint['random']))
+
+    @classmethod
+    def create(cls, path, experiment, rig_name=None, seed=None):
+        """Starts the journal of a new run, replacing any existing journal.
+
+        Parameters:
+            path (str): The path of the journal.
+            experiment (str): The filename of the experiment.
+            rig_name (str): The name of the rig running the experiment.
+            seed (int): The seed of session.random, a random one if None.
+
+        Returns:
+            ExperimentSession: The session, at its first trial.
+        """
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(32)
+        header = {'experiment': experiment, 'rig': rig_name, 'seed': seed,
+                  'started': datetime.utcnow().isoformat(' ')}
+        with open(path, 'w') as journal:
+            journal.write(json.dumps(header) + '\n')
+        return cls(path, header)
+
+    @classmethod
+    def resume(cls, path):
+        """Restores a run from the latest checkpoint of its journal.
+
+        Parameters:
+            path (str): The path of the journal.
+
+        Returns:
+            ExperimentSession: The session, at the trial following the latest checkpoint.
+
+        Raises:
+            FileNotFoundError: If the journal doesn't exist.
+            ValueError: If the file isn't a journal.
+        """
+        return cls(path, *read_journal(path))
+
+    def _append(self, entry):
+        with open(self.path, 'a') as journal:
+            journal.write(json.dumps(entry) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def checkpoint(self, trial=None):
+        """Records that a trial completed, with the session state and random state.
+
+        Parameters:
+            trial (int): The index of the completed trial, the current trial if None.
+
+        Raises:
+            TypeError: If the session state isn't JSON serializable.
+        """
+        if trial is None:
+            trial = self.trial
+        self._append({'trial': trial, 'state': self.state,
+                      'random': encode_random_state(self.random.getstate())})
+        self.trial = trial + 1
+
+    def trials(self, count):
+        """Yields the indices of the trials left to run, checkpointing each one once it completes.
+
+        Parameters:
+            count (int): The total number of trials of the experiment.
+        """
+        while self.trial < count:
+            trial = self.trial
+            yield trial
+            self.checkpoint(trial)
+
+    def finish(self):
+        """Records that the run finished, so it can't be resumed."""
+        self._append({'finished': True})
+        self.finished = True
@@ -0,0 +1,209 @@
+"""Counterbalanced trial sequences, precomputed from a seed.
+
+Drawing the correct side with random.choice on every trial gives sessions in
+which one side comes up far more often than the other, or many times in a row,
+and which can't be reproduced. Instead, the whole order of a session is
+computed before it starts, from a seed written to its log:
+
+* Sides are balanced. The sequence is built from blocks in which each side
+  comes up equally often, so every session is balanced too, within one trial
+  when its length isn't a multiple of the block size.
+* No side comes up more than max_run times in a row.
+* Stimuli rotate: each one is shown once before any is shown again.
+
+Each block is drawn at once by shuffling it, and drawn again if it breaks the
+run length constraint where it joins the previous blocks. Rejecting a single
+block rather than the whole sequence keeps generation linear in the number of
+trials, so the plan of a session is computed from its own seed when it starts::
+
+    plan = trial_sequences.generate_plan(session.seed, trials=20)[0]
+    for trial_index in session.trials(20):
+        white_side = plan[trial_index]['side']
+
+Plans spanning many sessions, counterbalanced across the whole study, are drawn
+from a fixed seed kept by the experiment, cached per experiment, and each run
+picks its own session from them::
+
+    plan = trial_sequences.cached_plan('experiment.py', PLAN_SEED, trials=20, sessions=30)
+    trials = plan[SESSION_NUMBER]
+"""
+
+import hashlib
+import json
+import os
+import random
+
+SIDES = ('left', 'right')
+MAX_RUN = 3
+# Number of times each value appears in a block
+BLOCK_REPEATS = 5
+MAX_ATTEMPTS = 1000
+CACHE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            'data', 'sequences')
+
+
+def _exceeds_run(sequence, block, max_run):
+    """Returns whether appending a block to a sequence makes a run longer than max_run."""
+    joined = list(sequence[-max_run:]) + list(block)
+    run = 0
+    for index, value in enumerate(joined):
+        run = run + 1 if index and value == joined[index - 1] else 1
+        if run > max_run:
+            return True
+    return False
+
+
+def balanced_sequence(values, length, max_run=MAX_RUN, block_size=None, rng=None,
+                      max_attempts=MAX_ATTEMPTS):
+    """Returns a sequence in which values come up equally often, in runs of at most max_run.
+
+    Parameters:
+        values (list): The values to balance, such as the sides of the correct stimulus.
+        length (int): The length of the sequence.
+        max_run (int): The maximum number of times a value may come up in a row,
+            unlimited if None.
+        block_size (int): The number of values in which each value comes up
+            equally often, BLOCK_REPEATS times the number of values by default.
+            It must be a multiple of the number of values.
+        rng (random.Random): The generator to draw from, seeded by the caller.
+        max_attempts (int): The number of times a block is drawn before giving up.
+
+    Returns:
+        list: The sequence of values.
+
+    Raises:
+        ValueError: If the block size isn't a multiple of the number of values, or no
+            block meeting the constraints was drawn in max_attempts attempts.
+    """
+    values = list(values)
+    if block_size is None:
+        block_size = BLOCK_REPEATS * len(values)
+    if not values or block_size % len(values):
+        raise ValueError('The block size must be a multiple of the number of values')
+    rng = rng or random.Random()
+    sequence = []
+    while len(sequence) < length:
+        block = values * (block_size // len(values))
+        size = min(block_size, length - len(sequence))
+        for _ in range(max_attempts):
+            rng.shuffle(block)
+            # A partial last block keeps its balance within one trial
+            candidate = _balanced_prefix(block, values, size)
+            if max_run is None or not _exceeds_run(sequence, candidate, max_run):
+                break
+        else:
+            raise ValueError(f'No sequence with runs of at most {max_run} found '
+                             f'in {max_attempts} attempts')
+        sequence.extend(candidate)
+    return sequence
+
+
+def _balanced_prefix(block, values, size):
+    """Returns size values of a shuffled block, none of them more than once more than another."""
+    if size == len(block):
+        return list(block)
+    rounds, remainder = divmod(size, len(values))
+    # The values getting one more trial are those coming first in the shuffled block
+    extra = list(dict.fromkeys(block))[:remainder]
+    quota = {value: rounds + (value in extra) for value in values}
+    prefix = []
+    for value in block:
+        if quota[value]:
+            quota[value] -= 1
+            prefix.append(value)
+    return prefix
+
+
+def rotation(items, length, rng=None):
+    """Returns a sequence showing each item once, in shuffled order, before any is shown again.
+
+    An item never comes up twice in a row where two rounds join.
+
+    Parameters:
+        items (list): The items to rotate through, such as stimulus filenames.
+        length (int): The length of the sequence.
+        rng (random.Random): The generator to draw from, seeded by the caller.
+
+    Returns:
+        list: The sequence of items.
+    """
+    items = list(items)
+    rng = rng or random.Random()
+    sequence = []
+    while items and len(sequence) < length:
+        round_ = list(items)
+        rng.shuffle(round_)
+        if sequence and len(round_) > 1 and round_[0] == sequence[-1]:
+            round_.append(round_.pop(0))
+        sequence.extend(round_[:length - len(sequence)])
+    return sequence
+
+
+def generate_plan(seed, trials, sessions=1, sides=SIDES, max_run=MAX_RUN, block_size=None,
+                  stimuli=None):
+    """Returns the trial order of one or more sessions of an experiment.
+
+    Parameters:
+        seed (int): The seed of the plan. The same parameters and seed always give
+            the same plan.
+        trials (int): The number of trials of each session.
+        sessions (int): The number of sessions.
+        sides (list): The sides the correct stimulus is balanced between.
+        max_run (int): The maximum number of trials in a row with the same side.
+        block_size (int): The number of trials over which sides are balanced.
+        stimuli (list): The stimuli to rotate through, one per trial, if any.
+
+    Returns:
+        list: A list of trials per session, each trial being a dict with its side and,
+        if stimuli were given, its stimulus.
+
+    Raises:
+        ValueError: If the constraints can't be met.
+    """
+    rng = random.Random(seed)
+    plan = []
+    for _ in range(sessions):
+        session = [{'side': side} for side in
+                   balanced_sequence(sides, trials, max_run, block_size, rng)]
+        if stimuli:
+            for trial, stimulus in zip(session, rotation(stimuli, trials, rng)):
+                trial['stimulus'] = stimulus
+        plan.append(session)
+    return plan
+
+
+def cached_plan(experiment, seed, trials, directory=CACHE_FOLDER, **parameters):
+    """Returns the plan generate_plan computes for an experiment, from a cache if possible.
+
+    Plans are cached as JSON files named after the experiment and a digest of
+    the parameters, so a plan is only computed once whatever its size. The seed
+    should be fixed, not drawn per run, or the cache is never read again. Plans
+    of a single session are quick to compute and returned without caching.
+
+    Parameters:
+        experiment (str): The filename of the experiment.
+        seed (int): The seed of the plan.
+        trials (int): The number of trials of each session.
+        directory (str): The cache directory, created if it doesn't exist.
+        **parameters: The other parameters of generate_plan.
+
+    Returns:
+        list: A list of trials per session, as returned by generate_plan.
+    """
+    if parameters.get('sessions', 1) == 1:
+        return generate_plan(seed, trials, **parameters)
+    key = json.dumps(dict(parameters, seed=seed, trials=trials), sort_keys=True)
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    path = os.path.join(directory, f'{experiment}.{digest}.json')
+    try:
+        with open(path) as plan_file:
+            return json.load(plan_file)
+    except (FileNotFoundError, ValueError):
+        pass
+    plan = generate_plan(seed, trials, **parameters)
+    os.makedirs(directory, exist_ok=True)
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w') as plan_file:
+        json.dump(plan, plan_file)
+    os.replace(temporary_path, path)
+    return plan
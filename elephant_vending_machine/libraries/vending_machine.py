@@ -4,9 +4,17 @@ This module  allows for display of images, control of LEDs,
 and detecting motion sensor input on the machine.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import time
 import spur
 import maestro
+from .calibration import compute_thresholds, thresholds_by_pin, DEFAULT_DURATION
+from .clock_sync import ClockSync, SYNC_INTERVAL
+from .command_queue import CommandQueue
+from .host_health import get_breaker, host_call, record_future
+from .pi_agent_client import AgentClient, AgentError, AGENT_PORT
+from .sensor_broker import SensorBrokerReader
+from .sensor_trace import TraceRecorder, DEFAULT_CAPACITY
 
 LEFT_SCREEN = 1
 MIDDLE_SCREEN = 2
@@ -15,6 +23,8 @@ SENSOR_THRESHOLD = 50
 LEFT_SENSOR_PIN = 0
 MIDDLE_SENSOR_PIN = 1
 RIGHT_SENSOR_PIN = 2
+MAESTRO_PORT = '/dev/ttyACM0'
+REMOTE_STAGING_DIRECTORY = '/dev/shm/elephant_vending_machine'
 
 def get_current_time_milliseconds():
     """Timeouts will be handled in milliseconds.
@@ -41,14 +51,26 @@ class VendingMachine:
             REMOTE_IMAGE_DIRECTORY: a string representing the absolute path
             to where stimuli images are stored on the remote pis, SENSOR_THRESHOLD:
             the minimum sensor reading that will not count as motion detected.
+            SENSOR_THRESHOLDS: a dict of thresholds by pin, as set by calibrate,
+            overriding SENSOR_THRESHOLD for those pins.
             LEFT_SENSOR_PIN: an integer in the range 0-5 indicating which pin on
             the maestro board the left sensor pin is wired to. There will also be
             MIDDLE_SENSOR_PIN and RIGHT_SENSOR_PIN, with corresponding purposes.
             In the event these values are not passed in, defaults will be assigned
-            as a fallback.
+            as a fallback. PI_AGENT_PORT: the port the agent started by pi_agent.py
+            listens on. MAESTRO_PORT: the serial port of the Maestro board reading
+            the sensors. REMOTE_STAGING_DIRECTORY: a RAM backed directory on the
+            remote pis where stimuli are staged for the session. CLOCK_SYNC_INTERVAL:
+            the number of seconds between estimations of the clock offset of the pis.
+            SENSOR_BROKER_PATH: the shared memory file a sensor broker publishes the
+            sensor readings to. When set, sensors are read from it instead of
+            opening MAESTRO_PORT, so several processes can share the Maestro.
+        sensor_reader (object): Reads the sensors in place of the Maestro, such as a
+            ReplayController replaying a recorded trace. It must provide getPositions
+            and close, and may provide clock, a function returning the time in seconds.
     """
 
-    def __init__(self, addresses, config=None):
+    def __init__(self, addresses, config=None, sensor_reader=None):
         self.addresses = addresses
         if config is None:
             self.config = {}
@@ -66,6 +88,16 @@ class VendingMachine:
             self.config['RIGHT_SENSOR_PIN'] = RIGHT_SENSOR_PIN
         if 'SENSOR_THRESHOLD' not in self.config:
             self.config['SENSOR_THRESHOLD'] = SENSOR_THRESHOLD
+        if 'SENSOR_THRESHOLDS' not in self.config:
+            self.config['SENSOR_THRESHOLDS'] = {}
+        if 'PI_AGENT_PORT' not in self.config:
+            self.config['PI_AGENT_PORT'] = AGENT_PORT
+        if 'MAESTRO_PORT' not in self.config:
+            self.config['MAESTRO_PORT'] = MAESTRO_PORT
+        if 'REMOTE_STAGING_DIRECTORY' not in self.config:
+            self.config['REMOTE_STAGING_DIRECTORY'] = REMOTE_STAGING_DIRECTORY
+        if 'CLOCK_SYNC_INTERVAL' not in self.config:
+            self.config['CLOCK_SYNC_INTERVAL'] = SYNC_INTERVAL
         self.left_group = SensorGrouping(
             addresses[0], LEFT_SCREEN, self.config['LEFT_SENSOR_PIN'], self.config)
         self.middle_group = SensorGrouping(
@@ -73,9 +105,97 @@ class VendingMachine:
         self.right_group = SensorGrouping(
             addresses[2], RIGHT_SCREEN, self.config['RIGHT_SENSOR_PIN'], self.config)
         self.result = None
+        self.last_input_time = None
+        self._reader = sensor_reader
+        self.trace = None
 
-    @staticmethod
-    def wait_for_input(groups, timeout):
+    def _sensor_reader(self):
+        # The serial port is opened on first use and kept open for the whole session
+        if self._reader is None:
+            if self.config.get('SENSOR_BROKER_PATH'):
+                self._reader = SensorBrokerReader(self.config['SENSOR_BROKER_PATH'])
+            else:
+                self._reader = maestro.Controller(self.config['MAESTRO_PORT'])
+        return self._reader
+
+    def _groups(self):
+        return [self.left_group, self.middle_group, self.right_group]
+
+    def stage_stimuli(self, stimuli_names):
+        """Copies stimuli into the RAM backed staging directory of every Pi, in parallel.
+
+        Once staged, display_on_screen reads the stimuli from RAM instead of the SD card.
+        Staging is best effort, a Pi which can't be reached keeps displaying stimuli
+        from REMOTE_IMAGE_DIRECTORY.
+
+        Parameters:
+            stimuli_names (list): The names of the stimuli files used in the session.
+        """
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            list(executor.map(lambda group: group.stage_stimuli(stimuli_names), self._groups()))
+
+    def clear_staged_stimuli(self):
+        """Removes the stimuli staged by stage_stimuli from every Pi, in parallel."""
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            list(executor.map(lambda group: group.clear_staged_stimuli(), self._groups()))
+
+    def start_trace(self, path, capacity=DEFAULT_CAPACITY, resume=False):
+        """Records every sensor sample read by wait_for_input to a trace file.
+
+        The pins of all three groups are read and recorded for every sample, whichever
+        groups are waited on. The trace is closed by close.
+
+        Parameters:
+            path (str): The path of the trace file, replaced if it exists.
+            capacity (int): The number of samples kept before the oldest are overwritten.
+            resume (bool): Whether to keep appending to the trace of a resumed experiment.
+        """
+        self.trace = TraceRecorder(
+            path, [group.sensor_pin for group in self._groups()], capacity, resume)
+
+    def close(self):
+        """Closes the Maestro serial port or sensor broker, the sensor trace and the
+        connections to the Pi agents."""
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+        for group in self._groups():
+            group.commands.close()
+            group.clock.stop()
+            group.clock.client.close()
+            group.agent.close()
+
+    def calibrate(self, duration=DEFAULT_DURATION):
+        """Computes the threshold of each sensor pin from samples of the empty enclosure.
+
+        Every pin is sampled as fast as the sensors can be read for *duration*
+        seconds, then the baseline, noise and threshold of each pin are computed
+        as described in the calibration module. The thresholds are stored in
+        SENSOR_THRESHOLDS, so they are used by the following calls to wait_for_input.
+        Nothing should be in front of the sensors while calibrating.
+
+        Parameters:
+            duration (float): The number of seconds to sample for.
+
+        Returns:
+            list: A dict per pin with its statistics and threshold, as returned by
+            calibration.compute_thresholds.
+        """
+        reader = self._sensor_reader()
+        clock = getattr(reader, 'clock', time.perf_counter)
+        pins = [group.sensor_pin for group in self._groups()]
+        samples = []
+        end_time = clock() + duration
+        while clock() < end_time:
+            samples.append(reader.getPositions(pins))
+        results = compute_thresholds(pins, samples)
+        self.config['SENSOR_THRESHOLDS'] = thresholds_by_pin(results)
+        return results
+
+    def wait_for_input(self, groups, timeout):
         """Waits for input on the motion sensors. If no motion is detected by the specified
         time to wait, returns with a result to indicate this.
 
@@ -86,27 +206,52 @@ class VendingMachine:
         Returns:
             String: A string with value 'left', 'middle', 'right', or 'timeout', indicating
             the selection or lack thereof.
+
+        The time.perf_counter() value at which the selecting sample was requested, in
+        seconds, is stored in last_input_time, None on timeout. With a sensor broker
+        it is the time the broker requested the sample. It can be passed
+        to the experiment logger as extra={'monotonic': vending_machine.last_input_time}
+        so the selection is logged at the time it was sensed.
+
+        When a trace was started with start_trace, every sample read is recorded to it.
         """
-        reader = maestro.Controller()
+        reader = self._sensor_reader()
+        # A replayed trace brings its own clock, so timeouts are measured in trace time
+        clock = getattr(reader, 'clock', time.perf_counter)
+        sensor_pins = [group.sensor_pin for group in groups]
+        thresholds = [self.config['SENSOR_THRESHOLDS'].get(pin, self.config['SENSOR_THRESHOLD'])
+                      for pin in sensor_pins]
+        self.last_input_time = None
         selection = 'timeout'
-        start_time = get_current_time_milliseconds()
-        elapsed_time = get_current_time_milliseconds() - start_time
+        start_time = clock() * 1000
+        elapsed_time = clock() * 1000 - start_time
         readings = [1000] * len(groups)
-        while (all(reading >= SENSOR_THRESHOLD or reading == 0 for reading in readings) and
+        trace = self.trace
+        if trace is not None:
+            # Every pin is recorded, the readings of the groups are picked out of the sample
+            indices = [trace.pins.index(pin) for pin in sensor_pins]
+            sensor_pins = trace.pins
+        while (all(reading >= threshold or reading == 0
+                   for reading, threshold in zip(readings, thresholds)) and
                elapsed_time < timeout):
-            # range(len()) has less overhead than enumerate
-            # pylint: disable=consider-using-enumerate
-            for i in range(len(groups)):
-                readings[i] = reader.getPosition(groups[i].sensor_pin)
-            elapsed_time = get_current_time_milliseconds() - start_time
+            # All pins are read with a single write and read on the serial port
+            sample_time = clock()
+            readings = reader.getPositions(sensor_pins)
+            # A sensor broker reports when it requested the sample it returned
+            sample_time = getattr(reader, 'sample_time', None) or sample_time
+            if trace is not None:
+                trace.record(sample_time, readings)
+                readings = [readings[index] for index in indices]
+            elapsed_time = clock() * 1000 - start_time
         selection_index = None
         # range(len()) has less overhead than enumerate
         # pylint: disable=consider-using-enumerate
         for i in range(len(readings)):
-            if SENSOR_THRESHOLD > readings[i] > 0:
+            if thresholds[i] > readings[i] > 0:
                 selection_index = i
                 break
         if selection_index is not None:
+            self.last_input_time = sample_time
             if groups[selection_index].group_id == LEFT_SCREEN:
                 selection = 'left'
             elif groups[selection_index].group_id == MIDDLE_SCREEN:
@@ -130,6 +275,16 @@ class SensorGrouping:
             and REMOTE_IMAGE_DIRECTORY, a string representing the absolute path
             to where stimuli images are stored on the remote pis. In the event these
             values are not passed in, defaults will be assigned as a fallback.
+            PI_AGENT_PORT, the port of the agent started by pi_agent.py, is used
+            for LED commands when present. REMOTE_STAGING_DIRECTORY is the RAM backed
+            directory stimuli are staged to.
+
+    Commands to the Pi go through its circuit breaker: while the Pi is known to be
+    down, they raise a HostDownError at once instead of waiting for a timeout.
+
+    The queue_* methods send their command through a prioritized, pipelined
+    CommandQueue and return a Future right away, so an experiment can show a
+    stimulus and cue the LEDs without waiting for either acknowledgement.
     """
 
     def __init__(self, address, screen_identifier, sensor_pin, config):
@@ -139,9 +294,19 @@ class SensorGrouping:
         self.sensor_pin = sensor_pin
         self.config = config
         self.pid_of_previous_display_command = None
+        self.staged_stimuli = set()
+        self.agent = AgentClient(address, config.get('PI_AGENT_PORT', AGENT_PORT))
+        # Time requests get their own connection, so they never delay a display command
+        self.clock = ClockSync(AgentClient(address, config.get('PI_AGENT_PORT', AGENT_PORT)))
+        self.commands = CommandQueue(address, config.get('PI_AGENT_PORT', AGENT_PORT))
+        self.last_display_time = None
+        self._queued_display = None
 
     def led_color_with_time(self, red, green, blue, display_time):
-        """Displays the color specified by the given RGB values for *time* seconds.
+        """Displays the color specified by the given RGB values for *time* milliseconds.
+
+        The command is sent to the agent running on the Pi, which returns as soon as
+        the color is displayed. If the agent can't be reached, led.py is run over SSH.
 
         Parameters:
             red (int): A number in the range 0-255 specifying how much
@@ -150,16 +315,43 @@ class SensorGrouping:
                 green should be in the RGB color display.
             blue (int): A number in the range 0-255 specifying how much
                 blue should be in the RGB color display.
-            display_time (int): The number of seconds that LEDs should display the color
+            display_time (int): The number of milliseconds that LEDs should display the color
                 before returning to an "off" state.
         """
-        shell = spur.SshShell(
+        with host_call(self.address):
+            try:
+                self.agent.set_color(red, green, blue, display_time)
+            except OSError:
+                self._led_color_over_ssh(red, green, blue, display_time)
+
+    def led_pattern(self, name, red, green, blue, display_time):
+        """Displays a named LED pattern in the color specified by the given RGB values.
+
+        Parameters:
+            name (str): The name of a pattern supported by the agent, one of 'solid',
+                'flash', 'pulse', 'chase' or 'gradient'. See led_patterns.py.
+            red (int): A number in the range 0-255.
+            green (int): A number in the range 0-255.
+            blue (int): A number in the range 0-255.
+            display_time (int): The number of milliseconds the pattern should last.
+
+        Raises:
+            OSError: If the agent running on the Pi can't be reached.
+            AgentError: If the agent doesn't support the pattern.
+        """
+        with host_call(self.address):
+            self.agent.show_pattern(name, red, green, blue, display_time)
+
+    def _shell(self):
+        return spur.SshShell(
             hostname=self.address,
             username='pi',
             missing_host_key=spur.ssh.MissingHostKey.accept,
             load_system_host_keys=False
         )
-        with shell:
+
+    def _led_color_over_ssh(self, red, green, blue, display_time):
+        with self._shell() as shell:
             shell.spawn(
                 ['sudo', 'PYTHONPATH=\".:build/lib.linux-armv71-2.7\"',
                  'python',
@@ -171,20 +363,146 @@ class SensorGrouping:
         """Displays the specified stimuli on the screen.
         Should only be called if the SensorGrouping config is not None
 
+        The image is displayed by the agent running on the Pi, which reports when
+        the viewer was started. That time is converted to the controller's clock
+        and stored in last_display_time, as a time.perf_counter() value which can
+        be logged with extra={'monotonic': group.last_display_time}. If the agent
+        can't be reached, feh is started over SSH and last_display_time is None.
+
+        The clock offset of the Pi is estimated on the first display through the
+        agent, then again every CLOCK_SYNC_INTERVAL seconds in the background.
+
         Parameters:
             stimuli_name (str): The name of the file corresponding to the desired
                                 stimuli to be displayed.
             correct_answer (boolean): Denotes whether this is the desired selection.
         """
         self.correct_stimulus = correct_answer
-        shell = spur.SshShell(
-            hostname=self.address,
-            username='pi',
-            missing_host_key=spur.ssh.MissingHostKey.accept,
-            load_system_host_keys=False
-        )
-        with shell:
-            result = shell.spawn(['feh', '-F',
-                                  f'''{self.config['REMOTE_IMAGE_DIRECTORY']}/{stimuli_name}''',
+        self.last_display_time = None
+        self._queued_display = None
+        directory = self._stimulus_directory(stimuli_name)
+        with host_call(self.address):
+            try:
+                displayed = self.agent.display(f'{directory}/{stimuli_name}')
+            except (OSError, AgentError):
+                self._display_over_ssh(directory, stimuli_name)
+                return
+        if self.clock.offset is None:
+            try:
+                self.clock.update()
+            except OSError:
+                return
+            self.clock.start(self.config.get('CLOCK_SYNC_INTERVAL', SYNC_INTERVAL))
+        self.last_display_time = self.clock.to_local(displayed)
+
+    def _stimulus_directory(self, stimuli_name):
+        if stimuli_name in self.staged_stimuli:
+            return self.config['REMOTE_STAGING_DIRECTORY']
+        return self.config['REMOTE_IMAGE_DIRECTORY']
+
+    def queue_display(self, stimuli_name, correct_answer):
+        """Queues the display of a stimulus ahead of any queued LED command, without waiting.
+
+        Once the agent acknowledges the display, last_display_time is set as by
+        display_on_screen. The first call waits for the clock offset of the Pi to
+        be estimated, then keeps it up to date in the background.
+
+        Parameters:
+            stimuli_name (str): The name of the file of the stimulus.
+            correct_answer (boolean): Denotes whether this is the desired selection.
+
+        Returns:
+            Future: Resolves to the acknowledgement of the agent, see CommandQueue.submit.
+
+        Raises:
+            HostDownError: If the Pi is known to be down.
+        """
+        get_breaker(self.address).check()
+        self.correct_stimulus = correct_answer
+        self.last_display_time = None
+        if self.clock.offset is None:
+            try:
+                self.clock.update()
+            except OSError:
+                pass
+        self.clock.start(self.config.get('CLOCK_SYNC_INTERVAL', SYNC_INTERVAL))
+        future = self.commands.display(f'{self._stimulus_directory(stimuli_name)}/{stimuli_name}')
+        self._queued_display = future
+
+        def record_display_time(completed):
+            # A display queued since then owns last_display_time
+            if completed is not self._queued_display or completed.cancelled():
+                return
+            if completed.exception() is None:
+                self.last_display_time = self.clock.to_local(completed.result()['displayed'])
+        future.add_done_callback(record_display_time)
+        return record_future(self.address, future)
+
+    def queue_led_color(self, red, green, blue, display_time):
+        """Queues a color for the LED strip behind any queued stimulus, without waiting.
+
+        Parameters are those of led_color_with_time. There is no SSH fallback.
+
+        Returns:
+            Future: Resolves to the acknowledgement of the agent, see CommandQueue.submit.
+
+        Raises:
+            HostDownError: If the Pi is known to be down.
+        """
+        get_breaker(self.address).check()
+        return record_future(self.address,
+                             self.commands.set_color(red, green, blue, display_time))
+
+    def queue_led_pattern(self, name, red, green, blue, display_time):
+        """Queues a named LED pattern behind any queued stimulus, without waiting.
+
+        Parameters are those of led_pattern.
+
+        Returns:
+            Future: Resolves to the acknowledgement of the agent, see CommandQueue.submit.
+
+        Raises:
+            HostDownError: If the Pi is known to be down.
+        """
+        get_breaker(self.address).check()
+        return record_future(self.address,
+                             self.commands.show_pattern(name, red, green, blue, display_time))
+
+    def _display_over_ssh(self, directory, stimuli_name):
+        with self._shell() as shell:
+            result = shell.spawn(['feh', '-F', f'{directory}/{stimuli_name}',
                                   '&'], update_env={'DISPLAY': ':0'}, store_pid=True).pid
         self.pid_of_previous_display_command = int(result)
+
+    def stage_stimuli(self, stimuli_names):
+        """Copies stimuli from REMOTE_IMAGE_DIRECTORY into REMOTE_STAGING_DIRECTORY on the Pi.
+
+        Stimuli which don't exist on the Pi are skipped. If the Pi can't be reached,
+        no stimuli are staged and display_on_screen keeps using REMOTE_IMAGE_DIRECTORY.
+
+        Parameters:
+            stimuli_names (list): The names of the stimuli files to stage.
+        """
+        if not stimuli_names:
+            return
+        # Prints the name of each stimulus successfully copied
+        script = 'mkdir -p "$0" && for f; do cp -f "$f" "$0"/ 2>/dev/null && basename "$f"; done'
+        paths = [f"{self.config['REMOTE_IMAGE_DIRECTORY']}/{name}" for name in stimuli_names]
+        try:
+            with host_call(self.address), self._shell() as shell:
+                result = shell.run(['sh', '-c', script, self.config['REMOTE_STAGING_DIRECTORY']]
+                                   + paths, allow_error=True)
+        except (spur.ssh.ConnectionError, OSError):
+            return
+        self.staged_stimuli = set(result.output.decode().splitlines())
+
+    def clear_staged_stimuli(self):
+        """Removes the staged stimuli from the Pi."""
+        if not self.staged_stimuli:
+            return
+        self.staged_stimuli = set()
+        try:
+            with host_call(self.address), self._shell() as shell:
+                shell.run(['rm', '-rf', self.config['REMOTE_STAGING_DIRECTORY']], allow_error=True)
+        except (spur.ssh.ConnectionError, OSError):
+            pass
@@ -1,79 +1,95 @@
-import random
 import time
 
-def run_experiment(experiment_logger, vending_machine):
+from elephant_vending_machine.libraries import trial_sequences
+
+def run_experiment(experiment_logger, vending_machine, session):
     """This is an example of an experiment file used to create custom experiments.
 
-    In this experiment, a fixation cross is presented on the center display and the other two displays randomly
+    In this experiment, a fixation cross is presented on the center display and the other two displays
     display either a white, or a black stimuli. The correct response is to select the white stimuli. The LEDs flash
     green if the correct choice was made.
-    
+
+    The side of the white stimuli is precomputed for the whole session from the session's seed, balanced
+    between left and right and never on the same side more than 3 trials in a row. The seed is logged, and
+    the session is checkpointed after every trial so an interrupted run can be resumed.
+
     Parameters:
         experiment_logger: Instance of experiment logger for writing logs to csv files
         vending_machine: Instance of vending_machine for interacting with hardware devices
+        session: Instance of ExperimentSession checkpointing the progress of the run
     """
 
     NUM_TRIALS = 20
-	INTERTRIAL_INTERVAL = 5 # seconds
+    INTERTRIAL_INTERVAL = 5 # seconds
     BLANK_SCREEN = 'all_black_screen.png'
     FIXATION_STIMULI = 'fixation_stimuli.png'
     WHITE_STIMULI = 'white_stimuli.png'
     BLACK_STIMULI = 'black_stimuli.png'
 
-    # Repeat trial for NUM_TRIALS iterations
-    for trial_index in range(NUM_TRIALS):
+    left_group = vending_machine.left_group
+    middle_group = vending_machine.middle_group
+    right_group = vending_machine.right_group
+
+    plan = trial_sequences.generate_plan(session.seed, NUM_TRIALS)[0]
+    experiment_logger.info("Trial sequence seed %s", session.seed)
+
+    # Repeat trial for NUM_TRIALS iterations, skipping those completed before a resume
+    for trial_index in session.trials(NUM_TRIALS):
         trial_num = trial_index + 1
         experiment_logger.info("Trial %s started", trial_num)
-		
-		vending_machine.left_group.display_on_screen(BLANK_SCREEN, False)
-		vending_machine.middle_group.display_on_screen(FIXATION_STIMULI, True)
-		vending_machine.right_group.display_on_screen(BLANK_SCREEN, False)
-		experiment_logger.info("Presented fixation cross")
-		
-		correct_response = False
-		
-		while not correct_response:
-			selection = vending_machine.wait_for_selection(vending_machine.left_group, vending_machine.middle_group, vending_machine.right_group)
-
-			if selection == 'middle':
-				experiment_logger.info("Trial %s picked middle when selecting fixation cross", trial_num)
-				correct_response = True
-			elif selection == 'left':
-				experiment_logger.info("Trial %s picked left when selecting fixation cross", trial_num)
-			else:
-				experiment_logger.info("Trial %s picked right when selecting fixation cross", trial_num)
-
-        # Randomly decide to display white stimuli on left or right display
-        white_on_left = random.choice([True, False])
+
+        left_group.display_on_screen(BLANK_SCREEN, False)
+        middle_group.display_on_screen(FIXATION_STIMULI, True)
+        right_group.display_on_screen(BLANK_SCREEN, False)
+        experiment_logger.info("Presented fixation cross", extra={'monotonic': middle_group.last_display_time})
+
+        correct_response = False
+
+        while not correct_response:
+            selection = vending_machine.wait_for_input([left_group, middle_group, right_group], 300000)
+
+            if selection == 'timeout':
+                continue
+            experiment_logger.info("Trial %s picked %s when selecting fixation cross", trial_num, selection,
+                                   extra={'monotonic': vending_machine.last_input_time})
+            correct_response = selection == 'middle'
+
+        # Display the white stimuli on the side planned for this trial
+        white_on_left = plan[trial_index]['side'] == 'left'
 
         if white_on_left:
-            vending_machine.left_group.display_on_screen(WHITE_STIMULI, True)
-			vending_machine.middle_group.display_on_screen(FIXATION_STIMULI, False)
-            vending_machine.right_group.display_on_screen(BLACK_STIMULI, False)
-            experiment_logger.info("Trial %s correct stimuli displayed on left", trial_num)
+            left_group.display_on_screen(WHITE_STIMULI, True)
+            middle_group.display_on_screen(FIXATION_STIMULI, False)
+            right_group.display_on_screen(BLACK_STIMULI, False)
+            experiment_logger.info("Trial %s correct stimuli displayed on left", trial_num,
+                                   extra={'monotonic': left_group.last_display_time})
         else:
-            vending_machine.left_group.display_on_screen(BLACK_STIMULI, False)
-			vending_machine.middle_group.display_on_screen(FIXATION_STIMULI, False)
-            vending_machine.right_group.display_on_screen(WHITE_STIMULI, True)
-            experiment_logger.info("Trial %s correct stimuli displayed on right", trial_num)
+            left_group.display_on_screen(BLACK_STIMULI, False)
+            middle_group.display_on_screen(FIXATION_STIMULI, False)
+            right_group.display_on_screen(WHITE_STIMULI, True)
+            experiment_logger.info("Trial %s correct stimuli displayed on right", trial_num,
+                                   extra={'monotonic': right_group.last_display_time})
 
         # Wait for choice on left or right screen. If no selection after 5 minutes (300000 milliseconds)
-        selection = vending_machine.wait_for_selection(vending_machine.left_group, vending_machine.right_group, timeout=300000)
+        selection = vending_machine.wait_for_input([left_group, right_group], 300000)
 
-		if selection == 'timeout':
-			experiment_logger.info("Trial %s no selection made.", trial_num)
-        elif selection == 'left':
-            experiment_logger.info("Trial %s picked left", trial_num)
+        if selection == 'timeout':
+            experiment_logger.info("Trial %s no selection made.", trial_num)
         else:
-            experiment_logger.info("Trial %s picked right", trial_num)
+            experiment_logger.info("Trial %s picked %s", trial_num, selection,
+                                   extra={'monotonic': vending_machine.last_input_time})
+            if selection == plan[trial_index]['side']:
+                session.state['correct'] = session.state.get('correct', 0) + 1
+                vending_machine.left_group.led_color_with_time(0, 255, 0, 1000)
+                vending_machine.right_group.led_color_with_time(0, 255, 0, 1000)
 
         experiment_logger.info("Trial %s finished", trial_num)
-		
-		experiment_logger.info("Start of intertrial interval")
-		
-		# Wait for intertrial interval
-		time.sleep(INTERTRIAL_INTERVAL)
-		
-		experiment_logger.info("End of intertrial interval")
-
-    experiment_logger.info("Experiment finished")
\ No newline at end of file
+
+        experiment_logger.info("Start of intertrial interval")
+
+        # Wait for intertrial interval
+        time.sleep(INTERTRIAL_INTERVAL)
+
+        experiment_logger.info("End of intertrial interval")
+
+    experiment_logger.info("Experiment finished with %s correct trials", session.state.get('correct', 0))
@@ -7,22 +7,412 @@ a lot of routes.
 
 # Circular import OK here. See https://flask.palletsprojects.com/en/1.1.x/patterns/packages/
 # pylint: disable=cyclic-import
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import importlib.util
+import inspect
+import csv
 import os
+import re
 import subprocess
 from subprocess import CalledProcessError
-from flask import request, make_response, jsonify
+from flask import g, request, make_response, jsonify, send_file, Response
 from werkzeug.utils import secure_filename
 from elephant_vending_machine import APP
-from .libraries.experiment_logger import create_experiment_logger
+from .libraries import (calibration, host_health, image_variants, log_archive, profiling,
+                        retention, sensor_trace, session_journal)
+from .libraries.image_index import ImageIndex, read_image_metadata
+from .libraries.log_analytics import LogAnalytics, LOG_NAME_PATTERN
+from .libraries.experiment_logger import create_experiment_logger, close_experiment_logger
+from .libraries.rig_registry import RigRegistry, RigBusyError
 from .libraries.vending_machine import VendingMachine
 
 ALLOWED_IMG_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'gif', 'svg'}
 ALLOWED_EXPERIMENT_EXTENSIONS = {'py'}
 IMAGE_UPLOAD_FOLDER = '/static/img'
+IMAGE_CACHE_FOLDER = '/static/img_cache'
+IMAGE_DISPLAY_FOLDER = '/static/img_display'
+IMAGE_INDEX_FILE = '/data/image_index.sqlite3'
+ANALYTICS_FILE = '/data/analytics.sqlite3'
+TRACE_FOLDER = '/data/trace'
+JOURNAL_FOLDER = '/data/journal'
+PROFILE_FOLDER = '/data/profile'
+RIG_LOCK_FOLDER = '/data/rigs'
+CALIBRATION_FILE = '/data/calibration.json'
 EXPERIMENT_UPLOAD_FOLDER = '/static/experiment'
 LOG_FOLDER = '/static/log'
+BATCH_DELETE_FOLDERS = {
+    'image': IMAGE_UPLOAD_FOLDER,
+    'experiment': EXPERIMENT_UPLOAD_FOLDER,
+    'log': LOG_FOLDER,
+}
+
+def get_rig_registry():
+    """Returns the registry of rigs, created from the Flask config on first use.
+
+    The sensor thresholds saved by the last calibration of each rig are applied
+    to its config. Each rig locks a file in RIG_LOCK_FOLDER while it runs, so
+    that server workers don't drive the same rig at once.
+
+    Returns:
+        RigRegistry: The registry of the rigs driven by this server
+    """
+    if 'rig_registry' not in APP.extensions:
+        registry = RigRegistry.from_config(
+            APP.config, os.path.dirname(os.path.abspath(__file__)) + RIG_LOCK_FOLDER)
+        calibrations = calibration.load_calibrations(
+            os.path.dirname(os.path.abspath(__file__)) + CALIBRATION_FILE)
+        for rig in registry:
+            if calibrations.get(rig.name):
+                rig.config['SENSOR_THRESHOLDS'] = calibrations[rig.name]
+        APP.extensions['rig_registry'] = registry
+    return APP.extensions['rig_registry']
+
+def get_image_worker_pool():
+    """Returns the pool generating image variants, created on first use.
+
+    Returns:
+        ThreadPoolExecutor: A pool of IMAGE_WORKERS threads
+    """
+    if 'image_worker_pool' not in APP.extensions:
+        APP.extensions['image_worker_pool'] = ThreadPoolExecutor(
+            max_workers=APP.config['IMAGE_WORKERS'])
+    return APP.extensions['image_worker_pool']
+
+def get_log_worker_pool():
+    """Returns the pool compressing finished experiment logs, created on first use.
+
+    Returns:
+        ThreadPoolExecutor: A pool of a single thread
+    """
+    if 'log_worker_pool' not in APP.extensions:
+        APP.extensions['log_worker_pool'] = ThreadPoolExecutor(max_workers=1)
+    return APP.extensions['log_worker_pool']
+
+def get_log_analytics():
+    """Returns the trial analytics database, opened on first use.
+
+    Returns:
+        LogAnalytics: The table of the trials recorded in the experiment logs
+    """
+    if 'log_analytics' not in APP.extensions:
+        path_to_current_file = os.path.dirname(os.path.abspath(__file__))
+        APP.extensions['log_analytics'] = LogAnalytics(path_to_current_file + ANALYTICS_FILE)
+    return APP.extensions['log_analytics']
+
+def ingest_logs():
+    """Ingests new and modified logs into the analytics database, skipping running experiments.
+
+    Returns:
+        int: The number of logs parsed
+    """
+    active = [rig.current_log_file for rig in get_rig_registry() if rig.busy]
+    log_directory = os.path.dirname(os.path.abspath(__file__)) + LOG_FOLDER
+    return get_log_analytics().ingest(log_directory, active)
+
+def trace_path(log_filename):
+    """Returns the path of the sensor trace recorded during the experiment of a log.
+
+    Parameters:
+        log_filename (str): The name of the log, without any .gz suffix
+
+    Returns:
+        str: The path of the trace file, which may not exist
+    """
+    return (os.path.dirname(os.path.abspath(__file__)) + TRACE_FOLDER + '/' + log_filename
+            + sensor_trace.TRACE_SUFFIX)
+
+def journal_path(log_filename):
+    """Returns the path of the session journal of the experiment of a log.
+
+    Parameters:
+        log_filename (str): The name of the log, without any .gz suffix
+
+    Returns:
+        str: The path of the journal, which may not exist
+    """
+    return (os.path.dirname(os.path.abspath(__file__)) + JOURNAL_FOLDER + '/' + log_filename
+            + session_journal.JOURNAL_SUFFIX)
+
+def profile_path(name):
+    """Returns the path of the profile of a run or request, without the suffix of its files.
+
+    Parameters:
+        name (str): The name of the log of the run, or the name of the request profile
+
+    Returns:
+        str: The path prefix of the profile files, which may not exist
+    """
+    return os.path.dirname(os.path.abspath(__file__)) + PROFILE_FOLDER + '/' + name
+
+def forget_log(filename):
+    """Removes the sensor trace, session journal and profile of a deleted log, if it has them.
+
+    Parameters:
+        filename (str): The filename of the deleted log, compressed or not
+    """
+    name = log_archive.log_name(filename)
+    for path in [trace_path(name), journal_path(name)] + [
+            profile_path(name) + suffix for suffix in profiling.SUFFIXES.values()]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def log_failure(task):
+    """Returns a callback logging the exception a task submitted to a worker pool failed with.
+
+    Exceptions of tasks are only raised by Future.result, which nothing calls for
+    background tasks, so they would be lost without it.
+
+    Parameters:
+        task (str): The description of the task, starting the log message
+
+    Returns:
+        callable: The callback, to be passed to Future.add_done_callback
+    """
+    def callback(future):
+        if not future.cancelled() and future.exception() is not None:
+            APP.logger.error('%s failed', task, exc_info=future.exception())
+    return callback
+
+def get_image_index():
+    """Returns the image metadata index, opened on first use.
+
+    The index is synced with the image directory in the background, as hashing
+    every image takes a while on a large library, so searches may miss images
+    copied to the directory by hand until the sync finishes.
+
+    Returns:
+        ImageIndex: The index of the images in the image directory
+    """
+    if 'image_index' not in APP.extensions:
+        path_to_current_file = os.path.dirname(os.path.abspath(__file__))
+        path = path_to_current_file + IMAGE_INDEX_FILE
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        index = ImageIndex(path)
+        APP.extensions['image_index'] = index
+        get_image_worker_pool().submit(
+            index.sync, path_to_current_file + IMAGE_UPLOAD_FOLDER).add_done_callback(
+                log_failure('Syncing the image index'))
+    return APP.extensions['image_index']
+
+def get_retention_job():
+    """Returns the job applying RETENTION_POLICIES, started on first use.
+
+    RETENTION_POLICIES maps 'log', 'image' or 'experiment' to the policy applied
+    to that directory, as described in the retention module. Logs are archived
+    by compressing them in place, where the log routes still find them.
+
+    Returns:
+        RetentionJob: The running job, or None if no policy is configured
+    """
+    if 'retention_job' not in APP.extensions:
+        job = None
+        policies = APP.config['RETENTION_POLICIES']
+        if policies:
+            path_to_current_file = os.path.dirname(os.path.abspath(__file__))
+            on_delete = {'image': forget_image}
+            # Archived logs keep their trace, deleted logs don't
+            if policies.get('log', {}).get('action') == 'delete':
+                on_delete['log'] = forget_log
+            targets = []
+            for kind, policy in policies.items():
+                if kind == 'log' and policy.get('action', 'archive') == 'archive':
+                    policy = dict(policy, action='compress')
+                targets.append((path_to_current_file + BATCH_DELETE_FOLDERS[kind], policy,
+                                on_delete.get(kind)))
+            job = retention.RetentionJob(targets, APP.config['RETENTION_INTERVAL'])
+            job.start()
+        APP.extensions['retention_job'] = job
+    return APP.extensions['retention_job']
+
+def get_host_monitor():
+    """Returns the health monitor of the Pis of every rig, created on first use.
+
+    The monitor only probes the hosts in the background if HOST_MONITOR_INTERVAL
+    is set, every HOST_MONITOR_INTERVAL seconds.
+
+    Returns:
+        HostMonitor: The monitor of the hosts of every rig
+    """
+    if 'host_monitor' not in APP.extensions:
+        hosts = [host for rig in get_rig_registry() for host in rig.hosts]
+        monitor = host_health.HostMonitor(hosts, APP.config['HOST_MONITOR_INTERVAL'])
+        if monitor.interval:
+            monitor.start()
+        APP.extensions['host_monitor'] = monitor
+    return APP.extensions['host_monitor']
+
+@APP.before_request
+def start_background_jobs():
+    """Starts the background jobs of the server when it gets its first request."""
+    get_retention_job()
+    get_host_monitor()
+
+@APP.before_request
+def start_request_profile():
+    """Profiles requests with an X-Profile header naming a profiling mode."""
+    mode = request.headers.get('X-Profile')
+    if mode in profiling.MODES:
+        profiler = profiling.Profiler(mode)
+        try:
+            profiler.start()
+        except ValueError:
+            APP.logger.exception('Request could not be profiled')
+            return
+        g.profiler = profiler
+
+@APP.after_request
+def save_request_profile(response):
+    """Saves the profile of a profiled request, naming it in the X-Profile response header.
+
+    The profile can then be downloaded from GET /profile/<name>.
+    """
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        name = f'request {datetime.utcnow()} {request.endpoint}'
+        try:
+            profiler.stop()
+            path = profile_path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            profiler.save(path)
+            response.headers['X-Profile'] = name
+        # Profiling must never fail the request it profiles
+        # pylint: disable=broad-except
+        except Exception:
+            APP.logger.exception('Profile of request %s could not be saved', name)
+    return response
+
+def find_experiment_stimuli(module, experiment_path):
+    """Returns the names of the stimuli files used by an experiment.
+
+    Experiments can list their stimuli in a module level STIMULI list.
+    Otherwise, every string literal in the experiment source which looks
+    like an image filename is considered a stimulus.
+
+    Parameters:
+        module (module): The loaded experiment module
+        experiment_path (str): The path of the experiment source file
+
+    Returns:
+        list: The sorted names of the stimuli files
+    """
+    stimuli = getattr(module, 'STIMULI', None)
+    if stimuli is None:
+        extensions = '|'.join(ALLOWED_IMG_EXTENSIONS)
+        pattern = re.compile(r'''['"]([^'"/\\]+\.(?:''' + extensions + r'''))['"]''', re.IGNORECASE)
+        with open(experiment_path) as experiment_file:
+            stimuli = pattern.findall(experiment_file.read())
+    return sorted(set(stimuli))
+
+def load_experiment(filename):
+    """Loads an uploaded experiment module.
+
+    Parameters:
+        filename (str): The filename of the experiment
+
+    Returns:
+        tuple: The loaded module and the names of the stimuli files it uses
+    """
+    experiment_path = f'elephant_vending_machine/static/experiment/{filename}'
+    spec = importlib.util.spec_from_file_location(filename, experiment_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module, find_experiment_stimuli(module, experiment_path)
+
+def accepts_session(run):
+    """Returns whether an experiment's run_experiment takes a session as third argument."""
+    parameters = inspect.signature(run).parameters.values()
+    return (len(parameters) >= 3
+            or any(parameter.kind == parameter.VAR_POSITIONAL for parameter in parameters))
+
+def execute_experiment(rig, module, filename, log_filename, stimuli=None, session=None,
+                       profile=None):
+    """Runs a loaded experiment module on a rig, logging to the specified file.
+
+    Meant to be run on the rig's thread. The stimuli are staged in RAM on the
+    rig's Pis for the duration of the experiment. The staged stimuli, the
+    rig's logger and hardware connections are cleaned up once the experiment
+    is finished. The log is then compressed, if COMPRESS_LOGS is set, and
+    ingested into the analytics database in the background. If
+    RECORD_SENSOR_TRACES is set, every sensor sample is recorded to the trace
+    file of the log.
+
+    Experiments whose run_experiment takes a third argument get an
+    ExperimentSession, checkpointed to the journal of the log after each trial
+    so the run can be resumed after a crash.
+
+    If a profiling mode is given, the run is profiled from the staging of its
+    stimuli until it finishes, and the profile is saved under the name of the log.
+
+    Parameters:
+        rig (Rig): The rig the experiment runs on
+        module (module): The loaded experiment module
+        filename (str): The filename of the experiment
+        log_filename (str): The name of the log file of the experiment
+        stimuli (list): The names of the stimuli files used by the experiment
+        session (ExperimentSession): The session of a resumed run, None to start
+            a new journal
+        profile (str): The profiling mode of the run, sampling or cprofile, None
+            not to profile it
+    """
+    if session is None:
+        path = journal_path(log_filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        session = session_journal.ExperimentSession.create(path, filename, rig.name)
+    exp_logger = create_experiment_logger(log_filename, rig.name)
+    vending_machine = VendingMachine(rig.hosts, rig.vending_machine_config())
+    profiler = profiling.Profiler(profile) if profile else None
+    try:
+        if APP.config['RECORD_SENSOR_TRACES']:
+            path = trace_path(log_filename)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            vending_machine.start_trace(path, APP.config['SENSOR_TRACE_CAPACITY'],
+                                        session.resumed)
+        if session.resumed:
+            exp_logger.info('Experiment %s resumed after %s completed trials',
+                            filename, session.trial)
+        else:
+            exp_logger.info('Experiment %s started', filename)
+        if profiler is not None:
+            try:
+                profiler.start()
+            except ValueError:
+                exp_logger.exception('Experiment %s could not be profiled', filename)
+                profiler = None
+        if stimuli:
+            vending_machine.stage_stimuli(stimuli)
+        if accepts_session(module.run_experiment):
+            module.run_experiment(exp_logger, vending_machine, session)
+        else:
+            module.run_experiment(exp_logger, vending_machine)
+        session.finish()
+    # Experiments are user code, any failure should be logged rather than lost
+    # pylint: disable=broad-except
+    except Exception:
+        exp_logger.exception('Experiment %s failed', filename)
+    finally:
+        if profiler is not None:
+            try:
+                profiler.stop()
+                path = profile_path(log_filename)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                profiler.save(path)
+            # The hardware and logger below must be released whatever happens to the profile
+            # pylint: disable=broad-except
+            except Exception:
+                exp_logger.exception('Profile of experiment %s could not be saved', filename)
+        vending_machine.clear_staged_stimuli()
+        vending_machine.close()
+        close_experiment_logger(rig.name)
+        if APP.config['COMPRESS_LOGS']:
+            log_directory = os.path.dirname(os.path.abspath(__file__)) + LOG_FOLDER
+            get_log_worker_pool().submit(
+                log_archive.compress_log, os.path.join(log_directory, log_filename)
+            ).add_done_callback(log_failure(f'Compressing log {log_filename}'))
+        get_log_worker_pool().submit(ingest_logs).add_done_callback(
+            log_failure('Ingesting logs'))
 
 @APP.route('/run-experiment/<filename>', methods=['POST'])
 def run_experiment(filename):
@@ -32,7 +422,7 @@ def run_experiment(filename):
 
     .. sourcecode::
 
-      POST /run-experiment?name=example_experiment HTTP/1.1
+      POST /run-experiment/example_experiment.py?rig=default HTTP/1.1
       Host: localhost:5000
       Accept-Encoding: gzip, deflate, br
       Content-Length:
@@ -50,62 +440,633 @@ def run_experiment(filename):
 
       {
         "log_file": "2020-03-17 05:15:06.558356 example_experiment.csv",
-        "message": "Running example_experiment"
+        "message": "Running example_experiment",
+        "rig": "default"
       }
 
-    All requests sent to this route should have an experiment file
-    included as a query parameter, otherwise a 400 error will be returned
+    The experiment runs in the background on the rig specified by the
+    optional rig query parameter, or on the first configured rig. Each
+    rig runs one experiment at a time, experiments on different rigs run
+    in parallel. The experiment's stimuli are staged in RAM on the rig's
+    Pis for the duration of the run.
+
+    The optional profile query parameter, sampling or cprofile, profiles the
+    run. Its profile is then downloaded from GET /profile/<log file>.
 
     :status 200: experiment started
     :status 400: malformed request
+    :status 409: the rig is already running an experiment
     """
     experiment_directory = os.path.dirname(os.path.abspath(__file__)) + EXPERIMENT_UPLOAD_FOLDER
     response_message = ""
     response_code = 400
     response_body = {}
-    if filename in os.listdir(experiment_directory):
+    rig_name = request.args.get('rig')
+    profile = request.args.get('profile')
+    try:
+        rig = get_rig_registry().get(rig_name)
+    except KeyError:
+        rig = None
+    if rig is None:
+        response_message = f"No rig named {rig_name}"
+    elif profile is not None and profile not in profiling.MODES:
+        response_message = f"Unknown profiling mode {profile}"
+    elif filename in os.listdir(experiment_directory):
         log_filename = str(datetime.utcnow()) + ' ' + filename + '.csv'
-        exp_logger = create_experiment_logger(log_filename)
+        module, stimuli = load_experiment(filename)
 
-        exp_logger.info('Experiment %s started', filename)
+        try:
+            rig.start(lambda: execute_experiment(rig, module, filename, log_filename, stimuli,
+                                                 profile=profile),
+                      log_filename)
+            response_message = 'Running ' + str(filename)
+            response_code = 200
+            response_body['log_file'] = log_filename
+            response_body['rig'] = rig.name
+        except RigBusyError as error:
+            response_message = str(error)
+            response_code = 409
+    else:
+        response_message = f"No experiment named {filename}"
+        response_code = 400
 
-        spec = importlib.util.spec_from_file_location(
-            filename,
-            f'elephant_vending_machine/static/experiment/{filename}')
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
+    response_body['message'] = response_message
+    return make_response(jsonify(response_body), response_code)
 
-        vending_machine = VendingMachine(APP.config['REMOTE_HOSTS'], {})
-        module.run_experiment(exp_logger, vending_machine)
+@APP.route('/resume-experiment/<log_filename>', methods=['POST'])
+def resume_experiment(log_filename):
+    """Resume an interrupted experiment from its last completed trial
 
-        response_message = 'Running ' + str(filename)
-        response_code = 200
-        response_body['log_file'] = log_filename
+    **Example request**:
+
+    .. sourcecode::
+
+      POST /resume-experiment/2020-03-17 05:15:06.558356 example_experiment.py.csv HTTP/1.1
+      Host: localhost:5000
+      Accept-Encoding: gzip, deflate, br
+      Content-Length:
+      Connection: keep-alive
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/json; charset=utf-8
+
+      {
+        "log_file": "2020-03-17 05:15:06.558356 example_experiment.py.csv",
+        "message": "Resuming example_experiment.py",
+        "rig": "default",
+        "trial": 42
+      }
+
+    The experiment of the log is run again on the rig it ran on, or on the rig
+    specified by the optional rig query parameter, starting at the trial
+    following the last checkpoint of its session journal. trial is the number
+    of trials completed before the interruption. The run keeps logging to the
+    same log file. The optional profile query parameter profiles the resumed
+    run, as for /run-experiment.
+
+    :status 200: experiment resumed
+    :status 400: the log has no journal, its experiment finished or no longer exists
+    :status 409: the rig is already running an experiment
+    """
+    response_body = {}
+    response_code = 400
+    profile = request.args.get('profile')
+    try:
+        session = session_journal.ExperimentSession.resume(journal_path(log_filename))
+    except FileNotFoundError:
+        response_message = f"No session journal for log {log_filename}"
+    except ValueError as error:
+        response_message = f"Session journal of {log_filename} is corrupt: {error}"
     else:
-        response_message = f"No experiment named {filename}"
-        response_code = 400
+        experiment_directory = (os.path.dirname(os.path.abspath(__file__))
+                                + EXPERIMENT_UPLOAD_FOLDER)
+        rig_name = request.args.get('rig', session.rig)
+        try:
+            rig = get_rig_registry().get(rig_name)
+        except KeyError:
+            rig = None
+        if session.finished:
+            response_message = f"Experiment of log {log_filename} already finished"
+        elif rig is None:
+            response_message = f"No rig named {rig_name}"
+        elif profile is not None and profile not in profiling.MODES:
+            response_message = f"Unknown profiling mode {profile}"
+        elif session.experiment not in os.listdir(experiment_directory):
+            response_message = f"No experiment named {session.experiment}"
+        else:
+            module, stimuli = load_experiment(session.experiment)
+            log_directory = os.path.dirname(os.path.abspath(__file__)) + LOG_FOLDER
+            log_path = log_archive.find_log(log_directory, log_filename)
+            # A failed run was compressed once it stopped, it is appended to again
+            if log_path is not None and log_path.endswith(log_archive.COMPRESSED_SUFFIX):
+                log_archive.decompress_log(log_path)
+            try:
+                rig.start(lambda: execute_experiment(rig, module, session.experiment,
+                                                     log_filename, stimuli, session, profile),
+                          log_filename)
+                response_message = 'Resuming ' + session.experiment
+                response_code = 200
+                response_body.update(log_file=log_filename, rig=rig.name, trial=session.trial)
+            except RigBusyError as error:
+                response_message = str(error)
+                response_code = 409
 
     response_body['message'] = response_message
     return make_response(jsonify(response_body), response_code)
 
-def add_remote_image(local_image_path, filename):
-    """Adds an image to the remote hosts defined in flask config.
+@APP.route('/profile', methods=['GET'])
+def list_profiles():
+    """Returns the profiles of runs and requests which can be downloaded
+
+    **Example request**:
+
+    .. sourcecode::
+
+      GET /profile HTTP/1.1
+      Host: 127.0.0.1
+      Accept-Encoding: gzip, deflate, br
+      Connection: keep-alive
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/json; charset=utf-8
+
+      {
+        "profiles": [
+          {
+            "formats": ["folded", "memory"],
+            "name": "2020-03-17 05:15:06.558356 example_experiment.py.csv"
+          }
+        ]
+      }
+
+    Profiles of runs are named after their log, profiles of requests are named
+    in the X-Profile header of the profiled response.
+
+    :status 200: list of profiles returned
+    """
+    profile_directory = os.path.dirname(os.path.abspath(__file__)) + PROFILE_FOLDER
+    formats = {}
+    if os.path.isdir(profile_directory):
+        for filename in os.listdir(profile_directory):
+            for profile_format, suffix in profiling.SUFFIXES.items():
+                if filename.endswith(suffix):
+                    formats.setdefault(filename[:-len(suffix)], []).append(profile_format)
+    profiles = [{'name': name, 'formats': sorted(formats[name])} for name in sorted(formats)]
+    return make_response(jsonify({'profiles': profiles}), 200)
+
+@APP.route('/profile/<name>', methods=['GET'])
+def get_profile(name):
+    """Downloads the profile of a run or request
+
+    **Example request**:
+
+    .. sourcecode::
+
+      GET /profile/2020-03-17 05:15:06.558356 example_experiment.py.csv?format=folded HTTP/1.1
+      Host: 127.0.0.1
+      Accept-Encoding: gzip, deflate, br
+      Connection: keep-alive
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: text/plain; charset=utf-8
+
+      run_experiment (example_experiment.py:5);wait_for_input (vending_machine.py:196) 812
+
+    format is folded for the sampled stacks, ready for flame graph tools such
+    as flamegraph.pl or speedscope, prof for cProfile statistics, or memory for
+    the tracemalloc report. It defaults to the format the profile was taken in.
+
+    :status 200: profile returned
+    :status 400: unknown format
+    :status 404: no profile of that name and format
+    """
+    profile_format = request.args.get('format')
+    if profile_format is not None and profile_format not in profiling.SUFFIXES:
+        return make_response(jsonify({
+            'message': f"Unknown profile format {profile_format}"}), 400)
+    # Names can't contain a slash, so the path stays in the profile folder
+    path = profile_path(name)
+    for candidate in ([profile_format] if profile_format else ['folded', 'prof']):
+        suffix = profiling.SUFFIXES[candidate]
+        if os.path.isfile(path + suffix):
+            mimetype = 'application/octet-stream' if candidate == 'prof' else 'text/plain'
+            response = send_file(path + suffix, mimetype=mimetype)
+            response.headers['Content-Disposition'] = f'attachment; filename="{name}{suffix}"'
+            return response
+    return make_response(jsonify({'message': f"No profile named {name}"}), 404)
+
+@APP.route('/analytics/accuracy', methods=['GET'])
+def get_accuracy():
+    """Returns the accuracy of the trials of each day, across all experiment logs
+
+    **Example request**:
+
+    .. sourcecode::
+
+      GET /analytics/accuracy?experiment=example_experiment.py&since=2020-01-01 HTTP/1.1
+      Host: 127.0.0.1
+      Accept-Encoding: gzip, deflate, br
+      Connection: keep-alive
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/json
+
+      {
+        "days": [
+          {
+            "day": "2020-03-17",
+            "trials": 20,
+            "correct": 15,
+            "accuracy": 0.75,
+            "no_selection": 1,
+            "mean_reaction_ms": 2140.5
+          }
+        ]
+      }
+
+    Trials are read from the "Trial N correct stimuli displayed on SIDE",
+    "Trial N picked SIDE" and "Trial N no selection made." log messages, and
+    grouped by UTC day. Logs written since the last request are ingested first.
+    All query parameters are optional: experiment is the filename of the
+    experiment, since and until are YYYY-MM-DD days, both included.
+
+    :status 200: accuracy successfully returned
+    :status 400: malformed since or until date
+    """
+    since = request.args.get('since')
+    until = request.args.get('until')
+    for day in (since, until):
+        try:
+            if day is not None:
+                datetime.strptime(day, '%Y-%m-%d')
+        except ValueError:
+            return make_response(jsonify({
+                'message': f"Error with request: {day} is not a YYYY-MM-DD date."}), 400)
+    ingest_logs()
+    days = get_log_analytics().accuracy(request.args.get('experiment'), since, until)
+    return make_response(jsonify({'days': days}), 200)
+
+@APP.route('/rig', methods=['GET'])
+def list_rigs():
+    """Returns the configured rigs and whether each is running an experiment
+
+    **Example request**:
+
+    .. sourcecode::
+
+      GET /rig HTTP/1.1
+      Host: 127.0.0.1
+      Accept-Encoding: gzip, deflate, br
+      Connection: keep-alive
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/json; charset=utf-8
+      Content-Length: 212
+      Server: Werkzeug/0.16.1 Python/3.8.1
+      Date: Thu, 13 Feb 2020 15:35:32 GMT
+
+      {
+        "rigs": [
+          {
+            "busy": true,
+            "hosts": ["192.168.1.11", "192.168.1.12", "192.168.1.13"],
+            "log_file": "2020-03-17 05:15:06.558356 example_experiment.csv",
+            "name": "default"
+          }
+        ]
+      }
+
+    :status 200: rig list successfully returned
+    """
+    rigs = [rig.status() for rig in get_rig_registry()]
+    return make_response(jsonify({'rigs': rigs}), 200)
+
+@APP.route('/rig/<name>/calibrate', methods=['POST'])
+def calibrate_rig(name):
+    """Computes the threshold of each sensor of a rig from samples of its empty enclosure
+
+    **Example request**:
+
+    .. sourcecode::
+
+      POST /rig/default/calibrate?duration=5 HTTP/1.1
+      Host: 127.0.0.1
+      Accept-Encoding: gzip, deflate, br
+      Connection: keep-alive
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/json
+
+      {
+        "message": "Calibrated rig default.",
+        "pins": [
+          {"pin": 0, "samples": 2480, "baseline": 702.4, "noise": 3.1, "minimum": 690,
+           "threshold": 617}
+        ],
+        "rig": "default"
+      }
+
+    Every sensor pin of the rig is sampled for duration seconds, 5 by default
+    and at most 20, so the request ends well before gunicorn's worker timeout,
+    while nothing should be in front of the sensors. The
+    threshold of each pin is stored in the rig's SENSOR_THRESHOLDS and saved,
+    so it is used by every following experiment on the rig, across restarts.
+    A pin which only read 0 gets a null threshold and keeps SENSOR_THRESHOLD.
+
+    :status 200: rig calibrated
+    :status 400: unknown rig or malformed duration
+    :status 409: the rig is running an experiment
+    :status 500: the sensors could not be read
+    """
+    try:
+        rig = get_rig_registry().get(name)
+    except KeyError:
+        return make_response(jsonify({'message': f"No rig named {name}"}), 400)
+    try:
+        duration = float(request.args.get('duration', calibration.DEFAULT_DURATION))
+    except ValueError:
+        duration = 0
+    if not 0 < duration <= calibration.MAX_DURATION:
+        return make_response(jsonify({
+            'message': "Error with request: duration must be a number of seconds up to "
+                       f"{calibration.MAX_DURATION:g}."
+        }), 400)
+    results = {}
+
+    def calibrate():
+        vending_machine = VendingMachine(rig.hosts, rig.vending_machine_config())
+        try:
+            results['pins'] = vending_machine.calibrate(duration)
+        except OSError as error:
+            results['error'] = str(error)
+        finally:
+            vending_machine.close()
+
+    # Calibrating on the rig's thread keeps experiments off the sensors meanwhile
+    try:
+        rig.start(calibrate, None)
+    except RigBusyError as error:
+        return make_response(jsonify({'message': str(error)}), 409)
+    rig.wait()
+    if 'pins' not in results:
+        return make_response(jsonify({
+            'message': f"Calibration of rig {name} failed: {results.get('error')}"}), 500)
+    thresholds = calibration.thresholds_by_pin(results['pins'])
+    rig.config['SENSOR_THRESHOLDS'] = thresholds
+    calibration.save_calibration(
+        os.path.dirname(os.path.abspath(__file__)) + CALIBRATION_FILE, rig.name, thresholds)
+    return make_response(jsonify({
+        'message': f"Calibrated rig {name}.", 'pins': results['pins'], 'rig': rig.name}), 200)
+
+@APP.route('/hosts', methods=['GET'])
+def list_hosts():
+    """Returns the availability and latency of the Pis of every rig
+
+    **Example request**:
+
+    .. sourcecode::
+
+      GET /hosts HTTP/1.1
+      Host: 127.0.0.1
+      Accept-Encoding: gzip, deflate, br
+      Connection: keep-alive
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/json
+
+      {
+        "hosts": [
+          {
+            "breaker": "closed",
+            "checked_at": "2020-03-17 05:15:06.558356",
+            "failures": 0,
+            "host": "192.168.1.11",
+            "latency_ms": 1.204,
+            "up": true
+          }
+        ]
+      }
+
+    Hosts are probed by opening a TCP connection to their SSH port. When
+    HOST_MONITOR_INTERVAL is set, they are probed in the background and the
+    latest results are returned, otherwise, or with refresh=true, they are
+    probed for the request. breaker is the state of the circuit breaker of the
+    host: commands to a host whose breaker is open fail immediately.
+
+    :status 200: host states successfully returned
+    """
+    monitor = get_host_monitor()
+    if monitor.running and request.args.get('refresh', 'false').lower() != 'true':
+        hosts = monitor.status()
+    else:
+        hosts = monitor.probe_all()
+    return make_response(jsonify({'hosts': hosts}), 200)
+
+def rig_screen_resolution(rig):
+    """Returns the resolution of a rig's screens, from its config or the flask config.
+
+    Parameters:
+        rig (Rig): The rig
+
+    Returns:
+        tuple: The width and height of the screens, in pixels
+    """
+    return tuple(rig.config.get('SCREEN_RESOLUTION', APP.config['SCREEN_RESOLUTION']))
+
+def normalize_uploaded_image(local_image_path, filename):
+    """Writes copies of an image pre-scaled to the screen resolution of each rig.
+
+    Parameters:
+        local_image_path (str): The local path of the uploaded image
+        filename (str): The filename of the uploaded image
+
+    Returns:
+        dict: Maps each resolution for which a copy was written to the local
+        path of the copy
+    """
+    display_path = os.path.dirname(os.path.abspath(__file__)) + IMAGE_DISPLAY_FOLDER
+    display_copies = {}
+    for resolution in {rig_screen_resolution(rig) for rig in get_rig_registry()}:
+        copy_path = os.path.join(display_path, '{}x{}'.format(*resolution))
+        if image_variants.normalize_for_display(os.path.join(local_image_path, filename),
+                                                os.path.join(copy_path, filename), resolution):
+            display_copies[resolution] = copy_path
+    return display_copies
+
+def add_remote_image(local_image_path, filename, display_copies=None):
+    """Adds an image to the remote hosts of every rig defined in flask config.
 
     Parameters:
         local_image_path (str): The local path of the image to be copied
         filename (str): The filename of the local file to be copied
+        display_copies (dict): Maps screen resolutions to the local path of a
+            copy of the image pre-scaled to that resolution, as returned by
+            normalize_uploaded_image. Rigs with a copy for their resolution
+            get the copy instead of the original.
 
     Raises:
         CalledProcessError: If scp or ssh calls fail for one of the hosts
+        HostDownError: If one of the hosts is known to be down
     """
-    for host in APP.config['REMOTE_HOSTS']:
-        user = APP.config['REMOTE_HOST_USERNAME']
-        directory = APP.config['REMOTE_IMAGE_DIRECTORY']
-        ssh_command = f'''ssh -oStrictHostKeyChecking=accept-new -i ~/.ssh/id_rsa \
-            {user}@{host} mkdir -p {directory}'''
-        subprocess.run(ssh_command, check=True, shell=True)
-        scp_command = f"scp {local_image_path}/{filename} {user}@{host}:{directory}/{filename}"
-        subprocess.run(scp_command, check=True, shell=True)
+    display_copies = display_copies or {}
+    for rig in get_rig_registry():
+        user = rig.config.get('REMOTE_HOST_USERNAME', APP.config['REMOTE_HOST_USERNAME'])
+        directory = rig.config.get('REMOTE_IMAGE_DIRECTORY', APP.config['REMOTE_IMAGE_DIRECTORY'])
+        source_path = display_copies.get(rig_screen_resolution(rig), local_image_path)
+        for host in rig.hosts:
+            # The image is removed first, as scp would write through a hard link left by dedupe
+            ssh_command = f'''ssh -oStrictHostKeyChecking=accept-new -i ~/.ssh/id_rsa \
+                {user}@{host} "mkdir -p {directory} && rm -f {directory}/{filename}"'''
+            scp_command = f"scp {source_path}/{filename} {user}@{host}:{directory}/{filename}"
+            with host_health.host_call(host):
+                subprocess.run(ssh_command, check=True, shell=True)
+                subprocess.run(scp_command, check=True, shell=True)
+
+def add_remote_link(existing_filename, filename):
+    """Adds an image to the remote hosts of every rig as a hard link to an image they already have.
+
+    Hosts missing the existing image get a copy of the local image instead.
+
+    Parameters:
+        existing_filename (str): The filename of the image already on the hosts
+        filename (str): The filename the image should also be available as
+
+    Raises:
+        CalledProcessError: If the ssh or scp calls fail for one of the hosts
+        HostDownError: If one of the hosts is known to be down
+    """
+    for rig in get_rig_registry():
+        user = rig.config.get('REMOTE_HOST_USERNAME', APP.config['REMOTE_HOST_USERNAME'])
+        directory = rig.config.get('REMOTE_IMAGE_DIRECTORY', APP.config['REMOTE_IMAGE_DIRECTORY'])
+        for host in rig.hosts:
+            ssh_command = f'''ssh -oStrictHostKeyChecking=accept-new -i ~/.ssh/id_rsa \
+                {user}@{host} ln -f {directory}/{existing_filename} {directory}/{filename}'''
+            with host_health.host_call(host):
+                try:
+                    subprocess.run(ssh_command, check=True, shell=True)
+                except CalledProcessError as error:
+                    if host_health.is_connection_failure(error):
+                        raise
+                    local_image_path = (os.path.dirname(os.path.abspath(__file__))
+                                        + IMAGE_UPLOAD_FOLDER)
+                    remove_command = f'''ssh -oStrictHostKeyChecking=accept-new -i ~/.ssh/id_rsa \
+                        {user}@{host} rm -f {directory}/{filename}'''
+                    scp_command = (f"scp {local_image_path}/{filename} "
+                                   f"{user}@{host}:{directory}/{filename}")
+                    subprocess.run(remove_command, check=True, shell=True)
+                    subprocess.run(scp_command, check=True, shell=True)
+
+def save_upload(file, path):
+    """Saves an uploaded file to a temporary file, then moves it over any file at path.
+
+    A deduplicated image is a hard link shared with another image, which saving
+    to the same filename in place would overwrite too. Replacing it only breaks
+    the link.
+
+    Parameters:
+        file (FileStorage): The uploaded file
+        path (str): The path to save the file to
+    """
+    temporary_path = f'{path}.{os.getpid()}.upload'
+    try:
+        file.save(temporary_path)
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+def link_duplicate(directory, existing_filename, filename):
+    """Replaces a file with a hard link to another file in the same directory.
+
+    Parameters:
+        directory (str): The directory holding both files
+        existing_filename (str): The filename of the file to link to
+        filename (str): The filename of the file to replace
+
+    Returns:
+        bool: True if the file was replaced, False if the link couldn't be created
+    """
+    temporary_path = os.path.join(directory, filename + '.link')
+    try:
+        os.link(os.path.join(directory, existing_filename), temporary_path)
+    except OSError:
+        return False
+    os.replace(temporary_path, os.path.join(directory, filename))
+    return True
+
+def link_uploaded_duplicate(save_path, existing_filename, filename):
+    """Replaces an uploaded image and its display copies with hard links to a duplicate.
+
+    Parameters:
+        save_path (str): The local image directory
+        existing_filename (str): The filename of the image the upload duplicates
+        filename (str): The filename of the uploaded image
+
+    Returns:
+        str: existing_filename if the upload was replaced, None if the link couldn't
+        be created, in which case the upload is kept as is
+    """
+    if not link_duplicate(save_path, existing_filename, filename):
+        return None
+    remove_display_copies(filename)
+    for copy_path in display_copy_folders():
+        link_duplicate(copy_path, existing_filename, filename)
+    return existing_filename
+
+def linkable_duplicate(image_index, metadata, filename, duplicates):
+    """Returns the closest duplicate an uploaded image can be replaced by a hard link to.
+
+    Near-duplicates are similar images, not the same file, so only one with the
+    same content, or with the same format and extension as the upload, is linked.
+    Anything else would serve another format under the upload's filename.
+
+    Parameters:
+        image_index (ImageIndex): The image index
+        metadata (dict): The metadata of the upload, as returned by read_image_metadata
+        filename (str): The filename of the upload
+        duplicates (list): (distance, filename) tuples returned by ImageIndex.find_similar
+
+    Returns:
+        str: The filename of the duplicate, None if none can be linked
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    for _, duplicate in duplicates:
+        existing = image_index.get(duplicate)
+        if existing is None:
+            continue
+        if existing['hash'] == metadata['hash'] or (
+                existing['format'] == metadata['format']
+                and os.path.splitext(duplicate)[1].lower() == extension):
+            return duplicate
+    return None
 
 def allowed_file(filename, allowed_extensions):
     """Determines whether an uploaded image file has an allowed extension.
@@ -152,12 +1113,36 @@ def upload_image():
       Date: Thu, 13 Feb 2020 15:35:32 GMT
 
       {
-          "message":"Success: Image saved."
+          "message":"Success: Image saved.",
+          "duplicates": [
+            {
+              "distance": 2,
+              "filename": "elephant_copy.jpeg"
+            }
+          ],
+          "linked_to": null
       }
 
     All requests sent to this route should have an image file
     included in the body of the request, otherwise a 400 error
-    will be returned
+    will be returned. Resized variants of the image are generated
+    in the background once it is saved.
+
+    The response lists the indexed images whose perceptual hash is
+    within DUPLICATE_DISTANCE bits of the upload's, closest first. When
+    the optional dedupe form field is true, the upload is replaced by a
+    hard link to the closest of them with the same content, or the same
+    format and extension, both here and on the Pis, instead of being
+    stored and copied again. linked_to then holds the filename of that
+    image. Other duplicates are only reported.
+
+    The optional tags form field holds comma separated tags, which are
+    stored in the image index along with the image's metadata.
+
+    When the optional normalize form field is true, or NORMALIZE_UPLOADS
+    is set in the flask config, the Pis of each rig get a copy of the
+    image pre-scaled to the rig's SCREEN_RESOLUTION instead of the
+    original.
 
     :status 201: file saved
     :status 400: malformed request
@@ -165,6 +1150,8 @@ def upload_image():
 
     response = ""
     response_code = 400
+    duplicates = []
+    linked_to = None
     if 'file' not in request.files:
         response = "Error with request: No file field in body of request."
     else:
@@ -174,18 +1161,141 @@ def upload_image():
         elif file and allowed_file(file.filename, ALLOWED_IMG_EXTENSIONS):
             filename = secure_filename(file.filename)
             save_path = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER
-            file.save(os.path.join(save_path, filename))
+            save_upload(file, os.path.join(save_path, filename))
             response = "Success: Image saved."
             response_code = 201
 
+            tags = [tag.strip() for tag in request.form.get('tags', '').split(',') if tag.strip()]
+            image_index = get_image_index()
+            try:
+                metadata = read_image_metadata(os.path.join(save_path, filename))
+            except FileNotFoundError:
+                # The file was removed again before it could be indexed
+                metadata = None
+            if metadata and metadata['phash']:
+                duplicates = image_index.find_similar(
+                    metadata['phash'], APP.config['DUPLICATE_DISTANCE'], exclude=filename)
+
+            if request.form.get('dedupe', 'false').lower() == 'true' and duplicates:
+                existing_filename = linkable_duplicate(image_index, metadata, filename, duplicates)
+                if existing_filename:
+                    linked_to = link_uploaded_duplicate(save_path, existing_filename, filename)
+            if metadata or linked_to:
+                # A linked upload now has the content of the existing image
+                image_index.add(filename, os.path.join(save_path, filename), tags,
+                                metadata=None if linked_to else metadata)
+
+            cache_path = os.path.dirname(os.path.abspath(__file__)) + IMAGE_CACHE_FOLDER
+            get_image_worker_pool().submit(
+                image_variants.generate_variants, os.path.join(save_path, filename), cache_path,
+                filename).add_done_callback(log_failure(f'Generating the variants of {filename}'))
+
+            normalize = request.form.get('normalize', str(APP.config['NORMALIZE_UPLOADS']))
+            display_copies = {}
+            if not linked_to:
+                remove_display_copies(filename)
+                if normalize.lower() == 'true':
+                    display_copies = normalize_uploaded_image(save_path, filename)
+
             try:
-                add_remote_image(save_path, filename)
+                if linked_to:
+                    add_remote_link(linked_to, filename)
+                else:
+                    add_remote_image(save_path, filename, display_copies)
             except CalledProcessError:
                 response = "Error: Failed to copy file to hosts"
                 response_code = 500
+            except host_health.HostDownError as error:
+                response = f"Error: Failed to copy file to hosts, {error}"
+                response_code = 500
         else:
             response = "Error with request: File extension not allowed."
-    return  make_response(jsonify({'message': response}), response_code)
+    duplicates = [{'filename': name, 'distance': distance} for distance, name in duplicates]
+    return  make_response(jsonify({'message': response, 'duplicates': duplicates,
+                                   'linked_to': linked_to}), response_code)
+
+def display_copy_folders():
+    """Returns the folders of the display copies written by normalize_uploaded_image.
+
+    Returns:
+        list: The path of the folder of each resolution, none if no copy was
+        ever written and the display folder doesn't exist
+    """
+    display_path = os.path.dirname(os.path.abspath(__file__)) + IMAGE_DISPLAY_FOLDER
+    try:
+        return [entry.path for entry in os.scandir(display_path) if entry.is_dir()]
+    except FileNotFoundError:
+        return []
+
+def remove_display_copies(filename):
+    """Removes the copies of an image written by normalize_uploaded_image.
+
+    Parameters:
+        filename (str): The filename of the image
+    """
+    for copy_path in display_copy_folders():
+        try:
+            os.remove(os.path.join(copy_path, filename))
+        except FileNotFoundError:
+            pass
+
+def forget_image(filename):
+    """Removes everything derived from a deleted image: variants, display copies and index entry.
+
+    Parameters:
+        filename (str): The filename of the deleted image
+    """
+    image_variants.forget_variants(
+        os.path.dirname(os.path.abspath(__file__)) + IMAGE_CACHE_FOLDER, filename)
+    remove_display_copies(filename)
+    get_image_index().remove(filename)
+
+def batch_delete(kind, on_delete=None):
+    """Deletes the files of an upload or log directory selected by the JSON body of the request.
+
+    The body holds any combination of files, a list of filenames, pattern, a glob
+    pattern the filenames must match, and before, a YYYY-MM-DD or
+    YYYY-MM-DDTHH:MM:SS local date the files must have been modified before.
+    At least one of them is required, so an empty body can't delete every file.
+
+    Parameters:
+        kind (str): 'image', 'experiment' or 'log'
+        on_delete (callable): Called with the name of each deleted file
+
+    Returns:
+        Response: The names of the deleted files and of the files which couldn't
+        be deleted, logs being named without any .gz suffix, or a 400 response if
+        the body is malformed
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not {'files', 'pattern', 'before'} & body.keys():
+        return make_response(jsonify({
+            'message': "Error with request: Specify files, pattern or before."}), 400)
+    names = body.get('files')
+    if names is not None and (not isinstance(names, list)
+                              or not all(isinstance(name, str) for name in names)):
+        return make_response(jsonify({
+            'message': "Error with request: files must be a list of filenames."}), 400)
+    try:
+        before = retention.parse_date(body['before']) if 'before' in body else None
+    except (TypeError, ValueError):
+        return make_response(jsonify({
+            'message': "Error with request: before must be a date."}), 400)
+    directory = os.path.dirname(os.path.abspath(__file__)) + BATCH_DELETE_FOLDERS[kind]
+    # Compressed logs are selected by their original name
+    suffixes = (log_archive.COMPRESSED_SUFFIX,) if kind == 'log' else ()
+    entries = retention.select_files(directory, names, body.get('pattern'), before,
+                                     suffixes=suffixes)
+    deleted, failed = retention.delete_files(entries, on_delete)
+    if kind == 'log':
+        # Clients know logs by their name, whether or not their file was compressed
+        deleted = list(dict.fromkeys(log_archive.log_name(name) for name in deleted))
+        failed = list(dict.fromkeys(log_archive.log_name(name) for name in failed))
+    return make_response(jsonify({
+        'message': f"Deleted {len(deleted)} of {len(entries)} selected files.",
+        'deleted': deleted,
+        'failed': failed,
+    }), 200)
 
 @APP.route('/image/<filename>', methods=['DELETE'])
 def delete_image(filename):
@@ -221,9 +1331,10 @@ def delete_image(filename):
     image_directory = os.path.dirname(os.path.abspath(__file__)) + IMAGE_UPLOAD_FOLDER
     response_code = 400
     response = ""
-    if filename in os.listdir(image_directory):
+    if os.path.lexists(os.path.join(image_directory, filename)):
         try:
             os.remove(os.path.join(image_directory, filename))
+            forget_image(filename)
             response = f"File {filename} was successfully deleted."
             response_code = 200
         except IsADirectoryError:
@@ -232,6 +1343,44 @@ def delete_image(filename):
         response = f"File {filename} does not exist and so couldn't be deleted."
     return make_response(jsonify({'message': response}), response_code)
 
+@APP.route('/image', methods=['DELETE'])
+def delete_images():
+    """Deletes several image files at once, selected by name, glob pattern or date
+
+    **Example request**:
+
+    .. sourcecode::
+
+      DELETE /image HTTP/1.1
+      Host: 127.0.0.1
+      Content-Type: application/json
+
+      {
+        "pattern": "old_*.png",
+        "before": "2020-03-01"
+      }
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/json
+
+      {
+        "message": "Deleted 1 of 1 selected files.",
+        "deleted": ["old_blank.png"],
+        "failed": []
+      }
+
+    The body is described in batch_delete. Files which can't be deleted,
+    such as directories, are listed in failed.
+
+    :status 200: matching image files deleted
+    :status 400: malformed request
+    """
+    return batch_delete('image', on_delete=forget_image)
+
 @APP.route('/image', methods=['GET'])
 def list_images():
     """Returns a list of images from the images directory
@@ -259,23 +1408,135 @@ def list_images():
         "files": [
           "http://localhost/static/img/allBlack.png",
           "http://localhost/static/img/whiteStimuli.png"
+        ],
+        "images": [
+          {
+            "height": 1080,
+            "name": "allBlack.png",
+            "url": "http://localhost/static/img/allBlack.png",
+            "variants": {
+              "preview": {
+                "height": 576,
+                "url": "http://localhost/static/img_cache/3f/3f9a...c1/preview.webp",
+                "width": 1024
+              },
+              "thumbnail": {
+                "height": 144,
+                "url": "http://localhost/static/img_cache/3f/3f9a...c1/thumbnail.webp",
+                "width": 256
+              }
+            },
+            "width": 1920
+          },
+          {
+            "height": null,
+            "name": "whiteStimuli.png",
+            "url": "http://localhost/static/img/whiteStimuli.png",
+            "variants": {},
+            "width": null
+          }
         ]
       }
 
+    Dimensions and variants are null and empty until the variants of a
+    newly uploaded image have been generated.
+
     :status 200: image file list successfully returned
     """
     resource_route = "/static/img/"
-    file_request_path = request.base_url[:request.base_url.rfind('/')] + resource_route
+    base_path = request.base_url[:request.base_url.rfind('/')]
+    file_request_path = base_path + resource_route
     path_to_current_file = os.path.dirname(os.path.abspath(__file__))
     images_path = os.path.join(path_to_current_file, 'static', 'img')
+    cache_path = path_to_current_file + IMAGE_CACHE_FOLDER
     directory_list = os.listdir(images_path)
     image_files = [f for f in directory_list if os.path.isfile(os.path.join(images_path, f))]
     image_files.sort()
     if '.gitignore' in image_files:
         image_files.remove('.gitignore')
     full_image_paths = [file_request_path + f for f in image_files]
+    images = []
+    for image_file in image_files:
+        manifest = image_variants.find_manifest(cache_path, image_file) or {}
+        variants = {
+            name: {
+                'url': base_path + IMAGE_CACHE_FOLDER + '/' + variant['path'],
+                'width': variant['width'],
+                'height': variant['height'],
+            } for name, variant in manifest.get('variants', {}).items()
+        }
+        images.append({
+            'name': image_file,
+            'url': file_request_path + image_file,
+            'width': manifest.get('width'),
+            'height': manifest.get('height'),
+            'variants': variants,
+        })
     response_code = 200
-    return make_response(jsonify({'files': full_image_paths}), response_code)
+    return make_response(jsonify({'files': full_image_paths, 'images': images}), response_code)
+
+@APP.route('/image/search', methods=['GET'])
+def search_images():
+    """Returns the images matching the query parameters, answered from the image index
+
+    **Example request**:
+
+    .. sourcecode::
+
+      GET /image/search?prefix=white&tag=training&min_width=1000 HTTP/1.1
+      Host: 127.0.0.1
+      Accept-Encoding: gzip, deflate, br
+      Connection: keep-alive
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/json; charset=utf-8
+      Content-Length: 312
+      Server: Werkzeug/0.16.1 Python/3.8.1
+      Date: Thu, 13 Feb 2020 15:35:32 GMT
+
+      {
+        "images": [
+          {
+            "filename": "whiteStimuli.png",
+            "format": "PNG",
+            "hash": "3f9a...c1",
+            "height": 1080,
+            "size": 20431,
+            "tags": ["training"],
+            "uploaded_at": "2020-03-17 05:15:06.558356",
+            "url": "http://localhost/static/img/whiteStimuli.png",
+            "width": 1920
+          }
+        ]
+      }
+
+    All query parameters are optional: prefix matches the start of the
+    filename, tag may be repeated and every tag must match, min_width,
+    max_width, min_height and max_height bound the dimensions in pixels
+    and limit caps the number of results, 100 by default.
+
+    :status 200: matching images successfully returned
+    :status 400: a dimension or limit parameter is not an integer
+    """
+    try:
+        dimensions = {name: int(request.args[name])
+                      for name in ('min_width', 'max_width', 'min_height', 'max_height')
+                      if name in request.args}
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        response = "Error with request: Dimensions and limit must be integers."
+        return make_response(jsonify({'message': response}), 400)
+    images = get_image_index().search(prefix=request.args.get('prefix'),
+                                      tags=request.args.getlist('tag'),
+                                      limit=limit, **dimensions)
+    file_request_path = request.base_url[:request.base_url.rfind('/image/search')] + '/static/img/'
+    for image in images:
+        image['url'] = file_request_path + image['filename']
+    return make_response(jsonify({'images': images}), 200)
 
 @APP.route('/experiment', methods=['POST'])
 def upload_experiment():
@@ -370,7 +1631,7 @@ def delete_experiment(filename):
     experiment_directory = os.path.dirname(os.path.abspath(__file__)) + EXPERIMENT_UPLOAD_FOLDER
     response_code = 400
     response = ""
-    if filename in os.listdir(experiment_directory):
+    if os.path.lexists(os.path.join(experiment_directory, filename)):
         try:
             os.remove(os.path.join(experiment_directory, filename))
             response = f"File {filename} was successfully deleted."
@@ -381,6 +1642,44 @@ def delete_experiment(filename):
         response = f"File {filename} does not exist and so couldn't be deleted."
     return make_response(jsonify({'message': response}), response_code)
 
+@APP.route('/experiment', methods=['DELETE'])
+def delete_experiments():
+    """Deletes several experiment files at once, selected by name, glob pattern or date
+
+    **Example request**:
+
+    .. sourcecode::
+
+      DELETE /experiment HTTP/1.1
+      Host: 127.0.0.1
+      Content-Type: application/json
+
+      {
+        "pattern": "test*.py",
+        "before": "2020-03-01"
+      }
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/json
+
+      {
+        "message": "Deleted 1 of 1 selected files.",
+        "deleted": ["testColorPerception.py"],
+        "failed": []
+      }
+
+    The body is described in batch_delete. Files which can't be deleted,
+    such as directories, are listed in failed.
+
+    :status 200: matching experiment files deleted
+    :status 400: malformed request
+    """
+    return batch_delete('experiment')
+
 @APP.route('/experiment', methods=['GET'])
 def list_experiments():
     """Returns a list of experiments from the experiment directory
@@ -426,6 +1725,73 @@ def list_experiments():
     response_code = 200
     return make_response(jsonify({'files': full_experiment_paths}), response_code)
 
+@APP.route('/log/export', methods=['GET'])
+def export_logs():
+    """Streams a zip of the logs matching a filter
+
+    **Example request**:
+
+    .. sourcecode::
+
+      GET /log/export?experiment=example_experiment.py&since=2020-03-09&until=2020-03-15 HTTP/1.1
+      Host: 127.0.0.1
+      Accept-Encoding: gzip, deflate, br
+      Connection: keep-alive
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/zip
+      Content-Disposition: attachment; filename=logs.zip
+
+      <zip of the csv logs>
+
+    All query parameters are optional: experiment is the filename of the
+    experiment which wrote the logs, since and until are YYYY-MM-DD days, both
+    included, compared with the UTC day each log was started. Without any of
+    them every log is exported. Compressed logs are exported decompressed,
+    under their original name. The zip is built while it is sent, so the first
+    bytes arrive at once whatever the size of the export.
+
+    :status 200: zip of the matching logs returned
+    :status 400: malformed since or until date
+    :status 404: no log matches the filter
+    """
+    since = request.args.get('since')
+    until = request.args.get('until')
+    experiment = request.args.get('experiment')
+    for day in (since, until):
+        try:
+            if day is not None:
+                datetime.strptime(day, '%Y-%m-%d')
+        except ValueError:
+            return make_response(jsonify({
+                'message': f"Error with request: {day} is not a YYYY-MM-DD date."}), 400)
+    log_directory = os.path.dirname(os.path.abspath(__file__)) + LOG_FOLDER
+    names = []
+    for name in sorted({log_archive.log_name(f) for f in os.listdir(log_directory)}):
+        if name == '.gitignore' or not os.path.isfile(log_archive.find_log(log_directory, name)):
+            continue
+        if experiment is not None or since is not None or until is not None:
+            match = LOG_NAME_PATTERN.match(name)
+            if match is None:
+                continue
+            day = match.group(1)[:10]
+            if ((experiment is not None and match.group(2) != experiment)
+                    or (since is not None and day < since)
+                    or (until is not None and day > until)):
+                continue
+        names.append(name)
+    if not names:
+        return make_response(jsonify({'message': "No log matches the filter."}), 404)
+    # Logs are found again when streamed, in case they were compressed in the meantime
+    logs = ((name, log_archive.find_log(log_directory, name)) for name in names)
+    response = Response(log_archive.stream_zip(logs), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename=logs.zip'
+    return response
+
 @APP.route('/log/<filename>', methods=['DELETE'])
 def delete_log(filename):
     """Returns a message indicating whether deletion of the specified file was successful
@@ -454,15 +1820,19 @@ def delete_log(filename):
         "message": "File somelog.csv was successfully deleted."
       }
 
+    Compressed logs are deleted the same way, by their name without the .gz suffix.
+
     :status 200: log file successfully deleted
     :status 400: file with specified name could not be found
     """
     log_directory = os.path.dirname(os.path.abspath(__file__)) + LOG_FOLDER
     response_code = 400
     response = ""
-    if filename in os.listdir(log_directory):
+    log_path = log_archive.find_log(log_directory, filename)
+    if log_path is not None:
         try:
-            os.remove(os.path.join(log_directory, filename))
+            os.remove(log_path)
+            forget_log(filename)
             response = f"File {filename} was successfully deleted."
             response_code = 200
         except IsADirectoryError:
@@ -471,6 +1841,175 @@ def delete_log(filename):
         response = f"File {filename} does not exist and so couldn't be deleted."
     return make_response(jsonify({'message': response}), response_code)
 
+@APP.route('/log/<filename>', methods=['GET'])
+def get_log(filename):
+    """Returns the content of a log file, compressed or not
+
+    **Example request**:
+
+    .. sourcecode::
+
+      GET /log/somelog.csv HTTP/1.1
+      Host: 127.0.0.1
+      Accept-Encoding: gzip, deflate, br
+      Connection: keep-alive
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: text/csv; charset=utf-8
+      Content-Encoding: gzip
+      Vary: Accept-Encoding
+
+      <gzipped csv>
+
+    Compressed logs are sent as is with a gzip Content-Encoding to clients
+    accepting it, and decompressed on the fly for other clients.
+
+    :status 200: log file returned
+    :status 404: log with specified name could not be found
+    """
+    log_directory = os.path.dirname(os.path.abspath(__file__)) + LOG_FOLDER
+    log_path = log_archive.find_log(log_directory, filename)
+    if log_path is None or not os.path.isfile(log_path):
+        return make_response(jsonify({
+            'message': f"File {filename} does not exist."}), 404)
+    mimetype = 'text/csv'
+    if not log_path.endswith(log_archive.COMPRESSED_SUFFIX):
+        response = send_file(log_path, mimetype=mimetype)
+    elif 'gzip' in request.accept_encodings:
+        response = send_file(log_path, mimetype=mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        def decompress():
+            with log_archive.open_log(log_path) as log:
+                for line in log:
+                    yield line
+        response = Response(decompress(), mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    return response
+
+@APP.route('/log/<filename>/trace', methods=['GET'])
+def get_log_trace(filename):
+    """Returns the raw sensor samples recorded around a logged event
+
+    **Example request**:
+
+    .. sourcecode::
+
+      GET /log/somelog.csv/trace?line=12&window_ms=50 HTTP/1.1
+      Host: 127.0.0.1
+      Accept-Encoding: gzip, deflate, br
+      Connection: keep-alive
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/json
+
+      {
+        "event": {
+          "line": 12,
+          "timestamp": "2020-03-17 05:15:20.101402",
+          "message": "Trial 3 picked left",
+          "monotonic": 4412.236118
+        },
+        "pins": [0, 1, 2],
+        "samples": [
+          {"offset_ms": -2.4, "readings": [812, 0, 790]},
+          {"offset_ms": 0.0, "readings": [31, 0, 788]}
+        ]
+      }
+
+    line is the 1-based line of the event in the log, which must have been
+    written with monotonic times. The samples recorded by wait_for_input
+    within window_ms milliseconds of the event, 1000 by default, are returned
+    with their time relative to the event, and the reading of each pin. Traces
+    are only recorded when RECORD_SENSOR_TRACES is set.
+
+    :status 200: samples successfully returned
+    :status 400: malformed line or window_ms, or the line has no monotonic time
+    :status 404: the log or its trace could not be found
+    """
+    try:
+        line = int(request.args['line'])
+        window_ms = float(request.args.get('window_ms', 1000))
+    except (KeyError, ValueError):
+        return make_response(jsonify({
+            'message': "Error with request: line must be a line number and window_ms a number."
+        }), 400)
+    log_directory = os.path.dirname(os.path.abspath(__file__)) + LOG_FOLDER
+    log_path = log_archive.find_log(log_directory, filename)
+    if log_path is None or not os.path.isfile(log_path):
+        return make_response(jsonify({'message': f"File {filename} does not exist."}), 404)
+    row = None
+    with log_archive.open_log(log_path) as log:
+        for number, log_row in enumerate(csv.reader(log), 1):
+            if number == line:
+                row = log_row
+                break
+    try:
+        event_time = float(row[2])
+    except (TypeError, IndexError, ValueError):
+        return make_response(jsonify({
+            'message': f"Error with request: Line {line} of {filename} has no monotonic time."
+        }), 400)
+    try:
+        with sensor_trace.TraceReader(trace_path(filename)) as trace:
+            pins = trace.pins
+            samples = trace.around(event_time, window_ms / 1000)
+    except (OSError, ValueError):
+        return make_response(jsonify({
+            'message': f"No sensor trace was recorded for {filename}."}), 404)
+    return make_response(jsonify({
+        'event': {'line': line, 'timestamp': row[0], 'message': row[1], 'monotonic': event_time},
+        'pins': pins,
+        'samples': [{'offset_ms': round((sample_time - event_time) * 1000, 3),
+                     'readings': list(readings)} for sample_time, readings in samples],
+    }), 200)
+
+@APP.route('/log', methods=['DELETE'])
+def delete_logs():
+    """Deletes several log files at once, selected by name, glob pattern or date
+
+    **Example request**:
+
+    .. sourcecode::
+
+      DELETE /log HTTP/1.1
+      Host: 127.0.0.1
+      Content-Type: application/json
+
+      {
+        "pattern": "*.csv",
+        "before": "2020-03-01"
+      }
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+      HTTP/1.0 200 OK
+      Content-Type: application/json
+
+      {
+        "message": "Deleted 1 of 1 selected files.",
+        "deleted": ["2020-02-13 15:35:32.000000 exampleExperiment.csv"],
+        "failed": []
+      }
+
+    The body is described in batch_delete. Files which can't be deleted,
+    such as directories, are listed in failed.
+
+    :status 200: matching log files deleted
+    :status 400: malformed request
+    """
+    return batch_delete('log', forget_log)
+
 @APP.route('/log', methods=['GET'])
 def list_logs():
     """Returns a list of log resources from the log directory.
@@ -501,6 +2040,9 @@ def list_logs():
         ]
       }
 
+    Compressed logs are listed under their original name. nginx serves them
+    from their .gz file, with a gzip Content-Encoding for clients accepting it.
+
     :status 200: log file list successfully returned
     """
     resource_route = "/static/log/"
@@ -508,8 +2050,9 @@ def list_logs():
     path_to_current_file = os.path.dirname(os.path.abspath(__file__))
     logs_path = os.path.join(path_to_current_file, 'static', 'log')
     directory_list = os.listdir(logs_path)
-    log_files = [f for f in directory_list if os.path.isfile(os.path.join(logs_path, f))]
-    log_files.sort()
+    # A log being compressed briefly exists in both forms, list it once
+    log_files = sorted({log_archive.log_name(f) for f in directory_list
+                        if os.path.isfile(os.path.join(logs_path, f))})
     if '.gitignore' in log_files:
         log_files.remove('.gitignore')
     full_log_paths = [file_request_path + f for f in log_files]
@@ -0,0 +1,131 @@
+"""Precomputed LED patterns for the Pi agent.
+
+Each pattern is rendered once into a tuple of frames, where a frame is an array of
+packed 24 bit colors holding one entry per pixel. Rendered patterns are cached, so
+displaying a pattern only costs writing whole frames to the strip at a fixed frame
+rate. Consecutive identical frames are the same array object, allowing the player
+to skip redundant calls to show().
+
+Patterns:
+    solid: The color on every pixel for the whole duration.
+    flash: The color blinking on and off FLASH_COUNT times.
+    pulse: The color fading in and back out.
+    chase: A short tail of the color running around the strip.
+    gradient: The color fading out along the strip, rotating once over the duration.
+"""
+from array import array
+from functools import lru_cache
+import math
+
+FRAME_RATE = 50
+FLASH_COUNT = 3
+CHASE_TAIL = 4
+
+
+def scale(pixel_color, factor):
+    """Scales the brightness of a packed color.
+
+    Parameters:
+        pixel_color (int): The packed color.
+        factor (float): A number in the range 0-1.
+
+    Returns:
+        int: The packed scaled color.
+    """
+    red = int(((pixel_color >> 16) & 0xff) * factor)
+    green = int(((pixel_color >> 8) & 0xff) * factor)
+    blue = int((pixel_color & 0xff) * factor)
+    return (red << 16) | (green << 8) | blue
+
+
+def fill(pixel_color, led_count):
+    """Returns a frame with every pixel set to the specified color."""
+    return array('I', [pixel_color]) * led_count
+
+
+def _solid(pixel_color, num_frames, led_count):
+    frame = fill(pixel_color, led_count)
+    return [frame] * num_frames
+
+
+def _flash(pixel_color, num_frames, led_count):
+    on_frame = fill(pixel_color, led_count)
+    off_frame = fill(0, led_count)
+    period = num_frames / FLASH_COUNT
+    return [on_frame if (i % period) < period / 2 else off_frame for i in range(num_frames)]
+
+
+def _pulse(pixel_color, num_frames, led_count):
+    return [fill(scale(pixel_color, math.sin(math.pi * (i + 0.5) / num_frames)), led_count)
+            for i in range(num_frames)]
+
+
+def _chase(pixel_color, num_frames, led_count):
+    tail = [scale(pixel_color, (CHASE_TAIL - i) / CHASE_TAIL) for i in range(CHASE_TAIL)]
+    frames = []
+    for i in range(num_frames):
+        frame = fill(0, led_count)
+        head = i % led_count
+        for offset, tail_color in enumerate(tail):
+            frame[(head - offset) % led_count] = tail_color
+        frames.append(frame)
+    return frames
+
+
+def _gradient(pixel_color, num_frames, led_count):
+    base = array('I', [scale(pixel_color, (led_count - i) / led_count) for i in range(led_count)])
+    frames = []
+    for i in range(num_frames):
+        shift = i * led_count // num_frames
+        frames.append(base[-shift:] + base[:-shift] if shift else base)
+    return frames
+
+
+PATTERNS = {
+    'solid': _solid,
+    'flash': _flash,
+    'pulse': _pulse,
+    'chase': _chase,
+    'gradient': _gradient,
+}
+
+
+@lru_cache(maxsize=64)
+def render(name, pixel_color, duration, led_count, frame_rate=FRAME_RATE):
+    """Renders a pattern into frames, followed by a frame turning every pixel off.
+
+    Parameters:
+        name (str): The name of the pattern, one of the keys of PATTERNS.
+        pixel_color (int): The packed color of the pattern.
+        duration (int): The number of milliseconds the pattern should last.
+        led_count (int): The number of pixels on the strip.
+        frame_rate (int): The number of frames displayed per second.
+
+    Returns:
+        tuple: The frames to display, one every 1 / frame_rate seconds.
+
+    Raises:
+        ValueError: If there is no pattern with the specified name.
+    """
+    if name not in PATTERNS:
+        raise ValueError(f'Unknown pattern {name}')
+    num_frames = max(1, round(duration * frame_rate / 1000))
+    frames = PATTERNS[name](pixel_color, num_frames, led_count)
+    return tuple(frames) + (fill(0, led_count),)
+
+
+def write_frame(strip, frame):
+    """Writes a whole frame to the strip, displayed on the next call to show().
+
+    Parameters:
+        strip: An Adafruit_NeoPixel or FakeStrip instance.
+        frame (array): The packed color of every pixel.
+    """
+    # Slice assignment to the strip's LED data avoids a method call per pixel.
+    # pylint: disable=protected-access
+    led_data = getattr(strip, '_led_data', None)
+    if led_data is not None:
+        led_data[0:len(frame)] = frame
+    else:
+        for i, pixel_color in enumerate(frame):
+            strip.setPixelColor(i, pixel_color)
@@ -1,7 +1,6 @@
 import serial
-from sys import version_info
-
-PY2 = version_info[0] == 2   #Running Python 2.x?
+import struct
+from contextlib import contextmanager
 
 #
 #---------------------------
@@ -16,6 +15,18 @@ PY2 = version_info[0] == 2   #Running Python 2.x?
 # These functions provide access to many of the Maestro's capabilities using the
 # Pololu serial protocol
 #
+# Commands are built in preallocated bytearrays rather than by concatenating strings.
+# Several commands can be coalesced into a single USB write with Controller.batch().
+#
+class Batch:
+    # Collects the bytes of the commands issued inside a Controller.batch() block,
+    # and the channels whose positions were requested.  After the block, positions
+    # holds the position read back for each requested channel, in request order.
+    def __init__(self):
+        self.buffer = bytearray()
+        self.channels = []
+        self.positions = None
+
 class Controller:
     # When connected via USB, the Maestro creates two virtual serial ports
     # /dev/ttyACM0 for commands and /dev/ttyACM1 for communications.
@@ -32,7 +43,14 @@ class Controller:
         # Open the command port
         self.usb = serial.Serial(ttyStr)
         # Command lead-in and device number are sent for each Pololu serial command.
-        self.PololuCmd = chr(0xaa) + chr(device)
+        self.PololuCmd = bytearray((0xaa, device))
+        # Preallocated buffers for 2 and 4 byte commands, lead-in included.
+        self._cmd2 = bytearray((0xaa, device, 0, 0))
+        self._cmd4 = bytearray((0xaa, device, 0, 0, 0, 0))
+        # Prebuilt getPositions commands and reply formats, keyed by channel tuple.
+        self._positionCmds = {}
+        # Batch currently collecting commands, see batch().
+        self._batch = None
         # Track target position for each servo. The function isMoving() will
         # use the Target vs Current servo position to determine if movement is
         # occuring.  Upto 24 servos on a Maestro, (0-23). Targets start at 0.
@@ -45,13 +63,60 @@ class Controller:
     def close(self):
         self.usb.close()
 
-    # Send a Pololu command out the serial port
-    def sendCmd(self, cmd):
-        cmdStr = self.PololuCmd + cmd
-        if PY2:
-            self.usb.write(cmdStr)
+    # Write bytes out the serial port, or append them to the current batch
+    def _write(self, data):
+        if self._batch is not None:
+            self._batch.buffer += data
         else:
-            self.usb.write(bytes(cmdStr,'latin-1'))
+            self.usb.write(data)
+
+    # Send a Pololu command out the serial port.  The command may be given as
+    # bytes or, for backwards compatibility, as a string of chr() values.
+    def sendCmd(self, cmd):
+        if not isinstance(cmd, (bytes, bytearray)):
+            cmd = cmd.encode('latin-1')
+        self._write(self.PololuCmd + cmd)
+
+    # Send a command taking a channel and a 14 bit value, using the preallocated buffer
+    def _sendCmd4(self, command, chan, value):
+        cmd = self._cmd4
+        cmd[2] = command
+        cmd[3] = chan
+        cmd[4] = value & 0x7f #7 bits for least significant byte
+        cmd[5] = (value >> 7) & 0x7f #shift 7 and take next 7 bits for msb
+        self._write(cmd)
+
+    # Send a command taking a single byte argument, using the preallocated buffer
+    def _sendCmd2(self, command, arg):
+        cmd = self._cmd2
+        cmd[2] = command
+        cmd[3] = arg
+        self._write(cmd)
+
+    # Coalesce the commands sent inside a with block into a single USB write.
+    # getPosition calls inside the block return None, the positions are read
+    # back after the write and stored in the batch's positions attribute:
+    #
+    #   with controller.batch() as batch:
+    #       controller.setTarget(3, 6000)
+    #       controller.getPosition(0)
+    #   position = batch.positions[0]
+    #
+    # If the block raises, nothing is written.
+    @contextmanager
+    def batch(self):
+        batch = Batch()
+        self._batch = batch
+        try:
+            yield batch
+        finally:
+            self._batch = None
+        if batch.buffer:
+            self.usb.write(batch.buffer)
+        batch.positions = []
+        if batch.channels:
+            reply = self.usb.read(2 * len(batch.channels))
+            batch.positions = list(struct.unpack('<%dH' % len(batch.channels), reply))
 
     # Set channels min and max value range.  Use this as a safety to protect
     # from accidentally moving outside known safe parameters. A setting of 0
@@ -87,10 +152,7 @@ class Controller:
         if self.Maxs[chan] > 0 and target > self.Maxs[chan]:
             target = self.Maxs[chan]
         #    
-        lsb = target & 0x7f #7 bits for least significant byte
-        msb = (target >> 7) & 0x7f #shift 7 and take next 7 bits for msb
-        cmd = chr(0x04) + chr(chan) + chr(lsb) + chr(msb)
-        self.sendCmd(cmd)
+        self._sendCmd4(0x04, chan, target)
         # Record Target value
         self.Targets[chan] = target
         
@@ -100,20 +162,14 @@ class Controller:
     # of 1 will take 1 minute, and a speed of 60 would take 1 second.
     # Speed of 0 is unrestricted.
     def setSpeed(self, chan, speed):
-        lsb = speed & 0x7f #7 bits for least significant byte
-        msb = (speed >> 7) & 0x7f #shift 7 and take next 7 bits for msb
-        cmd = chr(0x07) + chr(chan) + chr(lsb) + chr(msb)
-        self.sendCmd(cmd)
+        self._sendCmd4(0x07, chan, speed)
 
     # Set acceleration of channel
     # This provide soft starts and finishes when servo moves to target position.
     # Valid values are from 0 to 255. 0=unrestricted, 1 is slowest start.
     # A value of 1 will take the servo about 3s to move between 1ms to 2ms range.
     def setAccel(self, chan, accel):
-        lsb = accel & 0x7f #7 bits for least significant byte
-        msb = (accel >> 7) & 0x7f #shift 7 and take next 7 bits for msb
-        cmd = chr(0x09) + chr(chan) + chr(lsb) + chr(msb)
-        self.sendCmd(cmd)
+        self._sendCmd4(0x09, chan, accel)
     
     # Get the current position of the device on the specified channel
     # The result is returned in a measure of quarter-microseconds, which mirrors
@@ -122,13 +178,37 @@ class Controller:
     # to the servo. If the Speed is set to below the top speed of the servo, then
     # the position result will align well with the acutal servo position, assuming
     # it is not stalled or slowed.
+    #
+    # Inside a batch() block the position is not returned, see batch().
     def getPosition(self, chan):
-        cmd = chr(0x10) + chr(chan)
-        self.sendCmd(cmd)
-        lsb = ord(self.usb.read())
-        msb = ord(self.usb.read())
+        self._sendCmd2(0x10, chan)
+        if self._batch is not None:
+            self._batch.channels.append(chan)
+            return None
+        lsb, msb = bytearray(self.usb.read(2))
         return (msb << 8) + lsb
 
+    # Get the current positions of several channels with a single write and a
+    # single read.  Returns a list of positions in the order of chans.  The
+    # command for each distinct channel list is built once and reused.
+    # Inside a batch() block the positions are not returned, see batch().
+    def getPositions(self, chans):
+        if self._batch is not None:
+            for chan in chans:
+                self.getPosition(chan)
+            return None
+        key = tuple(chans)
+        prebuilt = self._positionCmds.get(key)
+        if prebuilt is None:
+            cmd = bytearray()
+            for chan in key:
+                cmd += self.PololuCmd + bytearray((0x10, chan))
+            prebuilt = (bytes(cmd), struct.Struct('<%dH' % len(key)))
+            self._positionCmds[key] = prebuilt
+        cmd, reply = prebuilt
+        self.usb.write(cmd)
+        return list(reply.unpack(self.usb.read(reply.size)))
+
     # Test to see if a servo has reached the set target position.  This only provides
     # useful results if the Speed parameter is set slower than the maximum speed of
     # the servo.  Servo range must be defined first using setRange. See setRange comment.
@@ -146,9 +226,8 @@ class Controller:
     # Acceleration have been set on one or more of the channels. Returns True or False.
     # Not available with Micro Maestro.
     def getMovingState(self):
-        cmd = chr(0x13)
-        self.sendCmd(cmd)
-        if self.usb.read() == chr(0):
+        self.sendCmd(bytearray((0x13,)))
+        if self.usb.read() == b'\x00':
             return False
         else:
             return True
@@ -157,13 +236,11 @@ class Controller:
     # have multiple subroutines, which get numbered sequentially from 0 on up. Code your
     # Maestro subroutine to either infinitely loop, or just end (return is not valid).
     def runScriptSub(self, subNumber):
-        cmd = chr(0x27) + chr(subNumber)
+        self._sendCmd2(0x27, subNumber)
         # can pass a param with command 0x28
-        # cmd = chr(0x28) + chr(subNumber) + chr(lsb) + chr(msb)
-        self.sendCmd(cmd)
+        # self._sendCmd4(0x28, subNumber, param)
 
     # Stop the current Maestro Script
     def stopScript(self):
-        cmd = chr(0x24)
-        self.sendCmd(cmd)
+        self.sendCmd(bytearray((0x24,)))
 
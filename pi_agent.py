@@ -0,0 +1,386 @@
+"""A resident agent run on each Raspberry Pi which keeps the LED strip initialized.
+
+Starting the agent once per Pi avoids paying for an SSH session, sudo, interpreter
+startup and strip initialization on every LED command. The agent listens on a TCP
+port and accepts newline delimited JSON commands over a persistent connection.
+Every command is acknowledged as soon as it has been applied, timed effects such as
+turning the strip off after a duration run in the background.
+
+Example command and acknowledgement::
+
+    {"id": 1, "command": "color", "red": 0, "green": 255, "blue": 0, "duration": 1000}
+    {"id": 1, "status": "ok"}
+
+Supported commands:
+    color: Display a color on every pixel for *duration* milliseconds.
+    pattern: Display a pattern from led_patterns for *duration* milliseconds.
+    off: Turn off every pixel immediately.
+    display: Display the image at *path* full screen with feh, run as the desktop
+        user. The acknowledgement is sent as soon as the viewer was spawned and
+        holds the time it was started, in *displayed*. The previous viewer is
+        closed once the new one is still running VIEWER_STARTUP_CHECK seconds
+        later. A viewer which exits before then, for example because it can't
+        open the X display, leaves the previous image displayed, and its failure
+        is reported in the *failed* list of the next display acknowledgement.
+    display_status: Acknowledge with the viewer failures not reported yet, in
+        *failed*, without displaying anything.
+    time: Acknowledge with the times the command was *received* and the
+        acknowledgement *sent*, for the controller to estimate the clock offset.
+    ping: Acknowledge without doing anything, useful to check the connection.
+
+Times are time.perf_counter() values of the Pi, in seconds. The controller
+converts them to its own clock, see elephant_vending_machine.libraries.clock_sync.
+
+Usage:
+    sudo python3 pi_agent.py [--port PORT] [--simulate]
+
+pi_agent.py and led_patterns.py should be copied to the same directory on the Pi.
+Passing --simulate replaces the LED strip by a FakeStrip, allowing the agent to be
+run and tested on a machine without LED hardware.
+"""
+import argparse
+import json
+import os
+import socketserver
+import subprocess
+import threading
+import time
+
+import led_patterns
+
+# LED strip configuration, see led.py for details.
+LED_COUNT = 16
+LED_PIN = 18
+LED_FREQ_HZ = 800000
+LED_DMA = 10
+LED_BRIGHTNESS = 255
+LED_INVERT = False
+LED_CHANNEL = 0
+
+DEFAULT_PORT = 8765
+VIEWER_COMMAND = ('feh', '-F')
+# The agent runs as root, the viewer must run in the X session of the desktop user
+DISPLAY_USER = 'pi'
+X_DISPLAY = ':0'
+XAUTHORITY = '/home/pi/.Xauthority'
+# Seconds a new viewer must keep running before the previous one is closed
+VIEWER_STARTUP_CHECK = 0.1
+
+
+def color(red, green, blue):
+    """Packs RGB values into a 24 bit color, as neopixel.Color does.
+
+    Parameters:
+        red (int): A number in the range 0-255.
+        green (int): A number in the range 0-255.
+        blue (int): A number in the range 0-255.
+
+    Returns:
+        int: The packed color.
+    """
+    return (red << 16) | (green << 8) | blue
+
+
+class FakeStrip:
+    """Local stand-in for Adafruit_NeoPixel which records displayed frames.
+
+    Parameters:
+        num_pixels (int): The number of pixels on the simulated strip.
+    """
+
+    def __init__(self, num_pixels=LED_COUNT):
+        self._led_data = [0] * num_pixels
+        self.shown = [0] * num_pixels
+        self.show_count = 0
+
+    def begin(self):
+        """Initializes the strip, nothing to do for the stand-in."""
+
+    def numPixels(self):
+        # Mirrors the Adafruit_NeoPixel API.
+        # pylint: disable=invalid-name
+        """Returns the number of pixels on the strip."""
+        return len(self._led_data)
+
+    def setPixelColor(self, index, pixel_color):
+        # pylint: disable=invalid-name
+        """Sets the color of a single pixel, displayed on the next call to show."""
+        self._led_data[index] = pixel_color
+
+    def show(self):
+        """Displays the pixel colors which have been set."""
+        self.shown = list(self._led_data)
+        self.show_count += 1
+
+
+class LedController:
+    """Applies LED commands to a strip without blocking the caller.
+
+    Patterns are rendered into frames by led_patterns and played on a worker thread
+    at a fixed frame rate. Starting a new pattern cancels the one currently playing.
+
+    Parameters:
+        strip: An initialized Adafruit_NeoPixel or FakeStrip instance.
+        frame_rate (int): The number of frames displayed per second.
+    """
+
+    def __init__(self, strip, frame_rate=led_patterns.FRAME_RATE):
+        self.strip = strip
+        self.frame_rate = frame_rate
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._worker = None
+
+    def run_frames(self, frames):
+        """Starts playing the given frames in the background.
+
+        Parameters:
+            frames (tuple): The frames to display, one every 1 / frame_rate seconds.
+        """
+        with self._lock:
+            self._stop_worker()
+            cancel = threading.Event()
+            self._cancel = cancel
+            self._worker = threading.Thread(
+                target=self._run_frames, args=(frames, cancel), daemon=True)
+            self._worker.start()
+
+    def _run_frames(self, frames, cancel):
+        frame_interval = 1 / self.frame_rate
+        next_frame_time = time.perf_counter()
+        previous_frame = None
+        for frame in frames:
+            if cancel.is_set():
+                return
+            if frame is not previous_frame:
+                led_patterns.write_frame(self.strip, frame)
+                self.strip.show()
+                previous_frame = frame
+            next_frame_time += frame_interval
+            if cancel.wait(max(0, next_frame_time - time.perf_counter())):
+                return
+
+    def _stop_worker(self):
+        self._cancel.set()
+        if self._worker is not None and self._worker is not threading.current_thread():
+            self._worker.join()
+        self._worker = None
+
+    def show_pattern(self, name, pixel_color, duration):
+        """Displays a named pattern for *duration* milliseconds, then turns the strip off.
+
+        Raises:
+            ValueError: If there is no pattern with the specified name.
+        """
+        self.run_frames(led_patterns.render(
+            name, pixel_color, duration, self.strip.numPixels(), self.frame_rate))
+
+    def show_color(self, pixel_color, duration):
+        """Displays a color for *duration* milliseconds, then turns the strip off."""
+        self.show_pattern('solid', pixel_color, duration)
+
+    def off(self):
+        """Cancels any running pattern and turns the strip off."""
+        with self._lock:
+            self._stop_worker()
+            led_patterns.write_frame(self.strip, led_patterns.fill(0, self.strip.numPixels()))
+            self.strip.show()
+
+    def handle(self, request):
+        """Applies a decoded command and returns the acknowledgement to send back.
+
+        Parameters:
+            request (dict): The decoded JSON command.
+
+        Returns:
+            dict: The acknowledgement, with status 'ok' or 'error'.
+        """
+        response = {'id': request.get('id'), 'status': 'ok'}
+        try:
+            command = request['command']
+            if command == 'color':
+                self.show_color(color(request['red'], request['green'], request['blue']),
+                                request['duration'])
+            elif command == 'pattern':
+                self.show_pattern(request['name'],
+                                  color(request['red'], request['green'], request['blue']),
+                                  request['duration'])
+            elif command == 'off':
+                self.off()
+            elif command != 'ping':
+                raise ValueError(f'Unknown command {command}')
+        except (KeyError, TypeError, ValueError) as error:
+            response['status'] = 'error'
+            response['message'] = str(error)
+        return response
+
+
+class Display:
+    """Displays images full screen, replacing the previously displayed image.
+
+    Parameters:
+        viewer_command (tuple): The command starting the image viewer, followed
+            by the path of the image. None when simulating, in which case the
+            paths of the displayed images are only recorded in *shown*.
+        user (str): The desktop user the viewer is run as when the agent runs as
+            root, None to run it as the agent's user.
+        xauthority (str): The X authority file of the desktop session.
+        startup_check (float): The number of seconds the viewer must keep running
+            for the image to be considered displayed, and the previous one closed.
+    """
+
+    def __init__(self, viewer_command=VIEWER_COMMAND, user=DISPLAY_USER, xauthority=XAUTHORITY,
+                 startup_check=VIEWER_STARTUP_CHECK):
+        self.viewer_command = viewer_command
+        self.user = user
+        self.xauthority = xauthority
+        self.startup_check = startup_check
+        self.shown = []
+        self._process = None
+        self._failures = []
+        self._shows = 0
+        self._confirmed = 0
+        self._lock = threading.Lock()
+
+    def command(self, path):
+        """Returns the command displaying an image in the desktop user's X session."""
+        command = ['env', f'DISPLAY={X_DISPLAY}', f'XAUTHORITY={self.xauthority}']
+        command += list(self.viewer_command) + [path]
+        if self.user is not None and os.geteuid() == 0:
+            command = ['sudo', '-u', self.user] + command
+        return command
+
+    def show(self, path):
+        """Starts displaying an image and returns the time the viewer was started.
+
+        Returns as soon as the viewer was spawned. The previous viewer is only
+        closed once the new one is known to be running, by a background thread,
+        so the desktop isn't visible in between, and the previous image stays
+        displayed if the new viewer fails. Such failures are kept for
+        take_failures.
+
+        Raises:
+            OSError: If the viewer can't be started.
+        """
+        with self._lock:
+            if self.viewer_command is None:
+                self.shown.append(path)
+                return time.perf_counter()
+            process = subprocess.Popen(self.command(path), stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.DEVNULL)
+            displayed = time.perf_counter()
+            self._shows += 1
+            threading.Thread(target=self._confirm, args=(process, path, self._shows),
+                             name='viewer-check', daemon=True).start()
+            return displayed
+
+    def _confirm(self, process, path, number):
+        """Replaces the displayed viewer by a new one once it has kept running startup_check seconds."""
+        try:
+            status = process.wait(self.startup_check)
+        except subprocess.TimeoutExpired:
+            status = None
+        with self._lock:
+            if status is not None:
+                self._failures.append(f'The viewer exited with status {status} displaying {path}')
+            elif number < self._confirmed:
+                # A viewer started later is already displayed
+                process.terminate()
+            else:
+                if self._process is not None:
+                    self._process.terminate()
+                self._process = process
+                self._confirmed = number
+
+    def take_failures(self):
+        """Returns the viewer failures since the previous call, as messages."""
+        with self._lock:
+            failures, self._failures = self._failures, []
+            return failures
+
+
+class AgentRequestHandler(socketserver.StreamRequestHandler):
+    """Reads newline delimited JSON commands from a connection until it is closed."""
+
+    def handle(self):
+        for line in self.rfile:
+            received = time.perf_counter()
+            try:
+                request = json.loads(line)
+            except ValueError:
+                request = {'command': None}
+            response = self.server.dispatch(request, received)
+            if 'received' in response:
+                response['sent'] = time.perf_counter()
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class AgentServer(socketserver.ThreadingTCPServer):
+    """TCP server dispatching commands from every connection to one LedController and Display.
+
+    Parameters:
+        address (tuple): The (host, port) to listen on.
+        controller (LedController): The controller which applies LED commands.
+        display (Display): The display which shows images, a simulated one by default.
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, controller, display=None):
+        super().__init__(address, AgentRequestHandler)
+        self.controller = controller
+        self.display = display if display is not None else Display(None)
+
+    def dispatch(self, request, received):
+        """Applies a decoded command and returns the acknowledgement to send back.
+
+        Parameters:
+            request (dict): The decoded JSON command.
+            received (float): The time the command was received.
+
+        Returns:
+            dict: The acknowledgement, with status 'ok' or 'error'.
+        """
+        command = request.get('command')
+        if command == 'time':
+            return {'id': request.get('id'), 'status': 'ok', 'received': received}
+        if command == 'display':
+            response = {'id': request.get('id'), 'status': 'ok'}
+            try:
+                response['displayed'] = self.display.show(request['path'])
+            except (KeyError, OSError) as error:
+                response['status'] = 'error'
+                response['message'] = str(error)
+            failures = self.display.take_failures()
+            if failures:
+                response['failed'] = failures
+            return response
+        if command == 'display_status':
+            return {'id': request.get('id'), 'status': 'ok',
+                    'failed': self.display.take_failures()}
+        return self.controller.handle(request)
+
+
+def create_strip(simulate):
+    """Creates and initializes the LED strip, or a FakeStrip when simulating."""
+    if simulate:
+        strip = FakeStrip(LED_COUNT)
+    else:
+        # neopixel is only available on the Pis.
+        # pylint: disable=import-outside-toplevel
+        from neopixel import Adafruit_NeoPixel
+        strip = Adafruit_NeoPixel(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA,
+                                  LED_INVERT, LED_BRIGHTNESS, LED_CHANNEL)
+    strip.begin()
+    return strip
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='Resident LED agent for the vending machine.')
+    PARSER.add_argument('--host', default='0.0.0.0')
+    PARSER.add_argument('--port', type=int, default=DEFAULT_PORT)
+    PARSER.add_argument('--simulate', action='store_true')
+    ARGS = PARSER.parse_args()
+    SERVER = AgentServer((ARGS.host, ARGS.port), LedController(create_strip(ARGS.simulate)),
+                         Display(None if ARGS.simulate else VIEWER_COMMAND))
+    SERVER.serve_forever()
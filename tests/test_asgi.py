@@ -0,0 +1,31 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip('asgiref')
+
+
+def test_serves_flask_routes():
+    from elephant_vending_machine.asgi import application
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+             'scheme': 'http', 'path': '/rig', 'root_path': '', 'query_string': b'',
+             'headers': [], 'server': ('testserver', 8000), 'client': ('10.0.0.1', 5000)}
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(application(scope, receive, send))
+    finally:
+        loop.close()
+    assert sent[0]['type'] == 'http.response.start'
+    assert sent[0]['status'] == 200
+    body = b''.join(message.get('body', b'') for message in sent[1:])
+    assert 'rigs' in json.loads(body)
@@ -0,0 +1,43 @@
+import pytest
+
+from elephant_vending_machine.libraries.calibration import (
+    compute_thresholds, load_calibrations, save_calibration, thresholds_by_pin)
+
+
+def test_thresholds_follow_each_pin():
+    samples = [[700, 300, 0], [710, 290, 0], [690, 310, 0], [700, 300, 0]]
+    results = compute_thresholds([0, 1, 2], samples, noise_multiplier=5, margin=0.1)
+    left, middle, right = results
+    assert left['baseline'] == 700
+    assert left['noise'] == pytest.approx(7.0711, abs=1e-3)
+    assert left['minimum'] == 690
+    assert left['threshold'] == int((700 - 5 * left['noise']) * 0.9)
+    assert middle['threshold'] == int((300 - 5 * middle['noise']) * 0.9)
+    assert right == {'pin': 2, 'samples': 0, 'baseline': None, 'noise': None, 'minimum': None,
+                     'threshold': None}
+    assert thresholds_by_pin(results) == {0: left['threshold'], 1: middle['threshold']}
+
+
+def test_threshold_stays_under_lowest_reading():
+    # A single dip far below the others must not trigger a selection
+    samples = [[800]] * 99 + [[400]]
+    result, = compute_thresholds([0], samples, noise_multiplier=1, margin=0)
+    assert result['threshold'] == 400
+
+
+def test_noisy_pin_gets_no_threshold():
+    result, = compute_thresholds([0], [[10], [900], [20], [800]])
+    assert result['threshold'] is None
+
+
+def test_no_samples():
+    assert thresholds_by_pin(compute_thresholds([0, 1], [])) == {}
+
+
+def test_calibrations_are_saved_per_rig(tmp_path):
+    path = str(tmp_path / 'calibration.json')
+    assert load_calibrations(path) == {}
+    save_calibration(path, 'north', {0: 600, 1: 580})
+    save_calibration(path, 'south', {0: 650})
+    save_calibration(path, 'north', {0: 610, 1: 590})
+    assert load_calibrations(path) == {'north': {0: 610, 1: 590}, 'south': {0: 650}}
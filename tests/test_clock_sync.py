@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+
+import pi_agent
+from elephant_vending_machine.libraries import clock_sync
+from elephant_vending_machine.libraries.clock_sync import ClockSync
+from elephant_vending_machine.libraries.pi_agent_client import AgentClient
+
+
+class SkewedClient:
+    """Answers time requests with a clock 100 seconds ahead, after a variable delay."""
+
+    address = 'skewed'
+
+    def __init__(self, monkeypatch, delays):
+        self.delays = list(delays)
+        self.now = 1000.0
+        monkeypatch.setattr(clock_sync.time, 'perf_counter', lambda: self.now)
+
+    def send(self, command):
+        outbound, inbound = self.delays.pop(0)
+        self.now += outbound
+        received = self.now + 100
+        self.now += 0.001
+        sent = self.now + 100
+        self.now += inbound
+        return {'status': 'ok', 'received': received, 'sent': sent}
+
+
+def test_offset_comes_from_fastest_exchange(monkeypatch):
+    client = SkewedClient(monkeypatch, [(0.010, 0.002), (0.001, 0.001), (0.002, 0.020)])
+    clock = ClockSync(client)
+    assert clock.offset is None
+    assert clock.to_local(5.0) is None
+    clock.update(samples=3)
+    assert clock.round_trip == pytest.approx(0.002)
+    assert clock.offset == pytest.approx(100)
+    assert clock.to_local(1100.5) == pytest.approx(1000.5)
+
+
+def test_window_forgets_old_exchanges(monkeypatch):
+    client = SkewedClient(monkeypatch, [(0.001, 0.001), (0.010, 0.002), (0.002, 0.010)])
+    clock = ClockSync(client, window_size=2)
+    clock.update(samples=3)
+    assert clock.round_trip == pytest.approx(0.012)
+    assert clock.offset == pytest.approx(96 / 1000 + 99.9)
+
+
+def test_sync_with_agent():
+    server = pi_agent.AgentServer(('127.0.0.1', 0), pi_agent.LedController(pi_agent.FakeStrip()))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = AgentClient('127.0.0.1', server.server_address[1])
+    clock = ClockSync(client)
+    clock.update()
+    # The agent runs on the same machine, so both clocks are the same
+    assert abs(clock.offset) <= clock.round_trip
+    clock.start(0.01)
+    clock.start(0.01)
+    clock.stop()
+    client.close()
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,167 @@
+import json
+import socket
+import threading
+import time
+from concurrent.futures import CancelledError
+
+import pytest
+
+import pi_agent
+from elephant_vending_machine.libraries import command_queue
+from elephant_vending_machine.libraries.command_queue import CommandQueue
+from elephant_vending_machine.libraries.pi_agent_client import AgentError
+from elephant_vending_machine.libraries.vending_machine import VendingMachine
+
+
+class ScriptedAgent:
+    """Agent recording the commands it receives, holding back acknowledgements until released."""
+
+    def __init__(self):
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen()
+        self.port = self.listener.getsockname()[1]
+        self.received = []
+        self.release = threading.Event()
+        self.connections = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                return
+            self.connections.append(connection)
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        # Requests keep being read while their acknowledgements are held back
+        lock = threading.Lock()
+        with connection.makefile('rb') as reader:
+            for line in reader:
+                request = json.loads(line)
+                self.received.append(request['command'])
+                threading.Thread(target=self._acknowledge, args=(connection, lock, request),
+                                 daemon=True).start()
+
+    def _acknowledge(self, connection, lock, request):
+        self.release.wait()
+        status = 'error' if request['command'] == 'fail' else 'ok'
+        try:
+            with lock:
+                connection.sendall(json.dumps({'id': request['id'], 'status': status}).encode()
+                                   + b'\n')
+        except OSError:
+            pass
+
+    def close(self):
+        self.listener.close()
+        for connection in self.connections:
+            connection.close()
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.perf_counter() + timeout
+    while not condition() and time.perf_counter() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+@pytest.fixture
+def scripted_agent():
+    agent = ScriptedAgent()
+    yield agent
+    agent.release.set()
+    agent.close()
+
+
+def test_urgent_commands_are_sent_first(scripted_agent):
+    queue = CommandQueue('127.0.0.1', scripted_agent.port, depth=1)
+    first = queue.submit(command_queue.HOUSEKEEPING, 'off')
+    assert wait_for(lambda: scripted_agent.received == ['off'])
+    futures = [queue.submit(command_queue.HOUSEKEEPING, 'ping'),
+               queue.set_color(0, 255, 0, 100),
+               queue.display('/tmp/white_stimuli.png')]
+    scripted_agent.release.set()
+    for future in [first] + futures:
+        future.result(timeout=2)
+    assert scripted_agent.received == ['off', 'display', 'color', 'ping']
+    queue.close()
+
+
+def test_commands_are_pipelined(scripted_agent):
+    queue = CommandQueue('127.0.0.1', scripted_agent.port, depth=3)
+    futures = [queue.submit(command_queue.LED, 'ping') for _ in range(4)]
+    # The agent acknowledges nothing until the third command arrived
+    assert wait_for(lambda: len(scripted_agent.received) == 3)
+    time.sleep(0.05)
+    assert len(scripted_agent.received) == 3
+    assert not any(future.done() for future in futures)
+    scripted_agent.release.set()
+    responses = [future.result(timeout=2) for future in futures]
+    assert all(response['sent_at'] <= response['acknowledged_at'] for response in responses)
+    queue.close()
+
+
+def test_agent_errors_and_lost_connections(scripted_agent):
+    scripted_agent.release.set()
+    queue = CommandQueue('127.0.0.1', scripted_agent.port)
+    with pytest.raises(AgentError):
+        queue.submit(command_queue.LED, 'fail').result(timeout=2)
+    scripted_agent.release.clear()
+    pending = queue.submit(command_queue.LED, 'ping')
+    assert wait_for(lambda: len(scripted_agent.received) == 2)
+    scripted_agent.connections[0].shutdown(socket.SHUT_RDWR)
+    with pytest.raises(OSError):
+        pending.result(timeout=2)
+    # The next command opens a new connection
+    scripted_agent.release.set()
+    assert queue.submit(command_queue.LED, 'ping').result(timeout=2)['status'] == 'ok'
+    queue.close()
+
+
+def test_unreachable_agent():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    queue = CommandQueue('127.0.0.1', port)
+    with pytest.raises(OSError):
+        queue.set_color(0, 0, 0, 10).result(timeout=2)
+    queue.close()
+
+
+def test_close_cancels_queued_commands(scripted_agent):
+    queue = CommandQueue('127.0.0.1', scripted_agent.port, depth=1)
+    sent = queue.submit(command_queue.LED, 'ping')
+    assert wait_for(lambda: scripted_agent.received == ['ping'])
+    queued = queue.submit(command_queue.LED, 'ping')
+    queue.close()
+    assert queued.cancelled()
+    with pytest.raises(CancelledError):
+        sent.result(timeout=2)
+    with pytest.raises(RuntimeError):
+        queue.submit(command_queue.LED, 'ping')
+
+
+def test_queued_display_and_led_cue():
+    strip = pi_agent.FakeStrip()
+    display = pi_agent.Display(None)
+    server = pi_agent.AgentServer(('127.0.0.1', 0), pi_agent.LedController(strip), display)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    vending_machine = VendingMachine(['127.0.0.1', '2', '3'],
+                                     {'PI_AGENT_PORT': server.server_address[1]})
+    group = vending_machine.left_group
+    before = time.perf_counter()
+    shown = group.queue_display('white_stimuli.png', True)
+    cue = group.queue_led_color(0, 255, 0, 50)
+    assert cue.result(timeout=2)['status'] == 'ok'
+    assert shown.result(timeout=2)['displayed'] >= before
+    assert display.shown == ['/home/pi/elephant_vending_machine/images/white_stimuli.png']
+    assert group.correct_stimulus
+    assert wait_for(lambda: group.last_display_time is not None)
+    assert abs(group.last_display_time - shown.result()['displayed']) <= group.clock.round_trip
+    vending_machine.close()
+    server.shutdown()
+    server.server_close()
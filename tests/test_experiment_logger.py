@@ -4,11 +4,13 @@ import logging
 import pytest
 import re
 
-from elephant_vending_machine.libraries.experiment_logger import CsvFormatter, create_experiment_logger
+from elephant_vending_machine.libraries.experiment_logger import CsvFormatter, create_experiment_logger, close_experiment_logger
 
 class MockLogRecord:
     def __init__(self, message):
         self.message = message
+        self.created = 1584419162.085651
+        self.monotonic = 12.5
 
     def getMessage(self):
         return self.message
@@ -35,24 +37,24 @@ def test_csv_formatter_creation():
 def test_csv_formatter_format_empty():
     message = ''
     formatted_message = formatter.format(MockLogRecord(message))
-    LOG_ENTRY_REGEX = r'^\"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}.\d{6}\",\"\"$'
+    LOG_ENTRY_REGEX = r'^\"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}.\d{6}\",\"\",\"12\.500000\"$'
     assert re.match(LOG_ENTRY_REGEX, formatted_message)
 
 def test_csv_formatter_format_basic_message():
     message = 'some_text'
-    LOG_ENTRY_REGEX = r'^\"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}.\d{6}\",\"some_text\"$'
+    LOG_ENTRY_REGEX = r'^\"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}.\d{6}\",\"some_text\",\"12\.500000\"$'
     formatted_message = formatter.format(MockLogRecord(message))
     assert re.match(LOG_ENTRY_REGEX, formatted_message)
 
 def test_csv_formatter_format_message_with_spaces():
     message = 'more complex text'
-    LOG_ENTRY_REGEX = r'^\"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}.\d{6}\",\"more complex text\"$'
+    LOG_ENTRY_REGEX = r'^\"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}.\d{6}\",\"more complex text\",\"12\.500000\"$'
     formatted_message = formatter.format(MockLogRecord(message))
     assert re.match(LOG_ENTRY_REGEX, formatted_message)
 
 def test_csv_formatter_format_message_with_double_quotes():
     message = 'this text "contains a quote"'
-    LOG_ENTRY_REGEX = r'^\"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}.\d{6}\",\"this text \"\"contains a quote\"\"\"$'
+    LOG_ENTRY_REGEX = r'^\"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}.\d{6}\",\"this text \"\"contains a quote\"\"\",\"12\.500000\"$'
     formatted_message = formatter.format(MockLogRecord(message))
     assert re.match(LOG_ENTRY_REGEX, formatted_message)
 
@@ -61,3 +63,37 @@ def test_create_experiment_logger(monkeypatch):
     exp_logger = create_experiment_logger('unittest.csv')
     assert exp_logger.level == logging.INFO
     assert exp_logger.name == 'experiment_logger'
+
+def test_rig_loggers_are_isolated():
+    first_logger = create_experiment_logger('unittest.csv', 'first')
+    second_logger = create_experiment_logger('unittest.csv', 'second')
+    assert first_logger is not second_logger
+    assert first_logger.name == 'experiment_logger.first'
+    assert not first_logger.propagate
+    close_experiment_logger('first')
+    close_experiment_logger('second')
+    assert first_logger.handlers == []
+    assert second_logger.handlers == []
+
+def test_csv_formatter_uses_record_time():
+    assert formatter.format(MockLogRecord('event')).startswith('"2020-03-17 04:26:02.085651","event"')
+
+def test_monotonic_time_filter(tmp_path, monkeypatch):
+    monkeypatch.setattr('elephant_vending_machine.libraries.experiment_logger.time.perf_counter', lambda: 100.0)
+    exp_logger = create_experiment_logger('unittest.csv', 'filtered')
+    exp_logger.handlers[0].setStream(open(str(tmp_path / 'filtered.csv'), 'w'))
+    exp_logger.info('Logged now')
+    exp_logger.info('Sensed earlier', extra={'monotonic': 99.75})
+    exp_logger.info('Displayed without agent', extra={'monotonic': None})
+    close_experiment_logger('filtered')
+    with open(str(tmp_path / 'filtered.csv'), newline='') as log:
+        rows = list(csv.reader(log))
+    assert [row[1:] for row in rows] == [['Logged now', '100.000000'], ['Sensed earlier', '99.750000'],
+                                         ['Displayed without agent', '100.000000']]
+    from datetime import datetime
+    first, second = (datetime.strptime(row[0], '%Y-%m-%d %H:%M:%S.%f') for row in rows[:2])
+    assert 0.2 < (first - second).total_seconds() < 0.3
+    assert len(exp_logger.filters) == 1
+    create_experiment_logger('unittest.csv', 'filtered')
+    close_experiment_logger('filtered')
+    assert len(exp_logger.filters) == 1
@@ -0,0 +1,140 @@
+import socket
+from subprocess import CalledProcessError
+
+import pytest
+import spur.ssh
+
+from elephant_vending_machine.libraries import host_health
+from elephant_vending_machine.libraries.host_health import (
+    CircuitBreaker, HostDownError, HostMonitor, host_call)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_opens_after_consecutive_failures():
+    clock = FakeClock()
+    breaker = CircuitBreaker('pi', failure_threshold=3, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+    with pytest.raises(HostDownError):
+        breaker.check()
+
+
+def test_breaker_half_opens_after_reset_timeout():
+    clock = FakeClock()
+    breaker = CircuitBreaker('pi', reset_timeout=30, clock=clock)
+    breaker.trip()
+    clock.now = 29
+    assert breaker.state == 'open'
+    clock.now = 30
+    assert breaker.state == 'half-open'
+    assert breaker.allow()
+    # A single failure while half-open opens the breaker again
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    clock.now = 60
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.failures == 0
+
+
+def test_breaker_admits_a_single_probe_while_half_open():
+    clock = FakeClock()
+    breaker = CircuitBreaker('pi', reset_timeout=30, clock=clock)
+    breaker.trip()
+    clock.now = 30
+    assert breaker.allow()
+    assert not breaker.allow()
+    with pytest.raises(HostDownError):
+        breaker.check()
+    # A failed probe opens the breaker, and the next one waits for the reset timeout
+    breaker.record_failure()
+    assert not breaker.allow()
+    clock.now = 60
+    assert breaker.allow()
+    assert not breaker.allow()
+    # A probe which never reported back is given up on after the reset timeout
+    clock.now = 90
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.allow()
+    assert breaker.allow()
+
+
+def test_only_connection_failures_count():
+    assert host_health.is_connection_failure(CalledProcessError(255, ['ssh']))
+    assert not host_health.is_connection_failure(CalledProcessError(1, ['ssh']))
+    assert host_health.is_connection_failure(socket.timeout())
+    assert host_health.is_connection_failure(spur.ssh.ConnectionError('refused'))
+    assert not host_health.is_connection_failure(ValueError())
+
+
+def test_host_call_fails_fast_once_host_is_down():
+    calls = []
+    for _ in range(host_health.FAILURE_THRESHOLD):
+        with pytest.raises(CalledProcessError):
+            with host_call('host-call-test'):
+                calls.append(None)
+                raise CalledProcessError(255, ['ssh'])
+    with pytest.raises(HostDownError):
+        with host_call('host-call-test'):
+            calls.append(None)
+    assert len(calls) == host_health.FAILURE_THRESHOLD
+    host_health.get_breaker('host-call-test').record_success()
+    with host_call('host-call-test'):
+        calls.append(None)
+    assert len(calls) == host_health.FAILURE_THRESHOLD + 1
+
+
+def test_command_errors_show_host_is_up():
+    breaker = host_health.get_breaker('command-error-test')
+    breaker.record_failure()
+    with pytest.raises(CalledProcessError):
+        with host_call('command-error-test'):
+            raise CalledProcessError(1, ['ssh'])
+    assert breaker.failures == 0
+
+
+def test_monitor_probes_hosts():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen()
+    port = listener.getsockname()[1]
+    closed = socket.socket()
+    closed.bind(('127.0.0.1', 0))
+    closed_port = closed.getsockname()[1]
+    closed.close()
+    monitor = HostMonitor(['127.0.0.1', '127.0.0.1'], 60, port=port)
+    assert monitor.status()[0]['up'] is None
+    up, = monitor.probe_all()
+    assert up['up'] is True
+    assert up['latency_ms'] >= 0
+    assert up['breaker'] == 'closed'
+    monitor = HostMonitor(['127.0.0.1'], 60, port=closed_port)
+    down, = monitor.probe_all()
+    assert down['up'] is False
+    assert down['breaker'] == 'open'
+    with pytest.raises(HostDownError):
+        with host_call('127.0.0.1'):
+            pass
+    monitor.port = port
+    monitor.start()
+    assert monitor.running
+    monitor.stop()
+    assert monitor.status()[0]['up'] is True
+    assert monitor.status()[0]['breaker'] == 'closed'
+    listener.close()
@@ -0,0 +1,131 @@
+from datetime import datetime
+
+from PIL import Image
+
+from elephant_vending_machine.libraries.image_index import ImageIndex, read_image_metadata
+from elephant_vending_machine.libraries.perceptual_hash import BKTree
+
+
+def make_image(directory, name, size):
+    path = directory / name
+    Image.new('RGB', size).save(path)
+    return str(path)
+
+
+def test_add_and_search(tmp_path):
+    index = ImageIndex(str(tmp_path / 'index.sqlite3'))
+    index.add('white.png', make_image(tmp_path, 'white.png', (1920, 1080)), ['training', 'bright'])
+    index.add('white_small.png', make_image(tmp_path, 'white_small.png', (640, 480)), ['training'])
+    index.add('black.png', make_image(tmp_path, 'black.png', (1920, 1080)), ['dark'])
+
+    assert [image['filename'] for image in index.search()] == ['black.png', 'white.png', 'white_small.png']
+    assert [image['filename'] for image in index.search(prefix='white')] == ['white.png', 'white_small.png']
+    assert [image['filename'] for image in index.search(tags=['training', 'bright'])] == ['white.png']
+    assert [image['filename'] for image in index.search(min_width=1000, tags=['training'])] == ['white.png']
+    assert [image['filename'] for image in index.search(max_height=500)] == ['white_small.png']
+    assert len(index.search(limit=1)) == 1
+
+    image = index.search(prefix='black')[0]
+    assert (image['width'], image['height'], image['format']) == (1920, 1080, 'PNG')
+    assert image['tags'] == ['dark']
+    assert len(image['hash']) == 64
+
+
+def test_replace_and_remove(tmp_path):
+    index = ImageIndex(str(tmp_path / 'index.sqlite3'))
+    path = make_image(tmp_path, 'white.png', (10, 10))
+    index.add('white.png', path, ['old'])
+    index.add('white.png', path, ['new'])
+    assert index.search(tags=['old']) == []
+    assert index.search()[0]['tags'] == ['new']
+    index.remove('white.png')
+    assert index.search() == []
+    assert index.search(tags=['new']) == []
+
+
+def test_unreadable_image_is_indexed_without_dimensions(tmp_path):
+    index = ImageIndex(str(tmp_path / 'index.sqlite3'))
+    path = tmp_path / 'drawing.svg'
+    path.write_text('<svg xmlns="http://www.w3.org/2000/svg"/>')
+    index.add('drawing.svg', str(path))
+    image = index.search()[0]
+    assert image['width'] is None and image['format'] is None
+
+
+def test_sync(tmp_path):
+    images = tmp_path / 'img'
+    images.mkdir()
+    (images / '.gitignore').write_text('')
+    make_image(images, 'kept.png', (10, 10))
+    index = ImageIndex(str(tmp_path / 'index.sqlite3'))
+    index.add('gone.png', make_image(tmp_path, 'gone.png', (10, 10)), uploaded_at=datetime(2020, 1, 1))
+    index.sync(str(images))
+    assert [image['filename'] for image in index.search()] == ['kept.png']
+
+
+def test_find_similar(tmp_path):
+    index = ImageIndex(str(tmp_path / 'index.sqlite3'))
+    mandelbrot = Image.effect_mandelbrot((256, 256), (-2, -1.5, 1, 1.5), 100).convert('RGB')
+    mandelbrot.save(tmp_path / 'mandelbrot.png')
+    mandelbrot.resize((64, 64)).save(tmp_path / 'mandelbrot_small.png')
+    mandelbrot.transpose(Image.FLIP_LEFT_RIGHT).save(tmp_path / 'mirrored.png')
+    for name in ('mandelbrot.png', 'mandelbrot_small.png', 'mirrored.png'):
+        index.add(name, str(tmp_path / name))
+
+    phash = index.search(prefix='mandelbrot.png')[0]['phash']
+    assert [name for _, name in index.find_similar(phash, 6)] == ['mandelbrot.png', 'mandelbrot_small.png']
+    assert [name for _, name in index.find_similar(phash, 6, exclude='mandelbrot.png')] == ['mandelbrot_small.png']
+    index.remove('mandelbrot_small.png')
+    assert index.find_similar(phash, 6, exclude='mandelbrot.png') == []
+
+
+def test_find_similar_sees_other_connections(tmp_path):
+    path = str(tmp_path / 'index.sqlite3')
+    index = ImageIndex(path)
+    mandelbrot = Image.effect_mandelbrot((256, 256), (-2, -1.5, 1, 1.5), 100).convert('RGB')
+    mandelbrot.save(tmp_path / 'mandelbrot.png')
+    index.add('mandelbrot.png', str(tmp_path / 'mandelbrot.png'))
+    phash = index.search()[0]['phash']
+    assert len(index.find_similar(phash, 0)) == 1
+    ImageIndex(path).add('copy.png', str(tmp_path / 'mandelbrot.png'))
+    assert [name for _, name in index.find_similar(phash, 0)] == ['copy.png', 'mandelbrot.png']
+
+
+def test_find_similar_updates_tree_in_place(tmp_path, monkeypatch):
+    from elephant_vending_machine.libraries import image_index
+    index = ImageIndex(str(tmp_path / 'index.sqlite3'))
+    mandelbrot = Image.effect_mandelbrot((256, 256), (-2, -1.5, 1, 1.5), 100).convert('RGB')
+    mandelbrot.save(tmp_path / 'mandelbrot.png')
+    mandelbrot.transpose(Image.FLIP_LEFT_RIGHT).save(tmp_path / 'mirrored.png')
+    index.add('mandelbrot.png', str(tmp_path / 'mandelbrot.png'))
+    phash = index.search()[0]['phash']
+    mirrored_phash = read_image_metadata(str(tmp_path / 'mirrored.png'))['phash']
+    assert len(index.find_similar(phash, 0)) == 1
+    builds = []
+    monkeypatch.setattr(image_index, 'BKTree', lambda: builds.append(1) or BKTree())
+    index.add('copy.png', str(tmp_path / 'mandelbrot.png'))
+    assert [name for _, name in index.find_similar(phash, 0)] == ['copy.png', 'mandelbrot.png']
+    # Replacing an image moves it to its new hash
+    index.add('copy.png', str(tmp_path / 'mirrored.png'))
+    assert [name for _, name in index.find_similar(phash, 0)] == ['mandelbrot.png']
+    assert [name for _, name in index.find_similar(mirrored_phash, 0)] == ['copy.png']
+    index.remove('copy.png')
+    assert index.find_similar(mirrored_phash, 0) == []
+    assert builds == []
+
+
+def test_migration_adds_perceptual_hashes(tmp_path):
+    import sqlite3
+    path = str(tmp_path / 'index.sqlite3')
+    connection = sqlite3.connect(path)
+    connection.executescript('''
+        CREATE TABLE images (filename TEXT PRIMARY KEY, size INTEGER NOT NULL, width INTEGER,
+            height INTEGER, format TEXT, hash TEXT NOT NULL, uploaded_at TEXT NOT NULL);
+        INSERT INTO images VALUES ('black.png', 1, 10, 10, 'PNG', 'abc', '2020-01-01 00:00:00');
+    ''')
+    connection.close()
+    make_image(tmp_path, 'black.png', (10, 10))
+    index = ImageIndex(path)
+    assert index.search()[0]['phash'] is None
+    index.sync(str(tmp_path), ignored=('index.sqlite3', 'index.sqlite3-wal', 'index.sqlite3-shm'))
+    assert index.search()[0]['phash'] == '0' * 16
@@ -0,0 +1,67 @@
+import os
+
+from PIL import Image
+
+from elephant_vending_machine.libraries import image_variants
+
+
+def make_image(path, size=(2000, 1000), color=(255, 255, 255)):
+    Image.new('RGB', size, color).save(path)
+    return str(path)
+
+
+def test_generate_variants(tmp_path):
+    source = make_image(tmp_path / 'white.png')
+    cache = str(tmp_path / 'cache')
+    manifest = image_variants.generate_variants(source, cache, 'white.png')
+    assert (manifest['width'], manifest['height']) == (2000, 1000)
+    assert manifest['format'] == 'PNG'
+    thumbnail = manifest['variants']['thumbnail']
+    assert (thumbnail['width'], thumbnail['height']) == (256, 128)
+    assert thumbnail['path'].startswith(manifest['hash'][:2] + '/' + manifest['hash'])
+    with Image.open(os.path.join(cache, thumbnail['path'])) as variant:
+        assert variant.format == 'WEBP'
+    assert image_variants.find_manifest(cache, 'white.png') == manifest
+
+
+def test_identical_content_is_generated_once(tmp_path, monkeypatch):
+    first = make_image(tmp_path / 'first.png')
+    second = make_image(tmp_path / 'second.png')
+    cache = str(tmp_path / 'cache')
+    image_variants.generate_variants(first, cache, 'first.png')
+    monkeypatch.setattr(image_variants, '_render_variants', lambda *args: 1 / 0)
+    manifest = image_variants.generate_variants(second, cache, 'second.png')
+    assert image_variants.find_manifest(cache, 'second.png') == manifest
+
+
+def test_unreadable_image_has_no_variants(tmp_path):
+    source = tmp_path / 'drawing.svg'
+    source.write_text('<svg xmlns="http://www.w3.org/2000/svg"/>')
+    cache = str(tmp_path / 'cache')
+    assert image_variants.generate_variants(str(source), cache, 'drawing.svg') is None
+    assert image_variants.find_manifest(cache, 'drawing.svg') is None
+
+
+def test_forget_variants(tmp_path):
+    source = make_image(tmp_path / 'white.png')
+    cache = str(tmp_path / 'cache')
+    image_variants.generate_variants(source, cache, 'white.png')
+    image_variants.forget_variants(cache, 'white.png')
+    image_variants.forget_variants(cache, 'white.png')
+    assert image_variants.find_manifest(cache, 'white.png') is None
+
+
+def test_normalize_for_display(tmp_path):
+    source = make_image(tmp_path / 'large.jpg', size=(4000, 3000))
+    destination = str(tmp_path / 'display' / 'large.jpg')
+    assert image_variants.normalize_for_display(source, destination, (1920, 1080))
+    with Image.open(destination) as display_copy:
+        assert display_copy.size == (1440, 1080)
+        assert display_copy.format == 'JPEG'
+
+
+def test_normalize_for_display_small_image(tmp_path):
+    source = make_image(tmp_path / 'small.png', size=(800, 600))
+    destination = str(tmp_path / 'display' / 'small.png')
+    assert not image_variants.normalize_for_display(source, destination, (1920, 1080))
+    assert not os.path.exists(destination)
@@ -0,0 +1,63 @@
+from array import array
+
+import pytest
+
+import led_patterns
+import pi_agent
+
+GREEN = pi_agent.color(0, 255, 0)
+
+
+@pytest.mark.parametrize('name', sorted(led_patterns.PATTERNS))
+def test_render_frame_count_and_size(name):
+    frames = led_patterns.render(name, GREEN, 1000, 16, 50)
+    assert len(frames) == 51
+    assert all(isinstance(frame, array) and len(frame) == 16 for frame in frames)
+    assert list(frames[-1]) == [0] * 16
+
+
+def test_render_is_cached():
+    assert led_patterns.render('pulse', GREEN, 500, 16) is led_patterns.render('pulse', GREEN, 500, 16)
+
+
+def test_render_unknown_pattern():
+    with pytest.raises(ValueError):
+        led_patterns.render('sparkle', GREEN, 500, 16)
+
+
+def test_solid_reuses_one_frame():
+    frames = led_patterns.render('solid', GREEN, 200, 16, 50)
+    assert all(frame is frames[0] for frame in frames[:-1])
+    assert list(frames[0]) == [GREEN] * 16
+
+
+def test_flash_alternates():
+    frames = led_patterns.render('flash', GREEN, 600, 16, 10)
+    lit = [frame[0] == GREEN for frame in frames[:-1]]
+    assert lit == [True, False] * 3
+
+
+def test_chase_lights_tail_only():
+    frame = led_patterns.render('chase', GREEN, 1000, 16, 50)[5]
+    assert frame[5] == GREEN
+    assert sum(1 for pixel in frame if pixel) == led_patterns.CHASE_TAIL
+
+
+def test_scale():
+    assert led_patterns.scale(pi_agent.color(200, 100, 50), 0.5) == pi_agent.color(100, 50, 25)
+
+
+def test_write_frame_to_fake_strip():
+    strip = pi_agent.FakeStrip(4)
+    led_patterns.write_frame(strip, array('I', [1, 2, 3, 4]))
+    strip.show()
+    assert strip.shown == [1, 2, 3, 4]
+
+
+def test_controller_plays_pattern_and_clears():
+    strip = pi_agent.FakeStrip()
+    controller = pi_agent.LedController(strip, frame_rate=200)
+    controller.show_pattern('pulse', GREEN, 50)
+    controller._worker.join()
+    assert strip.show_count == 11
+    assert strip.shown == [0] * 16
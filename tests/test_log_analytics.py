@@ -0,0 +1,88 @@
+import gzip
+import os
+
+from elephant_vending_machine.libraries.log_analytics import LogAnalytics, parse_trials
+
+SESSION = [
+    ['2020-03-17 10:00:00.000000', 'Experiment example_experiment.py started'],
+    ['2020-03-17 10:00:01.000000', 'Trial 1 started'],
+    ['2020-03-17 10:00:02.000000', 'Trial 1 picked middle when selecting fixation cross'],
+    ['2020-03-17 10:00:03.000000', 'Trial 1 correct stimuli displayed on left'],
+    ['2020-03-17 10:00:04.500000', 'Trial 1 picked left'],
+    ['2020-03-17 10:00:05', 'Trial 2 correct stimuli displayed on right'],
+    ['2020-03-17 10:00:06.000000', 'Trial 2 picked left'],
+    ['2020-03-17 10:00:07.000000', 'Trial 2 picked right'],
+    ['2020-03-17 10:00:08.000000', 'Trial 3 correct stimuli displayed on right'],
+    ['2020-03-17 10:05:08.000000', 'Trial 3 no selection made.'],
+    ['2020-03-17 10:05:09.000000', 'Trial 4 correct stimuli displayed on right'],
+]
+
+
+def write_log(directory, name, rows, compressed=False):
+    content = ''.join(f'"{timestamp}","{message}"\r\n' for timestamp, message in rows)
+    path = os.path.join(str(directory), name)
+    if compressed:
+        with gzip.open(path + '.gz', 'wt', newline='') as log:
+            log.write(content)
+    else:
+        with open(path, 'w', newline='') as log:
+            log.write(content)
+
+
+def test_parse_trials():
+    trials = parse_trials('log.csv', 'example_experiment.py', SESSION)
+    assert [(trial['trial'], trial['picked_side'], trial['correct']) for trial in trials] == [
+        (1, 'left', 1), (2, 'left', 0), (3, None, 0), (4, None, None)]
+    assert trials[0]['reaction_ms'] == 1500
+    assert trials[0]['day'] == '2020-03-17'
+    assert trials[2]['reaction_ms'] is None
+
+
+def test_ingest_and_accuracy(tmp_path):
+    logs = tmp_path / 'log'
+    logs.mkdir()
+    write_log(logs, '2020-03-17 10:00:00.000000 example_experiment.py.csv', SESSION)
+    write_log(logs, '2020-03-18 10:00:00.000000 other.py.csv', [
+        ['2020-03-18 10:00:00.000000', 'Trial 1 correct stimuli displayed on left'],
+        ['2020-03-18 10:00:01.000000', 'Trial 1 picked left'],
+    ], compressed=True)
+    write_log(logs, '2020-03-19 10:00:00.000000 other.py.csv', [], compressed=False)
+    write_log(logs, 'notes.csv', SESSION)
+    analytics = LogAnalytics(str(tmp_path / 'analytics.sqlite3'))
+
+    assert analytics.ingest(str(logs), active=['2020-03-19 10:00:00.000000 other.py.csv']) == 2
+    assert analytics.ingest(str(logs)) == 1
+    assert analytics.ingest(str(logs)) == 0
+
+    days = analytics.accuracy()
+    assert [(day['day'], day['trials'], day['correct'], day['no_selection']) for day in days] == [
+        ('2020-03-17', 3, 1, 1), ('2020-03-18', 1, 1, 0)]
+    assert days[0]['accuracy'] == 1 / 3
+    assert days[0]['mean_reaction_ms'] == 1250
+    assert [day['day'] for day in analytics.accuracy(experiment='other.py')] == ['2020-03-18']
+    assert [day['day'] for day in analytics.accuracy(since='2020-03-18')] == ['2020-03-18']
+    assert [day['day'] for day in analytics.accuracy(until='2020-03-17')] == ['2020-03-17']
+
+
+def test_compressed_archived_and_removed_logs(tmp_path):
+    logs = tmp_path / 'log'
+    (logs / 'archive').mkdir(parents=True)
+    name = '2020-03-17 10:00:00.000000 example_experiment.py.csv'
+    write_log(logs, name, SESSION)
+    analytics = LogAnalytics(str(tmp_path / 'analytics.sqlite3'))
+    analytics.ingest(str(logs))
+    os.remove(os.path.join(str(logs), name))
+    write_log(logs / 'archive', name, SESSION, compressed=True)
+    assert analytics.ingest(str(logs)) == 1
+    assert analytics.accuracy()[0]['trials'] == 3
+    os.remove(os.path.join(str(logs / 'archive'), name + '.gz'))
+    analytics.ingest(str(logs))
+    assert analytics.accuracy() == []
+
+
+def test_reaction_times_use_monotonic_column():
+    rows = [
+        ['2020-03-17 10:00:03.000000', 'Trial 1 correct stimuli displayed on left', '500.000000'],
+        ['2020-03-17 10:00:05.000000', 'Trial 1 picked left', '500.250000'],
+    ]
+    assert parse_trials('log.csv', 'example_experiment.py', rows)[0]['reaction_ms'] == 250
@@ -0,0 +1,71 @@
+import csv
+import gzip
+import os
+
+from elephant_vending_machine.libraries import log_archive
+
+
+def test_compress_log(tmp_path):
+    path = tmp_path / 'run.csv'
+    path.write_text('"2020-03-17 04:26:02.085651","Experiment started"\r\n')
+    os.utime(path, (1000000, 1000000))
+    compressed_path = log_archive.compress_log(str(path))
+    assert compressed_path == str(path) + '.gz'
+    assert os.listdir(tmp_path) == ['run.csv.gz']
+    assert os.path.getmtime(compressed_path) == 1000000
+    with gzip.open(compressed_path, 'rt') as log:
+        assert 'Experiment started' in log.read()
+    assert log_archive.compress_log(str(path)) is None
+
+
+def test_decompress_log(tmp_path):
+    path = tmp_path / 'run.csv'
+    path.write_text('"2020-03-17 04:26:02.085651","Experiment started"\r\n')
+    os.utime(path, (1000000, 1000000))
+    compressed_path = log_archive.compress_log(str(path))
+    assert log_archive.decompress_log(compressed_path) == str(path)
+    assert os.listdir(tmp_path) == ['run.csv']
+    assert os.path.getmtime(path) == 1000000
+    assert 'Experiment started' in path.read_text()
+
+
+def test_find_and_open_log(tmp_path):
+    (tmp_path / 'plain.csv').write_text('"a","b"\r\n')
+    with gzip.open(str(tmp_path / 'compressed.csv.gz'), 'wt', newline='') as log:
+        log.write('"c","d"\r\n')
+    assert log_archive.find_log(str(tmp_path), 'plain.csv') == str(tmp_path / 'plain.csv')
+    assert log_archive.find_log(str(tmp_path), 'compressed.csv') == str(tmp_path / 'compressed.csv.gz')
+    assert log_archive.find_log(str(tmp_path), 'missing.csv') is None
+    for name, row in (('plain.csv', ['a', 'b']), ('compressed.csv', ['c', 'd'])):
+        with log_archive.open_log(log_archive.find_log(str(tmp_path), name)) as log:
+            assert list(csv.reader(log)) == [row]
+
+
+def test_log_name():
+    assert log_archive.log_name('run.csv.gz') == 'run.csv'
+    assert log_archive.log_name('run.csv') == 'run.csv'
+
+
+def test_stream_zip(tmp_path):
+    import io
+    import zipfile
+    (tmp_path / 'plain.csv').write_bytes(os.urandom(200000))
+    (tmp_path / 'compressed.csv').write_text('"a","b"\r\n' * 1000)
+    log_archive.compress_log(str(tmp_path / 'compressed.csv'))
+    opened = []
+
+    def logs():
+        for name in ('plain.csv', 'missing.csv', 'compressed.csv'):
+            opened.append(name)
+            yield name, log_archive.find_log(str(tmp_path), name)
+
+    stream = log_archive.stream_zip(logs(), chunk_size=16384)
+    # The archive is sent while the first log is read
+    first = next(stream)
+    assert first and opened == ['plain.csv']
+    parts = [first] + list(stream)
+    assert all(parts)
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(parts)))
+    assert archive.namelist() == ['plain.csv', 'compressed.csv']
+    assert archive.read('plain.csv') == (tmp_path / 'plain.csv').read_bytes()
+    assert archive.read('compressed.csv') == b'"a","b"\r\n' * 1000
@@ -0,0 +1,71 @@
+import pytest
+
+import maestro
+
+
+class MockSerial:
+    def __init__(self, port):
+        self.port = port
+        self.writes = []
+        self.replies = bytearray()
+
+    def write(self, data):
+        self.writes.append(bytes(data))
+
+    def read(self, size=1):
+        data = bytes(self.replies[:size])
+        del self.replies[:size]
+        return data
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    monkeypatch.setattr('serial.Serial', MockSerial)
+    return maestro.Controller()
+
+
+def test_set_target_command(controller):
+    controller.setTarget(2, 6000)
+    assert controller.usb.writes == [bytes([0xaa, 0x0c, 0x04, 2, 6000 & 0x7f, (6000 >> 7) & 0x7f])]
+    assert controller.Targets[2] == 6000
+
+
+def test_send_cmd_accepts_legacy_strings(controller):
+    controller.sendCmd(chr(0x24))
+    assert controller.usb.writes == [bytes([0xaa, 0x0c, 0x24])]
+
+
+def test_get_position(controller):
+    controller.usb.replies += bytes([0x34, 0x12])
+    assert controller.getPosition(1) == 0x1234
+    assert controller.usb.writes == [bytes([0xaa, 0x0c, 0x10, 1])]
+
+
+def test_get_positions_single_write(controller):
+    controller.usb.replies += bytes([1, 0, 2, 0, 3, 1])
+    assert controller.getPositions([0, 1, 2]) == [1, 2, 259]
+    assert controller.usb.writes == [bytes([0xaa, 0x0c, 0x10, 0, 0xaa, 0x0c, 0x10, 1, 0xaa, 0x0c, 0x10, 2])]
+
+
+def test_batch_coalesces_writes(controller):
+    controller.usb.replies += bytes([5, 0])
+    with controller.batch() as batch:
+        controller.setTarget(3, 4000)
+        assert controller.getPosition(0) is None
+        controller.setSpeed(3, 10)
+    assert len(controller.usb.writes) == 1
+    assert controller.usb.writes[0] == bytes([0xaa, 0x0c, 0x04, 3, 4000 & 0x7f, (4000 >> 7) & 0x7f,
+                                              0xaa, 0x0c, 0x10, 0,
+                                              0xaa, 0x0c, 0x07, 3, 10, 0])
+    assert batch.positions == [5]
+
+
+def test_batch_discarded_on_error(controller):
+    with pytest.raises(RuntimeError):
+        with controller.batch():
+            controller.setTarget(3, 4000)
+            raise RuntimeError
+    assert controller.usb.writes == []
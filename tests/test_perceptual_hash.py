@@ -0,0 +1,58 @@
+import random
+
+from PIL import Image, ImageDraw
+
+from elephant_vending_machine.libraries.perceptual_hash import BKTree, difference_hash, hamming_distance
+
+
+def make_image(size, seed):
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    generator = random.Random(seed)
+    for _ in range(20):
+        x, y = generator.randrange(size[0]), generator.randrange(size[1])
+        draw.ellipse((x, y, x + size[0] // 4, y + size[1] // 4), fill=(generator.randrange(256),) * 3)
+    return image
+
+
+def test_difference_hash_survives_resizing():
+    original = make_image((800, 600), seed=1)
+    resized = original.resize((400, 300))
+    other = make_image((800, 600), seed=2)
+    assert hamming_distance(difference_hash(original), difference_hash(resized)) <= 4
+    assert hamming_distance(difference_hash(original), difference_hash(other)) > 10
+
+
+def test_hamming_distance():
+    assert hamming_distance(0b1010, 0b1010) == 0
+    assert hamming_distance(0b1010, 0b0101) == 4
+
+
+def test_bk_tree_search_matches_linear_scan():
+    generator = random.Random(0)
+    values = [generator.getrandbits(64) for _ in range(300)]
+    tree = BKTree()
+    for number, value in enumerate(values):
+        tree.add(value, number)
+    tree.add(values[0], 1000)
+    query = values[0] ^ 0b111
+    expected = sorted((hamming_distance(query, value), number) for number, value in enumerate(values)
+                      if hamming_distance(query, value) <= 20)
+    results = tree.search(query, 20)
+    assert [result for result in results if result[1] != 1000] == expected
+    assert (3, 1000) in results
+    assert BKTree().search(query, 64) == []
+
+
+def test_bk_tree_remove():
+    tree = BKTree()
+    tree.add(0b0000, 'a')
+    tree.add(0b0001, 'b')
+    tree.add(0b0011, 'c')
+    tree.add(0b0001, 'b')
+    assert tree.search(0b0001, 0) == [(0, 'b')]
+    tree.remove(0b0001, 'b')
+    tree.remove(0b0001, 'missing')
+    tree.remove(0b1111, 'a')
+    # The emptied node still leads to its children
+    assert tree.search(0b0001, 1) == [(1, 'a'), (1, 'c')]
@@ -0,0 +1,222 @@
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+import pi_agent
+from elephant_vending_machine.libraries.pi_agent_client import AgentClient, AgentError
+from elephant_vending_machine.libraries.vending_machine import VendingMachine
+
+
+@pytest.fixture
+def agent():
+    strip = pi_agent.FakeStrip()
+    server = pi_agent.AgentServer(('127.0.0.1', 0), pi_agent.LedController(strip))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield strip, server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.perf_counter() + timeout
+    while not condition() and time.perf_counter() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+def test_color_is_displayed_then_cleared(agent):
+    strip, port = agent
+    client = AgentClient('127.0.0.1', port)
+    response = client.set_color(0, 255, 0, 50)
+    assert response['status'] == 'ok'
+    assert wait_for(lambda: strip.shown == [pi_agent.color(0, 255, 0)] * pi_agent.LED_COUNT)
+    assert wait_for(lambda: strip.shown == [0] * pi_agent.LED_COUNT)
+    client.close()
+
+
+def test_color_command_does_not_block(agent):
+    _, port = agent
+    client = AgentClient('127.0.0.1', port)
+    start = time.perf_counter()
+    client.set_color(255, 0, 0, 5000)
+    assert time.perf_counter() - start < 1
+    client.send('off')
+    client.close()
+
+
+def test_connection_is_reused(agent):
+    _, port = agent
+    client = AgentClient('127.0.0.1', port)
+    client.send('ping')
+    connection = client._socket
+    client.send('ping')
+    assert client._socket is connection
+    client.close()
+
+
+def serve_connections(handlers):
+    """Accepts one connection per handler, called with the connection and the request it read."""
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen()
+    requests = []
+
+    def serve():
+        for handler in handlers:
+            connection, _ = listener.accept()
+            with connection, connection.makefile('rb') as reader:
+                line = reader.readline()
+                requests.append(json.loads(line))
+                handler(connection, requests[-1])
+        listener.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1], requests
+
+
+def acknowledge(connection, request):
+    connection.sendall(json.dumps({'id': request['id'], 'status': 'ok'}).encode() + b'\n')
+
+
+def test_dropped_connection_is_reopened():
+    port, requests = serve_connections([acknowledge, acknowledge])
+    client = AgentClient('127.0.0.1', port)
+    client.send('ping')
+    # The first connection is closed by the agent once it acknowledged the command
+    assert wait_for(lambda: client._closed_by_agent())
+    client.send('ping')
+    assert [request['id'] for request in requests] == [1, 2]
+    client.close()
+
+
+def test_missing_acknowledgement_is_not_retried():
+    port, requests = serve_connections([lambda connection, request: time.sleep(0.3), acknowledge])
+    client = AgentClient('127.0.0.1', port, timeout=0.1)
+    with pytest.raises(OSError):
+        client.send('color', red=255, green=0, blue=0, duration=1000)
+    assert client._socket is None
+    # A retry would be accepted once the first connection is closed
+    assert not wait_for(lambda: len(requests) > 1, timeout=0.5)
+
+
+def test_unknown_pattern_is_an_error(agent):
+    _, port = agent
+    client = AgentClient('127.0.0.1', port)
+    with pytest.raises(AgentError):
+        client.show_pattern('sparkle', 255, 0, 0, 100)
+    client.close()
+
+
+def test_time_command_reports_receive_and_send_times(agent):
+    _, port = agent
+    client = AgentClient('127.0.0.1', port)
+    before = time.perf_counter()
+    response = client.send('time')
+    assert before <= response['received'] <= response['sent'] <= time.perf_counter()
+    client.close()
+
+
+def test_display_command_reports_onset(agent):
+    _, port = agent
+    client = AgentClient('127.0.0.1', port)
+    before = time.perf_counter()
+    displayed = client.display('/home/pi/elephant_vending_machine/images/white_stimuli.png')
+    assert before <= displayed <= time.perf_counter()
+    with pytest.raises(AgentError):
+        client.send('display')
+    client.close()
+
+
+def test_simulated_display_records_images():
+    display = pi_agent.Display(None)
+    display.show('/tmp/white_stimuli.png')
+    display.show('/tmp/black_stimuli.png')
+    assert display.shown == ['/tmp/white_stimuli.png', '/tmp/black_stimuli.png']
+
+
+def test_viewer_runs_in_desktop_session(monkeypatch):
+    display = pi_agent.Display(user='pi')
+    monkeypatch.setattr(pi_agent.os, 'geteuid', lambda: 0)
+    assert display.command('/tmp/white_stimuli.png') == [
+        'sudo', '-u', 'pi', 'env', 'DISPLAY=:0', 'XAUTHORITY=/home/pi/.Xauthority',
+        'feh', '-F', '/tmp/white_stimuli.png']
+    monkeypatch.setattr(pi_agent.os, 'geteuid', lambda: 1000)
+    assert display.command('/tmp/white_stimuli.png')[0] == 'env'
+
+
+def test_failed_viewer_is_reported_and_previous_image_kept():
+    display = pi_agent.Display(('sh', '-c', 'sleep 5', 'viewer'), user=None, startup_check=0.05)
+    before = time.perf_counter()
+    assert display.show('/tmp/white_stimuli.png') >= before
+    # The display is acknowledged without waiting for the startup check
+    assert time.perf_counter() - before < display.startup_check
+    assert wait_for(lambda: display._process is not None)
+    running = display._process
+    display.viewer_command = ('false',)
+    display.show('/tmp/black_stimuli.png')
+    assert wait_for(lambda: display._failures)
+    assert 'black_stimuli.png' in display.take_failures()[0]
+    assert display.take_failures() == []
+    assert display._process is running
+    assert running.poll() is None
+    display.viewer_command = ('sh', '-c', 'sleep 5', 'viewer')
+    display.show('/tmp/white_stimuli.png')
+    # The previous viewer is closed once the new one is running
+    assert wait_for(lambda: running.poll() is not None)
+    display._process.terminate()
+    display._process.wait()
+
+
+def test_viewer_failures_are_reported_to_the_controller():
+    display = pi_agent.Display(('false',), user=None, startup_check=0.05)
+    server = pi_agent.AgentServer(('127.0.0.1', 0), pi_agent.LedController(pi_agent.FakeStrip()), display)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = AgentClient('127.0.0.1', server.server_address[1])
+    client.display('/tmp/white_stimuli.png')
+    assert wait_for(lambda: display._failures)
+    assert len(client.display_failures()) == 1
+    client.display('/tmp/black_stimuli.png')
+    assert wait_for(lambda: display._failures)
+    response = client.send('display', path='/tmp/white_stimuli.png')
+    assert 'black_stimuli.png' in response['failed'][0]
+    client.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_stimulus_display_time_in_controller_clock(agent):
+    _, port = agent
+    vending_machine = VendingMachine(['127.0.0.1', '2', '3'], {'PI_AGENT_PORT': port})
+    group = vending_machine.left_group
+    before = time.perf_counter()
+    group.display_on_screen('white_stimuli.png', True)
+    # The agent runs on the same machine, so its clock is the controller's
+    assert abs(group.last_display_time - (before + time.perf_counter()) / 2) < 0.5
+    assert group.clock.offset is not None
+    group.clock.stop()
+    group.agent.close()
+
+
+def test_clock_sync_does_not_wait_for_display_commands(agent):
+    _, port = agent
+    vending_machine = VendingMachine(['127.0.0.1', '2', '3'], {'PI_AGENT_PORT': port})
+    group = vending_machine.left_group
+    # A display command in flight holds the lock of the agent connection
+    with group.agent._lock:
+        round_trip, _ = group.clock.sample()
+    assert round_trip < 0.5
+    vending_machine.close()
+
+
+def test_led_falls_back_to_ssh_without_agent(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        'elephant_vending_machine.libraries.vending_machine.SensorGrouping._led_color_over_ssh',
+        lambda self, *args: calls.append(args))
+    vending_machine = VendingMachine(['127.0.0.1', '2', '3'], {'PI_AGENT_PORT': 1})
+    vending_machine.left_group.led_color_with_time(0, 255, 0, 1000)
+    assert calls == [(0, 255, 0, 1000)]
@@ -0,0 +1,92 @@
+import pstats
+import time
+import tracemalloc
+
+import pytest
+
+from elephant_vending_machine.libraries import profiling
+
+
+def busy_wait(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def allocate():
+    return [bytearray(1024) for _ in range(1000)]
+
+
+def test_sampling_profile(tmp_path):
+    with profiling.Profiler(profiling.SAMPLING, interval=0.001) as profiler:
+        busy_wait(0.1)
+        kept = allocate()
+    assert profiler.samples > 10
+    folded = profiler.folded().splitlines()
+    stack, count = folded[0].rsplit(' ', 1)
+    assert [frame.split(' ')[0] for frame in stack.split(';')[-2:]] == [
+        'test_sampling_profile', 'busy_wait']
+    assert stack.endswith('busy_wait (test_profiling.py:10)')
+    assert int(count) <= profiler.samples
+    paths = profiler.save(str(tmp_path / 'run'))
+    assert paths == [str(tmp_path / 'run.folded'), str(tmp_path / 'run.memory.txt')]
+    report = (tmp_path / 'run.memory.txt').read_text()
+    assert report.startswith('Peak traced memory')
+    assert 'test_profiling.py' in report
+    assert not tracemalloc.is_tracing()
+    del kept
+
+
+def test_cprofile_profile(tmp_path):
+    with profiling.Profiler(profiling.CPROFILE, memory=False) as profiler:
+        allocate()
+    assert profiler.save(str(tmp_path / 'run')) == [str(tmp_path / 'run.prof')]
+    functions = {function for _, _, function in pstats.Stats(str(tmp_path / 'run.prof')).stats}
+    assert 'allocate' in functions
+
+
+def test_tracing_started_elsewhere_is_kept():
+    tracemalloc.start()
+    try:
+        with profiling.Profiler(profiling.SAMPLING):
+            allocate()
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        profiling.Profiler('perf')
+
+
+def test_overlapping_profilers_share_tracing(tmp_path):
+    first = profiling.Profiler(profiling.SAMPLING)
+    second = profiling.Profiler(profiling.SAMPLING)
+    first.start()
+    second.start()
+    kept = allocate()
+    first.stop()
+    assert tracemalloc.is_tracing()
+    second.stop()
+    assert not tracemalloc.is_tracing()
+    assert second.memory_report().startswith('Peak traced memory')
+    # Profilers stopped in the order they started work the same
+    first.start()
+    second.start()
+    second.stop()
+    first.stop()
+    assert not tracemalloc.is_tracing()
+    del kept
+
+
+def test_tracing_stopped_elsewhere():
+    profiler = profiling.Profiler(profiling.SAMPLING)
+    profiler.start()
+    tracemalloc.stop()
+    profiler.stop()
+    assert profiler.memory_report() == ''
+    # The next profiler starts tracing again
+    with profiling.Profiler(profiling.SAMPLING):
+        assert tracemalloc.is_tracing()
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,94 @@
+import gzip
+import os
+import time
+
+import pytest
+
+from elephant_vending_machine.libraries import retention
+
+
+def make_files(directory, ages):
+    now = time.time()
+    for name, age_days in ages.items():
+        path = directory / name
+        path.write_text(name)
+        os.utime(path, (now - age_days * 86400, now - age_days * 86400))
+    return now
+
+
+def names(entries):
+    return [entry.name for entry in entries]
+
+
+def test_select_files(tmp_path):
+    now = make_files(tmp_path, {'old.csv': 40, 'new.csv': 1, 'old.txt': 40, '.gitignore': 40})
+    (tmp_path / 'folder.csv').mkdir()
+    assert names(retention.select_files(str(tmp_path))) == ['new.csv', 'old.csv', 'old.txt']
+    assert names(retention.select_files(str(tmp_path), pattern='*.csv')) == ['new.csv', 'old.csv']
+    assert names(retention.select_files(str(tmp_path), before=now - 30 * 86400)) == ['old.csv', 'old.txt']
+    assert names(retention.select_files(str(tmp_path), names=['new.csv', 'missing.csv', 'folder.csv'])) == ['new.csv']
+
+
+def test_parse_date():
+    assert retention.parse_date('2020-03-17') < retention.parse_date('2020-03-17T04:26:02')
+    assert retention.parse_date('2020-03-17 04:26:02') == retention.parse_date('2020-03-17T04:26:02')
+    with pytest.raises(ValueError):
+        retention.parse_date('last week')
+
+
+def test_delete_files_reports_failures(tmp_path):
+    make_files(tmp_path, {'a.csv': 0, 'b.csv': 0})
+    entries = retention.select_files(str(tmp_path))
+    os.remove(entries[1].path)
+    removed = []
+    assert retention.delete_files(entries, removed.append) == (['a.csv'], ['b.csv'])
+    assert removed == ['a.csv']
+    assert os.listdir(tmp_path) == []
+
+
+def test_apply_policy_archives_old_files(tmp_path):
+    now = make_files(tmp_path, {'old.csv': 40, 'new.csv': 1, 'old.txt': 40})
+    policy = {'max_age_days': 30, 'pattern': '*.csv'}
+    assert retention.apply_policy(str(tmp_path), policy, now=now) == (['old.csv'], [])
+    assert sorted(os.listdir(tmp_path)) == ['archive', 'new.csv', 'old.txt']
+    with gzip.open(tmp_path / 'archive' / 'old.csv.gz', 'rt') as archive:
+        assert archive.read() == 'old.csv'
+
+
+def test_apply_policy_deletes_old_files(tmp_path):
+    now = make_files(tmp_path, {'old.csv': 40, 'new.csv': 1})
+    assert retention.apply_policy(str(tmp_path), {'max_age_days': 30, 'action': 'delete'}, now=now) == (['old.csv'], [])
+    assert os.listdir(tmp_path) == ['new.csv']
+    with pytest.raises(ValueError):
+        retention.apply_policy(str(tmp_path), {'max_age_days': 30, 'action': 'shred'})
+
+
+def test_retention_job(tmp_path):
+    make_files(tmp_path, {'old.csv': 40})
+    job = retention.RetentionJob([(str(tmp_path), {'max_age_days': 30, 'action': 'delete'}, None),
+                                  (str(tmp_path / 'missing'), {'max_age_days': 30}, None)], 3600)
+    job.start()
+    job.stop()
+    assert os.listdir(tmp_path) == []
+    assert job.run_once() == {str(tmp_path): []}
+
+
+def test_compressed_files_are_matched_by_name_and_archived_as_is(tmp_path):
+    now = make_files(tmp_path, {'old.csv.gz': 40})
+    entries = retention.select_files(str(tmp_path), names=['old.csv'], pattern='*.csv', suffixes=('.gz',))
+    assert names(entries) == ['old.csv.gz']
+    assert retention.archive_files(entries) == (['old.csv.gz'], [])
+    assert (tmp_path / 'archive' / 'old.csv.gz').read_text() == 'old.csv.gz'
+
+
+def test_apply_policy_compresses_old_files_in_place(tmp_path):
+    now = make_files(tmp_path, {'old.csv': 40, 'older.csv.gz': 50, 'new.csv': 1})
+    policy = {'max_age_days': 30, 'pattern': '*.csv', 'action': 'compress'}
+    assert retention.apply_policy(str(tmp_path), policy, now=now) == (['old.csv'], [])
+    assert sorted(os.listdir(tmp_path)) == ['new.csv', 'old.csv.gz', 'older.csv.gz']
+    with gzip.open(tmp_path / 'old.csv.gz', 'rt') as compressed:
+        assert compressed.read() == 'old.csv'
+    assert os.path.getmtime(tmp_path / 'old.csv.gz') == pytest.approx(now - 40 * 86400)
+    # Compressed files are still matched by their original name
+    policy['action'] = 'delete'
+    assert retention.apply_policy(str(tmp_path), policy, now=now) == (['old.csv.gz', 'older.csv.gz'], [])
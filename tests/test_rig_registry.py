@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+from elephant_vending_machine.libraries.rig_registry import Rig, RigRegistry, RigBusyError
+
+
+def test_default_rig_from_remote_hosts():
+    registry = RigRegistry.from_config({'REMOTE_HOSTS': ['1', '2', '3'], 'RIGS': {}})
+    rig = registry.get()
+    assert rig.name == 'default'
+    assert rig.hosts == ['1', '2', '3']
+    assert registry.get('default') is rig
+
+
+def test_rigs_from_config():
+    registry = RigRegistry.from_config({
+        'REMOTE_HOSTS': ['1', '2', '3'],
+        'RIGS': {
+            'north': {'REMOTE_HOSTS': ['4', '5', '6'], 'MAESTRO_PORT': '/dev/ttyACM2'},
+            'south': {'REMOTE_HOSTS': ['7', '8', '9']},
+        },
+    })
+    assert [rig.name for rig in registry] == ['north', 'south']
+    assert registry.get('north').vending_machine_config() == {'MAESTRO_PORT': '/dev/ttyACM2'}
+    with pytest.raises(KeyError):
+        registry.get('default')
+
+
+def test_rig_runs_one_experiment_at_a_time():
+    rig = Rig('test', ['1', '2', '3'])
+    release = threading.Event()
+    rig.start(release.wait, 'first.csv')
+    assert rig.busy
+    assert rig.status()['log_file'] == 'first.csv'
+    with pytest.raises(RigBusyError):
+        rig.start(release.wait, 'second.csv')
+    release.set()
+    rig.wait()
+    assert not rig.busy
+    assert rig.status()['log_file'] is None
+
+
+def test_rigs_run_in_parallel():
+    first, second = Rig('first', ['1', '2', '3']), Rig('second', ['4', '5', '6'])
+    release = threading.Event()
+    first.start(release.wait, 'first.csv')
+    second.start(release.wait, 'second.csv')
+    assert first.busy and second.busy
+    release.set()
+    first.wait()
+    second.wait()
+
+
+def test_rig_is_locked_across_workers(tmp_path):
+    lock_path = str(tmp_path / 'rigs' / 'test.lock')
+    # Each worker has its own registry, hence its own Rig
+    worker = Rig('test', ['1', '2', '3'], lock_path=lock_path)
+    other_worker = Rig('test', ['1', '2', '3'], lock_path=lock_path)
+    release = threading.Event()
+    worker.start(release.wait, 'first.csv')
+    assert other_worker.busy
+    assert other_worker.status()['log_file'] == 'first.csv'
+    with pytest.raises(RigBusyError, match='first.csv'):
+        other_worker.start(release.wait, 'second.csv')
+    release.set()
+    worker.wait()
+    assert not other_worker.busy
+    other_worker.start(lambda: None, 'second.csv')
+    other_worker.wait()
+    assert not worker.busy
+
+
+def test_rig_lock_files_from_config(tmp_path):
+    registry = RigRegistry.from_config({'RIGS': {'north': {'REMOTE_HOSTS': ['1', '2', '3']}}}, str(tmp_path))
+    assert registry.get('north').lock_path == str(tmp_path / 'north.lock')
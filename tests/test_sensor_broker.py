@@ -0,0 +1,120 @@
+import threading
+import time
+
+import pytest
+
+from elephant_vending_machine.libraries import sensor_broker
+from elephant_vending_machine.libraries.sensor_broker import (
+    SensorBroker, SensorBrokerError, SensorBrokerReader)
+from elephant_vending_machine.libraries.vending_machine import VendingMachine
+
+
+class FakeController:
+    def __init__(self, positions):
+        self.positions = positions
+        self.requests = []
+
+    def getPositions(self, channels):
+        self.requests.append(list(channels))
+        return [self.positions.get(channel, 0) for channel in channels]
+
+
+@pytest.fixture
+def shared_path(tmp_path):
+    return str(tmp_path / 'sensors')
+
+
+def test_reader_returns_published_sample(shared_path):
+    broker = SensorBroker(FakeController({0: 30, 1: 700, 5: 12}), shared_path, [0, 1, 5])
+    reader = SensorBrokerReader(shared_path)
+    broker.publish([30, 700, 12], 12.5)
+    assert reader.getPositions([5, 0, 1, 2]) == [12, 30, 700, 0]
+    assert reader.sample_time == 12.5
+    broker.poll()
+    assert reader.getPositions([1]) == [700]
+    assert reader.sample_time > 12.5
+    reader.close()
+    broker.close()
+
+
+def test_reader_waits_for_a_new_sample(shared_path):
+    broker = SensorBroker(FakeController({}), shared_path)
+    reader = SensorBrokerReader(shared_path, stale_after=0.05)
+    with pytest.raises(SensorBrokerError):
+        reader.getPositions([0])
+    broker.publish([1, 2, 3], 1.0)
+    assert reader.getPositions([0, 1, 2]) == [1, 2, 3]
+    # The same sample isn't returned twice
+    with pytest.raises(SensorBrokerError):
+        reader.getPositions([0])
+    reader.close()
+    broker.close()
+
+
+def test_reader_skips_partially_written_sample(shared_path, monkeypatch):
+    broker = SensorBroker(FakeController({}), shared_path)
+    broker.publish([1, 2, 3], 1.0)
+    reader = SensorBrokerReader(shared_path)
+    reads = []
+    unpack_from = sensor_broker.HEADER.unpack_from
+
+    class Header:
+        size = sensor_broker.HEADER.size
+
+        @staticmethod
+        def unpack_from(buffer, offset=0):
+            reads.append(None)
+            if len(reads) == 1:
+                # The broker is halfway through writing the next sample
+                return 3, 1.0
+            return unpack_from(buffer, offset)
+
+    monkeypatch.setattr(sensor_broker, 'HEADER', Header)
+    assert reader.read() == (2, 1.0, (1, 2, 3) + (0,) * 21)
+    assert len(reads) == 3
+    reader.close()
+    broker.close()
+
+
+def test_new_broker_continues_sequence(shared_path):
+    broker = SensorBroker(FakeController({}), shared_path)
+    broker.publish([1, 2, 3], 1.0)
+    broker.close()
+    broker = SensorBroker(FakeController({}), shared_path)
+    broker.publish([1, 2, 3], 2.0)
+    reader = SensorBrokerReader(shared_path)
+    assert reader.read()[0] == 4
+    reader.close()
+    broker.close()
+
+
+def test_missing_broker_is_an_error(shared_path):
+    with pytest.raises(OSError):
+        SensorBrokerReader(shared_path)
+
+
+def test_wait_for_input_reads_from_broker(shared_path, monkeypatch):
+    def no_serial_port(*args):
+        raise AssertionError('The serial port must not be opened')
+    monkeypatch.setattr('maestro.Controller.__init__', no_serial_port)
+    controller = FakeController({0: 1000, 1: 1000, 2: 1000})
+    broker = SensorBroker(controller, shared_path)
+    broker.publish([1000, 1000, 1000], time.perf_counter())
+    stop = threading.Event()
+
+    def run_broker():
+        while not stop.is_set():
+            broker.poll()
+            time.sleep(0.001)
+    thread = threading.Thread(target=run_broker, daemon=True)
+    thread.start()
+    vending_machine = VendingMachine(['1', '2', '3'], {'SENSOR_BROKER_PATH': shared_path})
+    threading.Timer(0.05, lambda: controller.positions.update({2: 30})).start()
+    result = vending_machine.wait_for_input(
+        [vending_machine.left_group, vending_machine.right_group], 5000)
+    assert result == 'right'
+    assert vending_machine.last_input_time == vending_machine._reader.sample_time
+    stop.set()
+    thread.join()
+    vending_machine.close()
+    broker.close()
@@ -0,0 +1,75 @@
+import pytest
+
+from elephant_vending_machine.libraries import sensor_replay
+from elephant_vending_machine.libraries.sensor_replay import ReplayController, synthetic_samples
+from elephant_vending_machine.libraries.sensor_trace import TraceRecorder
+from elephant_vending_machine.libraries.vending_machine import VendingMachine
+
+PINS = [0, 1, 2]
+
+
+def replay_machine(samples, config=None):
+    return VendingMachine(['1', '2', '3'], config, ReplayController(PINS, samples))
+
+
+def test_selection_is_replayed_in_trace_time():
+    # The right sensor sees an elephant 2.5 seconds into the trial
+    samples = synthetic_samples(PINS, 10, [(2.5, 3, 2, 20)], start=100)
+    vending_machine = replay_machine(samples)
+    groups = [vending_machine.left_group, vending_machine.right_group]
+    assert vending_machine.wait_for_input(groups, 5000) == 'right'
+    assert vending_machine.last_input_time == pytest.approx(102.5)
+
+
+def test_timeout_is_replayed_in_trace_time():
+    samples = synthetic_samples(PINS, 10, [(6, 7, 0, 20)])
+    vending_machine = replay_machine(samples)
+    groups = [vending_machine.left_group, vending_machine.middle_group]
+    assert vending_machine.wait_for_input(groups, 5000) == 'timeout'
+    assert vending_machine._reader.clock() == pytest.approx(5, abs=0.01)
+    assert vending_machine.wait_for_input(groups, 5000) == 'left'
+    assert vending_machine.last_input_time == pytest.approx(6)
+
+
+def test_threshold_is_replayed():
+    samples = synthetic_samples(PINS, 1, [(0.5, 0.6, 1, 45)])
+    groups = lambda machine: [machine.middle_group]
+    vending_machine = replay_machine(samples)
+    assert vending_machine.wait_for_input(groups(vending_machine), 5000) == 'middle'
+    vending_machine = replay_machine(samples, {'SENSOR_THRESHOLD': 40})
+    with pytest.raises(EOFError):
+        vending_machine.wait_for_input(groups(vending_machine), 5000)
+
+
+def test_recorded_trace_is_replayed(tmp_path):
+    path = str(tmp_path / 'session.trace')
+    recorder = TraceRecorder(path, PINS)
+    for sample_time, readings in synthetic_samples(PINS, 2, [(1, 2, 0, 30)], start=50):
+        recorder.record(sample_time, readings)
+    recorder.close()
+    replay = ReplayController.from_trace(path, start=50.5)
+    assert replay.remaining == 750
+    vending_machine = VendingMachine(['1', '2', '3'], sensor_reader=replay)
+    assert vending_machine.wait_for_input([vending_machine.left_group], 5000) == 'left'
+    assert vending_machine.last_input_time == pytest.approx(51)
+
+
+def test_replay_needs_samples():
+    with pytest.raises(ValueError):
+        ReplayController(PINS, [])
+
+
+def test_replay_command(tmp_path, capsys):
+    path = str(tmp_path / 'session.trace')
+    recorder = TraceRecorder(path, PINS)
+    for sample_time, readings in synthetic_samples(PINS, 4, [(1, 1.5, 2, 30), (3, 4, 0, 10)]):
+        recorder.record(sample_time, readings)
+    recorder.close()
+    sensor_replay.main([path, '--timeout', '1000'])
+    lines = capsys.readouterr().out.splitlines()
+    selections = [line.split()[1] for line in lines[:-1]]
+    # The wait started at 0 times out just before the right sensor is triggered at 1 second
+    assert selections[:2] == ['timeout', 'right']
+    assert lines[1].split()[0] == '1.000000'
+    assert 'left' in selections
+    assert lines[-1].startswith('Replayed 2000 samples')
@@ -0,0 +1,71 @@
+import pytest
+
+from elephant_vending_machine.libraries.sensor_trace import TraceReader, TraceRecorder
+
+
+@pytest.fixture
+def trace_path(tmp_path):
+    return str(tmp_path / 'session.csv.trace')
+
+
+def test_samples_are_read_back(trace_path):
+    recorder = TraceRecorder(trace_path, [0, 1, 2], capacity=16)
+    for index in range(5):
+        recorder.record(10 + index * 0.001, [index, 1000, 0])
+    with TraceReader(trace_path) as trace:
+        assert trace.pins == [0, 1, 2]
+        assert len(trace) == 5
+        assert trace.sample(0) == (10.0, (0, 1000, 0))
+        assert [readings[0] for _, readings in trace.samples(10.001, 10.003)] == [1, 2, 3]
+        assert [readings[0] for _, readings in trace.around(10.004, 0.0015)] == [3, 4]
+        assert len(trace.samples()) == 5
+    recorder.close()
+
+
+def test_ring_keeps_latest_samples(trace_path):
+    recorder = TraceRecorder(trace_path, [3], capacity=4)
+    for index in range(10):
+        recorder.record(float(index), [index])
+    recorder.close()
+    with TraceReader(trace_path) as trace:
+        assert trace.samples() == [(6.0, (6,)), (7.0, (7,)), (8.0, (8,)), (9.0, (9,))]
+        assert trace.samples(start=7.5) == [(8.0, (8,)), (9.0, (9,))]
+        assert trace.samples(end=2.0) == []
+
+
+def test_resumed_recording_keeps_samples(trace_path):
+    recorder = TraceRecorder(trace_path, [0, 1, 2], capacity=16)
+    recorder.record(1.0, [1, 1, 1])
+    recorder.close()
+    recorder = TraceRecorder(trace_path, [0, 1, 2], capacity=16, resume=True)
+    recorder.record(2.0, [2, 2, 2])
+    recorder.close()
+    with TraceReader(trace_path) as trace:
+        assert trace.samples() == [(1.0, (1, 1, 1)), (2.0, (2, 2, 2))]
+    # A trace of other pins is replaced
+    recorder = TraceRecorder(trace_path, [3, 4, 5], capacity=16, resume=True)
+    recorder.close()
+    with TraceReader(trace_path) as trace:
+        assert trace.pins == [3, 4, 5]
+        assert len(trace) == 0
+
+
+def test_reader_sees_samples_recorded_after_opening(trace_path):
+    recorder = TraceRecorder(trace_path, [0, 1], capacity=8)
+    trace = TraceReader(trace_path)
+    assert trace.samples() == []
+    recorder.record(1.0, [20, 30])
+    assert trace.samples() == [(1.0, (20, 30))]
+    trace.close()
+    recorder.close()
+
+
+def test_invalid_traces(trace_path, tmp_path):
+    with pytest.raises(ValueError):
+        TraceRecorder(trace_path, list(range(9)))
+    not_a_trace = tmp_path / 'log.csv'
+    not_a_trace.write_text('"2020-03-17 05:15:06","Trial 1 picked left","12.5"\n' * 2)
+    with pytest.raises(ValueError):
+        TraceReader(str(not_a_trace))
+    with pytest.raises(OSError):
+        TraceReader(str(tmp_path / 'missing.trace'))
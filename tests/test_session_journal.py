@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from elephant_vending_machine.libraries.session_journal import (
+    ExperimentSession, decode_random_state, encode_random_state, read_journal)
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / 'session.csv.journal')
+
+
+def run_trials(session, count, crash_at=None):
+    draws = []
+    for trial in session.trials(count):
+        if trial == crash_at:
+            return draws
+        draws.append(session.random.random())
+        session.state['completed'] = session.state.get('completed', 0) + 1
+    return draws
+
+
+def test_random_state_round_trip():
+    import random
+    generator = random.Random(42)
+    generator.gauss(0, 1)
+    state = json.loads(json.dumps(encode_random_state(generator.getstate())))
+    assert decode_random_state(state) == generator.getstate()
+
+
+def test_resumed_session_continues_where_it_stopped(journal_path, tmp_path):
+    uninterrupted = run_trials(
+        ExperimentSession.create(str(tmp_path / 'other.journal'), 'experiment.py', seed=7), 5)
+
+    session = ExperimentSession.create(journal_path, 'experiment.py', 'north', seed=7)
+    draws = run_trials(session, 5, crash_at=3)
+    resumed = ExperimentSession.resume(journal_path)
+    assert resumed.resumed
+    assert (resumed.experiment, resumed.rig, resumed.trial) == ('experiment.py', 'north', 3)
+    assert resumed.state == {'completed': 3}
+    draws += run_trials(resumed, 5)
+    assert draws == uninterrupted
+    assert resumed.state == {'completed': 5}
+    assert not resumed.finished
+    resumed.finish()
+    assert ExperimentSession.resume(journal_path).finished
+
+
+def test_new_session(journal_path):
+    session = ExperimentSession.create(journal_path, 'experiment.py')
+    assert not session.resumed
+    assert session.trial == 0
+    resumed = ExperimentSession.resume(journal_path)
+    assert (resumed.trial, resumed.seed, resumed.resumed) == (0, session.seed, False)
+
+
+def test_truncated_checkpoint_is_ignored(journal_path):
+    session = ExperimentSession.create(journal_path, 'experiment.py')
+    session.checkpoint()
+    session.checkpoint()
+    with open(journal_path, 'a') as journal:
+        journal.write('{"trial": 2, "sta')
+    header, checkpoint, finished = read_journal(journal_path)
+    assert header['experiment'] == 'experiment.py'
+    assert checkpoint['trial'] == 1
+    assert not finished
+    with open(journal_path, 'a') as journal:
+        journal.write('\n{"finished": true}\n')
+    with pytest.raises(ValueError):
+        read_journal(journal_path)
+
+
+def test_invalid_journals(journal_path):
+    with pytest.raises(FileNotFoundError):
+        ExperimentSession.resume(journal_path)
+    with open(journal_path, 'w') as journal:
+        journal.write('{"trial": 0}\n')
+    with pytest.raises(ValueError):
+        ExperimentSession.resume(journal_path)
@@ -0,0 +1,74 @@
+import os
+import random
+
+import pytest
+
+from elephant_vending_machine.libraries import trial_sequences
+
+
+def longest_run(sequence):
+    longest = run = 0
+    for index, value in enumerate(sequence):
+        run = run + 1 if index and value == sequence[index - 1] else 1
+        longest = max(longest, run)
+    return longest
+
+
+def test_balanced_sequence():
+    sequence = trial_sequences.balanced_sequence(['left', 'right'], 100, max_run=3,
+                                                 rng=random.Random(1))
+    assert len(sequence) == 100
+    assert sequence.count('left') == sequence.count('right') == 50
+    assert longest_run(sequence) <= 3
+    # Every block of 10 trials is balanced too
+    assert all(sequence[start:start + 10].count('left') == 5 for start in range(0, 100, 10))
+
+
+def test_partial_block_stays_balanced():
+    for seed in range(20):
+        sequence = trial_sequences.balanced_sequence(['left', 'middle', 'right'], 35,
+                                                     max_run=2, rng=random.Random(seed))
+        counts = [sequence.count(value) for value in ('left', 'middle', 'right')]
+        assert sorted(counts) == [11, 12, 12]
+        assert longest_run(sequence) <= 2
+
+
+def test_impossible_constraints():
+    with pytest.raises(ValueError):
+        trial_sequences.balanced_sequence(['left', 'right'], 10, block_size=5)
+    with pytest.raises(ValueError):
+        trial_sequences.balanced_sequence(['left'], 10, max_run=3, max_attempts=10)
+
+
+def test_rotation():
+    sequence = trial_sequences.rotation(['a', 'b', 'c'], 31, random.Random(3))
+    assert len(sequence) == 31
+    for start in range(0, 30, 3):
+        assert sorted(sequence[start:start + 3]) == ['a', 'b', 'c']
+    assert longest_run(sequence) == 1
+
+
+def test_plan_is_reproducible():
+    plan = trial_sequences.generate_plan(42, 20, sessions=3, stimuli=['a.png', 'b.png'])
+    assert plan == trial_sequences.generate_plan(42, 20, sessions=3, stimuli=['a.png', 'b.png'])
+    assert plan != trial_sequences.generate_plan(43, 20, sessions=3, stimuli=['a.png', 'b.png'])
+    assert [len(session) for session in plan] == [20, 20, 20]
+    assert all([trial['side'] for trial in session].count('left') == 10 for session in plan)
+    assert all(trial['stimulus'] in ('a.png', 'b.png') for trial in plan[0])
+
+
+def test_cached_plan(tmp_path, monkeypatch):
+    directory = str(tmp_path / 'sequences')
+    plan = trial_sequences.cached_plan('experiment.py', 7, 40, directory, sessions=2)
+    assert plan == trial_sequences.generate_plan(7, 40, sessions=2)
+    assert len(os.listdir(directory)) == 1
+    monkeypatch.setattr(trial_sequences, 'generate_plan', lambda *args, **kwargs: None)
+    assert trial_sequences.cached_plan('experiment.py', 7, 40, directory, sessions=2) == plan
+    assert trial_sequences.cached_plan('experiment.py', 8, 40, directory, sessions=2) is None
+
+
+def test_single_session_plans_are_not_cached(tmp_path):
+    directory = str(tmp_path / 'sequences')
+    plan = trial_sequences.cached_plan('experiment.py', 7, 20, directory)
+    assert plan == trial_sequences.generate_plan(7, 20)
+    assert not os.path.exists(directory)
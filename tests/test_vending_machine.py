@@ -1,22 +1,28 @@
 from elephant_vending_machine.libraries.vending_machine import VendingMachine, SensorGrouping, LEFT_SCREEN
+from elephant_vending_machine.libraries.sensor_replay import ReplayController, synthetic_samples
+from elephant_vending_machine.libraries.sensor_trace import TraceReader
 import pytest
 import time
 
 
-def new_init(self):
+def new_init(self, *args):
     self.getPosition = lambda pin_number: 30 if pin_number == 0 else 0
+    self.getPositions = lambda pin_numbers: [self.getPosition(pin) for pin in pin_numbers]
 
 
-def new_init_timeout(self):
+def new_init_timeout(self, *args):
     self.getPosition = lambda pin_number: 0
+    self.getPositions = lambda pin_numbers: [self.getPosition(pin) for pin in pin_numbers]
 
 
 def test_wait_for_input(monkeypatch):
     monkeypatch.setattr('maestro.Controller.__init__', new_init)
     vending_machine = VendingMachine(['1', '2', '3'])
+    before = time.perf_counter()
     result = vending_machine.wait_for_input(
         [vending_machine.left_group, vending_machine.right_group], 5000)
     assert result == 'left'
+    assert before <= vending_machine.last_input_time <= time.perf_counter()
 
 
 def test_wait_for_input_timeout(monkeypatch):
@@ -26,6 +32,43 @@ def test_wait_for_input_timeout(monkeypatch):
     result = vending_machine.wait_for_input(
         [vending_machine.left_group, vending_machine.right_group], 1000)
     assert result == 'timeout'
+    assert vending_machine.last_input_time is None
+
+
+def test_wait_for_input_records_trace(monkeypatch, tmp_path):
+    readings = iter([[900, 800, 0], [900, 800, 850], [30, 800, 850]])
+    monkeypatch.setattr('maestro.Controller.__init__', lambda self, *args: None)
+    monkeypatch.setattr('maestro.Controller.getPositions', lambda self, pins: next(readings))
+    monkeypatch.setattr('maestro.Controller.close', lambda self: None)
+    vending_machine = VendingMachine(['1', '2', '3'])
+    vending_machine.start_trace(str(tmp_path / 'session.trace'))
+    result = vending_machine.wait_for_input(
+        [vending_machine.right_group, vending_machine.left_group], 5000)
+    assert result == 'left'
+    vending_machine.close()
+    with TraceReader(str(tmp_path / 'session.trace')) as trace:
+        samples = trace.samples()
+    assert [sample_readings for _, sample_readings in samples] == [
+        (900, 800, 0), (900, 800, 850), (30, 800, 850)]
+    assert samples[-1][0] == vending_machine.last_input_time
+
+
+def test_calibrate_sets_thresholds_per_pin():
+    samples = synthetic_samples([0, 1, 2], 1, baseline=700)
+    samples = [(sample_time, (reading, reading // 2, reading + index % 3 * 10))
+               for index, (sample_time, (reading, _, _)) in enumerate(samples)]
+    vending_machine = VendingMachine(['1', '2', '3'],
+                                     sensor_reader=ReplayController([0, 1, 2], samples))
+    results = vending_machine.calibrate(0.5)
+    assert [result['samples'] for result in results] == [250, 250, 250]
+    thresholds = vending_machine.config['SENSOR_THRESHOLDS']
+    assert thresholds == {0: 630, 1: 315, 2: int((710 - 5 * results[2]['noise']) * 0.9)}
+    # The middle sensor reading 300 is now a selection, the left one reading 640 isn't
+    replay = ReplayController([0, 1, 2], [(10, (640, 1000, 1000)), (10.1, (1000, 300, 1000))])
+    vending_machine._reader = replay
+    groups = [vending_machine.left_group, vending_machine.middle_group]
+    assert vending_machine.wait_for_input(groups, 5000) == 'middle'
+    assert vending_machine.last_input_time == 10.1
 
 
 @pytest.mark.skip(reason="There is no good way to unit test an ssh connection and visual display with pytest.")
@@ -37,3 +80,65 @@ def test_display(monkeypatch):
     vending_machine.left_group.display_on_screen('elephant2.jpg', True)
     assert type(
         vending_machine.left_group.pid_of_previous_display_command) is int
+
+
+class MockResult:
+    def __init__(self, output=b'', pid=1234):
+        self.output = output
+        self.pid = pid
+
+
+class MockShell:
+    def __init__(self, output=b''):
+        self.output = output
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def run(self, command, allow_error=False):
+        self.commands.append(command)
+        return MockResult(self.output)
+
+    def spawn(self, command, update_env=None, store_pid=False):
+        self.commands.append(command)
+        return MockResult()
+
+
+def test_stage_stimuli_and_display(monkeypatch):
+    def no_agent(self, path):
+        raise OSError('Connection refused')
+    shell = MockShell(b'white_stimuli.png\n')
+    monkeypatch.setattr(
+        'elephant_vending_machine.libraries.pi_agent_client.AgentClient.display', no_agent)
+    monkeypatch.setattr(
+        'elephant_vending_machine.libraries.vending_machine.SensorGrouping._shell', lambda self: shell)
+    vending_machine = VendingMachine(['1', '2', '3'])
+    vending_machine.stage_stimuli(['white_stimuli.png', 'missing.png'])
+    group = vending_machine.left_group
+    assert group.staged_stimuli == {'white_stimuli.png'}
+    assert shell.commands[0][-2:] == ['/home/pi/elephant_vending_machine/images/white_stimuli.png',
+                                      '/home/pi/elephant_vending_machine/images/missing.png']
+
+    group.display_on_screen('white_stimuli.png', True)
+    assert shell.commands[-1][2] == '/dev/shm/elephant_vending_machine/white_stimuli.png'
+    group.display_on_screen('black_stimuli.png', False)
+    assert shell.commands[-1][2] == '/home/pi/elephant_vending_machine/images/black_stimuli.png'
+    assert group.last_display_time is None
+
+    vending_machine.clear_staged_stimuli()
+    assert group.staged_stimuli == set()
+    assert shell.commands[-1] == ['rm', '-rf', '/dev/shm/elephant_vending_machine']
+
+
+def test_stage_stimuli_unreachable_pi(monkeypatch):
+    def unreachable(self):
+        raise OSError('No route to host')
+    monkeypatch.setattr(
+        'elephant_vending_machine.libraries.vending_machine.SensorGrouping._shell', unreachable)
+    vending_machine = VendingMachine(['1', '2', '3'])
+    vending_machine.stage_stimuli(['white_stimuli.png'])
+    assert vending_machine.left_group.staged_stimuli == set()
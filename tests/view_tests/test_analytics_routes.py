@@ -0,0 +1,39 @@
+import json
+import os
+
+import pytest
+
+from elephant_vending_machine import elephant_vending_machine
+
+LOG_NAME = '2001-02-03 10:00:00.000000 unittest_experiment.py.csv'
+LOG_PATH = 'elephant_vending_machine/static/log/' + LOG_NAME
+
+
+@pytest.fixture
+def client():
+    elephant_vending_machine.APP.config['TESTING'] = True
+
+    with elephant_vending_machine.APP.test_client() as client:
+        yield client
+        if os.path.exists(LOG_PATH):
+            os.remove(LOG_PATH)
+
+def test_get_accuracy(client):
+    with open(LOG_PATH, 'w') as log:
+        log.write('"2001-02-03 10:00:01.000000","Trial 1 correct stimuli displayed on left"\r\n')
+        log.write('"2001-02-03 10:00:02.000000","Trial 1 picked right"\r\n')
+        log.write('"2001-02-03 10:00:03.000000","Trial 2 correct stimuli displayed on left"\r\n')
+        log.write('"2001-02-03 10:00:04.000000","Trial 2 picked left"\r\n')
+    response = client.get('/analytics/accuracy?experiment=unittest_experiment.py&since=2001-02-03&until=2001-02-03')
+    assert response.status_code == 200
+    days = json.loads(response.data)['days']
+    assert [(day['day'], day['trials'], day['accuracy']) for day in days] == [('2001-02-03', 2, 0.5)]
+
+    os.remove(LOG_PATH)
+    response = client.get('/analytics/accuracy?experiment=unittest_experiment.py')
+    assert json.loads(response.data)['days'] == []
+
+def test_get_accuracy_bad_date(client):
+    response = client.get('/analytics/accuracy?since=March')
+    assert response.status_code == 400
+    assert json.loads(response.data)['message'] == 'Error with request: March is not a YYYY-MM-DD date.'
@@ -70,4 +70,14 @@ def test_delete_experiment_is_a_directory_exception(client, monkeypatch):
     monkeypatch.setattr('os.remove', lambda file: (_ for _ in ()).throw(IsADirectoryError))
     response = client.delete('/experiment/empty.py')
     assert response.status_code == 400
-    assert json.loads(response.data)['message'] == 'empty.py exists, but is a directory and not a file. Deletion failed.'
\ No newline at end of file
+    assert json.loads(response.data)['message'] == 'empty.py exists, but is a directory and not a file. Deletion failed.'
+
+def test_batch_delete_experiments(client):
+    subprocess.call(["touch", "elephant_vending_machine/static/experiment/test_file.py"])
+    subprocess.call(["touch", "elephant_vending_machine/static/experiment/test_file2.py"])
+    response = client.delete('/experiment', json={'pattern': 'test_file?.py'})
+    assert response.status_code == 200
+    assert json.loads(response.data)['deleted'] == ['test_file2.py']
+    response = client.delete('/experiment', json={'files': ['test_file.py']})
+    assert json.loads(response.data)['deleted'] == ['test_file.py']
+    assert not os.path.exists('elephant_vending_machine/static/experiment/test_file.py')
@@ -1,3 +1,4 @@
+import os
 import pytest
 import subprocess
 from io import BytesIO
@@ -37,7 +38,7 @@ def test_post_image_route_with_file_bad_extension(client):
     assert b'Error with request: File extension not allowed.' in response.data
 
 def test_post_image_route_with_file(monkeypatch, client):
-    monkeypatch.setattr('werkzeug.datastructures.FileStorage.save', lambda save_path, filename: "" )
+    monkeypatch.setattr('elephant_vending_machine.views.save_upload', lambda file, path: None)
     monkeypatch.setattr('subprocess.run', lambda command, check, shell: CompletedProcess(['some_command'], returncode=0))
     data = {'file': (BytesIO(b"Testing: \x00\x01"), 'test_file.png')}
     response = client.post('/image', data=data) 
@@ -45,7 +46,7 @@ def test_post_image_route_with_file(monkeypatch, client):
     assert b'Success: Image saved.' in response.data
 
 def test_post_image_route_copying_exception(monkeypatch, client):
-    monkeypatch.setattr('werkzeug.datastructures.FileStorage.save', lambda save_path, filename: "" )
+    monkeypatch.setattr('elephant_vending_machine.views.save_upload', lambda file, path: None)
     monkeypatch.setattr('subprocess.run', lambda command, check, shell: raise_(CalledProcessError(1, ['ssh'])))
     data = {'file': (BytesIO(b"Testing: \x00\x01"), 'test_file.png')}
     response = client.post('/image', data=data) 
@@ -77,4 +78,189 @@ def test_delete_image_is_a_directory_exception(client, monkeypatch):
     monkeypatch.setattr('os.remove', lambda file: (_ for _ in ()).throw(IsADirectoryError))
     response = client.delete('/image/blank.jpg')
     assert response.status_code == 400
-    assert json.loads(response.data)['message'] == 'blank.jpg exists, but is a directory and not a file. Deletion failed.'
\ No newline at end of file
+    assert json.loads(response.data)['message'] == 'blank.jpg exists, but is a directory and not a file. Deletion failed.'
+
+def test_get_image_endpoint_with_variants(client, monkeypatch):
+    monkeypatch.setattr('elephant_vending_machine.views.image_variants.find_manifest', lambda cache, name: {
+        'width': 2000, 'height': 1000, 'variants': {'thumbnail': {'path': 'ab/abcd/thumbnail.webp', 'width': 256, 'height': 128}}
+    } if name == 'test_file.png' else None)
+    subprocess.call(["touch", "elephant_vending_machine/static/img/test_file.png"])
+    subprocess.call(["touch", "elephant_vending_machine/static/img/test_file2.jpg"])
+    response = client.get('/image')
+    images = {image['name']: image for image in json.loads(response.data)['images']}
+    assert images['test_file.png']['width'] == 2000
+    assert images['test_file.png']['variants']['thumbnail'] == {
+        'url': 'http://localhost/static/img_cache/ab/abcd/thumbnail.webp', 'width': 256, 'height': 128}
+    assert images['test_file2.jpg']['variants'] == {}
+    assert images['test_file2.jpg']['width'] is None
+
+def test_post_image_route_normalized(monkeypatch, client):
+    from PIL import Image
+    commands = []
+    monkeypatch.setattr('subprocess.run', lambda command, check, shell: commands.append(command))
+    monkeypatch.setattr('elephant_vending_machine.views.image_variants.generate_variants', lambda *args: None)
+    image_data = BytesIO()
+    Image.new('RGB', (4000, 2000)).save(image_data, 'PNG')
+    image_data.seek(0)
+    data = {'file': (image_data, 'test_file.png'), 'normalize': 'true'}
+    response = client.post('/image', data=data)
+    assert response.status_code == 201
+    display_copy = 'elephant_vending_machine/static/img_display/1920x1080/test_file.png'
+    with Image.open(display_copy) as image:
+        assert image.size == (1920, 960)
+    assert all('/static/img_display/1920x1080/test_file.png' in command for command in commands if command.startswith('scp'))
+    client.delete('/image/test_file.png')
+    assert not os.path.exists(display_copy)
+
+def test_post_image_route_without_display_folder(monkeypatch, client):
+    monkeypatch.setattr('subprocess.run', lambda command, check, shell: CompletedProcess(['some_command'], returncode=0))
+    monkeypatch.setattr('elephant_vending_machine.views.image_variants.generate_variants', lambda *args: None)
+    monkeypatch.setattr('elephant_vending_machine.views.IMAGE_DISPLAY_FOLDER', '/static/img_display_missing')
+    data = {'file': (BytesIO(b"Testing: \x00\x01"), 'test_file.png')}
+    response = client.post('/image', data=data)
+    assert response.status_code == 201
+    response = client.delete('/image/test_file.png')
+    assert response.status_code == 200
+    assert not os.path.exists('elephant_vending_machine/static/img_display_missing')
+
+def test_image_index_synced_in_background(monkeypatch, client):
+    import shutil
+    import threading
+    from elephant_vending_machine import views
+    synced = threading.Event()
+    sync_threads = []
+    def sync(index, directory):
+        sync_threads.append(threading.current_thread())
+        synced.set()
+    monkeypatch.setattr('elephant_vending_machine.views.ImageIndex.sync', sync)
+    monkeypatch.setattr('elephant_vending_machine.views.IMAGE_INDEX_FILE', '/data/test_index/index.sqlite3')
+    monkeypatch.delitem(elephant_vending_machine.APP.extensions, 'image_index', raising=False)
+    try:
+        index = views.get_image_index()
+        assert index.search() == []
+        assert synced.wait(5)
+        assert sync_threads != [threading.current_thread()]
+    finally:
+        shutil.rmtree('elephant_vending_machine/data/test_index')
+
+def test_failed_variant_generation_is_logged(monkeypatch, client):
+    import threading
+    logged = threading.Event()
+    errors = []
+    def error(message, *args, **kwargs):
+        errors.append((message % args, kwargs['exc_info']))
+        logged.set()
+    monkeypatch.setattr('subprocess.run', lambda command, check, shell: CompletedProcess(['some_command'], returncode=0))
+    monkeypatch.setattr('elephant_vending_machine.views.image_variants.generate_variants', lambda *args: raise_(OSError('disk full')))
+    monkeypatch.setattr(elephant_vending_machine.APP.logger, 'error', error)
+    response = client.post('/image', data={'file': (BytesIO(b"Testing: \x00\x01"), 'test_file.png')})
+    assert response.status_code == 201
+    assert logged.wait(5)
+    assert errors[0][0] == 'Generating the variants of test_file.png failed'
+    assert str(errors[0][1]) == 'disk full'
+    client.delete('/image/test_file.png')
+
+def test_search_images(monkeypatch, client):
+    from PIL import Image
+    monkeypatch.setattr('subprocess.run', lambda command, check, shell: CompletedProcess(['some_command'], returncode=0))
+    monkeypatch.setattr('elephant_vending_machine.views.image_variants.generate_variants', lambda *args: None)
+    image_data = BytesIO()
+    Image.new('RGB', (300, 200)).save(image_data, 'PNG')
+    image_data.seek(0)
+    response = client.post('/image', data={'file': (image_data, 'test_file.png'), 'tags': 'unittest, dark'})
+    assert response.status_code == 201
+
+    response = client.get('/image/search?prefix=test_file&tag=unittest&min_width=300')
+    assert response.status_code == 200
+    images = json.loads(response.data)['images']
+    assert [image['filename'] for image in images] == ['test_file.png']
+    assert images[0]['tags'] == ['dark', 'unittest']
+    assert images[0]['url'] == 'http://localhost/static/img/test_file.png'
+
+    client.delete('/image/test_file.png')
+    response = client.get('/image/search?prefix=test_file')
+    assert json.loads(response.data)['images'] == []
+
+def test_search_images_bad_dimension(client):
+    response = client.get('/image/search?min_width=wide')
+    assert response.status_code == 400
+
+def test_post_image_route_dedupe(monkeypatch, client):
+    from PIL import Image
+    commands = []
+    monkeypatch.setattr('subprocess.run', lambda command, check, shell: commands.append(command))
+    monkeypatch.setattr('elephant_vending_machine.views.image_variants.generate_variants', lambda *args: None)
+    image = Image.effect_mandelbrot((256, 256), (-2, -1.5, 1, 1.5), 100).convert('RGB')
+    responses = []
+    for name, size in (('test_file.png', 256), ('test_file2.jpg', 128), ('test_file3.png', 128)):
+        image_data = BytesIO()
+        image.resize((size, size)).save(image_data, 'PNG' if name.endswith('png') else 'JPEG')
+        image_data.seek(0)
+        response = client.post('/image', data={'file': (image_data, name), 'dedupe': 'true'})
+        assert response.status_code == 201
+        responses.append(json.loads(response.data))
+
+    image_directory = 'elephant_vending_machine/static/img/'
+    # A near-duplicate in another format is reported but kept
+    assert [duplicate['filename'] for duplicate in responses[1]['duplicates']] == ['test_file.png']
+    assert responses[1]['linked_to'] is None
+    assert not os.path.samefile(image_directory + 'test_file.png', image_directory + 'test_file2.jpg')
+    with Image.open(image_directory + 'test_file2.jpg') as saved:
+        assert saved.format == 'JPEG'
+    # A near-duplicate with the same format and extension is linked
+    assert 'test_file.png' in [duplicate['filename'] for duplicate in responses[2]['duplicates']]
+    assert responses[2]['linked_to'] == 'test_file.png'
+    assert os.path.samefile(image_directory + 'test_file.png', image_directory + 'test_file3.png')
+    assert 'ln -f' in commands[-1] and commands[-1].endswith('/test_file.png ~/elephant_vending_machine/images/test_file3.png')
+    for name in ('test_file.png', 'test_file2.jpg', 'test_file3.png'):
+        client.delete('/image/' + name)
+
+def test_upload_over_deduped_image_keeps_original(monkeypatch, client):
+    from PIL import Image
+    commands = []
+    monkeypatch.setattr('subprocess.run', lambda command, check, shell: commands.append(command))
+    monkeypatch.setattr('elephant_vending_machine.views.image_variants.generate_variants', lambda *args: None)
+    image_directory = 'elephant_vending_machine/static/img/'
+    uploads = []
+    for name, color, dedupe in (('test_file.png', 'white', 'false'), ('test_file3.png', 'white', 'true'),
+                                ('test_file3.png', 'black', 'false')):
+        image_data = BytesIO()
+        Image.new('RGB', (64, 64), color).save(image_data, 'PNG')
+        uploads.append(image_data.getvalue())
+        image_data.seek(0)
+        response = client.post('/image', data={'file': (image_data, name), 'dedupe': dedupe})
+        assert response.status_code == 201
+        if name == 'test_file3.png' and dedupe == 'true':
+            assert json.loads(response.data)['linked_to'] == 'test_file.png'
+
+    with open(image_directory + 'test_file.png', 'rb') as original:
+        assert original.read() == uploads[0]
+    with open(image_directory + 'test_file3.png', 'rb') as replaced:
+        assert replaced.read() == uploads[2]
+    # The link on the Pis is removed before the new image is copied over it
+    assert 'rm -f ~/elephant_vending_machine/images/test_file3.png' in commands[-2]
+    assert commands[-1].startswith('scp') and commands[-1].endswith('/test_file3.png')
+    for name in ('test_file.png', 'test_file3.png'):
+        client.delete('/image/' + name)
+
+def test_batch_delete_images(monkeypatch, client):
+    forgotten = []
+    monkeypatch.setattr('elephant_vending_machine.views.forget_image', forgotten.append)
+    subprocess.call(["touch", "elephant_vending_machine/static/img/test_file.png"])
+    subprocess.call(["touch", "elephant_vending_machine/static/img/test_file2.jpg"])
+    response = client.delete('/image', json={'files': ['test_file.png', 'test_file2.jpg']})
+    assert response.status_code == 200
+    assert json.loads(response.data)['deleted'] == ['test_file.png', 'test_file2.jpg']
+    assert forgotten == ['test_file.png', 'test_file2.jpg']
+
+def test_post_image_route_host_down(monkeypatch, client):
+    from elephant_vending_machine.libraries import host_health
+    monkeypatch.setattr('elephant_vending_machine.views.save_upload', lambda file, path: None)
+    monkeypatch.setattr('subprocess.run', lambda command, check, shell: raise_(AssertionError(command)))
+    breaker = host_health.get_breaker('192.168.1.11')
+    breaker.trip()
+    data = {'file': (BytesIO(b"Testing: \x00\x01"), 'test_file.png')}
+    response = client.post('/image', data=data)
+    breaker.record_success()
+    assert response.status_code == 500
+    assert b'Error: Failed to copy file to hosts, Host 192.168.1.11 is down' in response.data
@@ -1,4 +1,5 @@
 import pytest
+import os
 import subprocess
 from io import BytesIO
 import json
@@ -18,6 +19,7 @@ def client():
         subprocess.call(["rm","elephant_vending_machine/static/log/test_file.csv"])
         subprocess.call(["rm","elephant_vending_machine/static/log/test_file2.csv"])
         subprocess.call(["rm", "elephant_vending_machine/static/log/empty.csv"])
+        subprocess.call(["rm", "-f", "elephant_vending_machine/static/log/test_file.csv.gz", "elephant_vending_machine/static/log/test_file2.csv.gz"])
 
 def test_get_log_endpoint(client):
     subprocess.call(["touch", "elephant_vending_machine/static/log/test_file.csv"])
@@ -44,4 +46,124 @@ def test_delete_log_is_a_directory_exception(client, monkeypatch):
     monkeypatch.setattr('os.remove', lambda file: (_ for _ in ()).throw(IsADirectoryError))
     response = client.delete('/log/empty.csv')
     assert response.status_code == 400
-    assert json.loads(response.data)['message'] == 'empty.csv exists, but is a directory and not a file. Deletion failed.'
\ No newline at end of file
+    assert json.loads(response.data)['message'] == 'empty.csv exists, but is a directory and not a file. Deletion failed.'
+
+def test_batch_delete_logs(client):
+    subprocess.call(["touch", "elephant_vending_machine/static/log/test_file.csv"])
+    subprocess.call(["touch", "-d", "2001-01-01", "elephant_vending_machine/static/log/test_file2.csv"])
+    response = client.delete('/log', json={'pattern': 'test_file*.csv', 'before': '2002-01-01'})
+    assert response.status_code == 200
+    assert json.loads(response.data)['deleted'] == ['test_file2.csv']
+    response = client.delete('/log', json={'files': ['test_file.csv', 'missing.csv']})
+    assert json.loads(response.data)['deleted'] == ['test_file.csv']
+    assert json.loads(response.data)['message'] == 'Deleted 1 of 1 selected files.'
+
+def test_batch_delete_logs_malformed(client):
+    assert client.delete('/log', json={}).status_code == 400
+    assert client.delete('/log').status_code == 400
+    assert client.delete('/log', json={'files': 'test_file.csv'}).status_code == 400
+    response = client.delete('/log', json={'before': 'yesterday'})
+    assert response.status_code == 400
+    assert json.loads(response.data)['message'] == 'Error with request: before must be a date.'
+
+def write_compressed_log(name, content):
+    import gzip
+    with gzip.open('elephant_vending_machine/static/log/' + name + '.gz', 'wt') as log:
+        log.write(content)
+
+def test_compressed_logs_are_listed_served_and_deleted(client):
+    write_compressed_log('test_file.csv', '"2020-03-17 04:26:02.085651","Experiment started"\r\n')
+    response = client.get('/log')
+    assert 'http://localhost/static/log/test_file.csv' in json.loads(response.data)['files']
+
+    response = client.get('/log/test_file.csv', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.mimetype == 'text/csv'
+    import gzip
+    assert b'Experiment started' in gzip.decompress(response.data)
+
+    response = client.get('/log/test_file.csv')
+    assert 'Content-Encoding' not in response.headers
+    assert b'Experiment started' in response.data
+
+    response = client.delete('/log/test_file.csv')
+    assert response.status_code == 200
+    assert client.get('/log/test_file.csv').status_code == 404
+
+def test_get_plain_log(client):
+    subprocess.call(["touch", "elephant_vending_machine/static/log/test_file.csv"])
+    response = client.get('/log/test_file.csv')
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+
+def test_batch_delete_compressed_logs(client):
+    write_compressed_log('test_file2.csv', '')
+    response = client.delete('/log', json={'pattern': 'test_file2.csv'})
+    assert json.loads(response.data)['deleted'] == ['test_file2.csv']
+    assert not os.path.exists('elephant_vending_machine/static/log/test_file2.csv.gz')
+
+def test_get_log_trace(client):
+    from elephant_vending_machine.libraries.sensor_trace import TraceRecorder
+    from elephant_vending_machine.views import trace_path
+    import os
+    with open("elephant_vending_machine/static/log/test_file.csv", "w") as log:
+        log.write('"2020-03-17 05:15:06.000000","Experiment started",""\n'
+                  '"2020-03-17 05:15:07.000000","Trial 1 picked left","100.500000"\n')
+    path = trace_path('test_file.csv')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    recorder = TraceRecorder(path, [0, 1, 2], capacity=64)
+    for index in range(20):
+        recorder.record(100.4 + index * 0.01, [900 - index * 40, 0, 800])
+    recorder.close()
+    response = client.get('/log/test_file.csv/trace?line=2&window_ms=25')
+    assert response.status_code == 200
+    body = json.loads(response.data)
+    assert body['event']['message'] == 'Trial 1 picked left'
+    assert body['pins'] == [0, 1, 2]
+    assert [sample['offset_ms'] for sample in body['samples']] == [-20, -10, 0, 10, 20]
+    assert body['samples'][2]['readings'] == [500, 0, 800]
+    response = client.get('/log/test_file.csv/trace?line=1')
+    assert response.status_code == 400
+    assert client.get('/log/test_file.csv/trace').status_code == 400
+    client.delete('/log/test_file.csv')
+    assert not os.path.exists(path)
+
+def test_get_log_trace_not_recorded(client):
+    with open("elephant_vending_machine/static/log/test_file.csv", "w") as log:
+        log.write('"2020-03-17 05:15:07.000000","Trial 1 picked left","100.500000"\n')
+    response = client.get('/log/test_file.csv/trace?line=1')
+    assert response.status_code == 404
+    assert json.loads(response.data)['message'] == 'No sensor trace was recorded for test_file.csv.'
+    assert client.get('/log/missing.csv/trace?line=1').status_code == 404
+
+def test_export_logs(client):
+    import gzip
+    import io
+    import os
+    import zipfile
+    log_directory = 'elephant_vending_machine/static/log/'
+    names = ['2020-03-09 10:00:00.000000 export_experiment.py.csv',
+             '2020-03-12 10:00:00.000000 export_experiment.py.csv',
+             '2020-03-12 11:00:00.000000 other_experiment.py.csv',
+             '2020-03-20 10:00:00.000000 export_experiment.py.csv']
+    for name in names:
+        with open(log_directory + name, 'w') as log:
+            log.write(f'"{name}","Experiment started"\r\n')
+    with gzip.open(log_directory + names[1] + '.gz', 'wt') as log:
+        log.write('"compressed","Experiment started"\r\n')
+    os.remove(log_directory + names[1])
+    try:
+        response = client.get('/log/export?experiment=export_experiment.py&since=2020-03-10&until=2020-03-20')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/zip'
+        archive = zipfile.ZipFile(io.BytesIO(response.data))
+        assert archive.namelist() == [names[1], names[3]]
+        assert archive.read(names[1]) == b'"compressed","Experiment started"\r\n'
+        response = client.get('/log/export')
+        assert set(names) <= set(zipfile.ZipFile(io.BytesIO(response.data)).namelist())
+        assert client.get('/log/export?experiment=missing.py').status_code == 404
+        assert client.get('/log/export?since=last week').status_code == 400
+    finally:
+        for name in names:
+            subprocess.call(["rm", "-f", log_directory + name, log_directory + name + '.gz'])
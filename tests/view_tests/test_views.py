@@ -21,7 +21,7 @@ def client():
 
 def test_run_trial_route_success(client, monkeypatch):
     mock_logger = MockLogger()
-    monkeypatch.setattr('elephant_vending_machine.views.create_experiment_logger', lambda file_name: mock_logger)
+    monkeypatch.setattr('elephant_vending_machine.views.create_experiment_logger', lambda file_name, rig_name: mock_logger)
 
     experiment_path = "elephant_vending_machine/static/experiment/unittestExperiment.py"
     subprocess.call(["touch", experiment_path])
@@ -33,6 +33,7 @@ def test_run_trial_route_success(client, monkeypatch):
     response = client.post('/run-experiment/unittestExperiment.py')
     assert b'Running unittestExperiment' in response.data
     assert response.status_code == 200
+    elephant_vending_machine.views.get_rig_registry().get('default').wait()
     assert mock_logger.args == ['Entered unit test experiment']
     subprocess.call(["rm", "elephant_vending_machine/static/experiment/unittestExperiment.py"])
 
@@ -40,3 +41,181 @@ def test_run_trial_experiment_file_doesnt_exist(client):
     response = client.post('/run-experiment/aNonexistentExperiment.py')
     assert b'No experiment named aNonexistentExperiment' in response.data
     assert response.status_code == 400
+
+def test_run_trial_unknown_rig(client):
+    response = client.post('/run-experiment/aNonexistentExperiment.py?rig=nowhere')
+    assert b'No rig named nowhere' in response.data
+    assert response.status_code == 400
+
+def test_run_trial_rig_busy(client, monkeypatch):
+    monkeypatch.setattr('elephant_vending_machine.views.execute_experiment', lambda *args: None)
+    monkeypatch.setattr('elephant_vending_machine.libraries.rig_registry.Rig.busy', True)
+
+    experiment_path = "elephant_vending_machine/static/experiment/unittestExperiment.py"
+    experiment_file = open(experiment_path, 'w')
+    experiment_file.write('def run_experiment(experiment_logger, vending_machine):\n    pass\n')
+    experiment_file.close()
+
+    response = client.post('/run-experiment/unittestExperiment.py')
+    assert response.status_code == 409
+    assert b'already running' in response.data
+    subprocess.call(["rm", experiment_path])
+
+def test_list_rigs(client):
+    response = client.get('/rig')
+    assert response.status_code == 200
+    rigs = json.loads(response.data)['rigs']
+    assert rigs[0]['name'] == 'default'
+    assert rigs[0]['hosts'] == elephant_vending_machine.APP.config['REMOTE_HOSTS']
+
+def test_find_experiment_stimuli(tmp_path):
+    experiment_path = tmp_path / 'experiment.py'
+    experiment_path.write_text("BLANK = 'blank.png'\nWHITE = \"white.JPG\"\nNOTE = 'notes.txt'\nAGAIN = 'blank.png'\n")
+    module = type('Module', (), {})()
+    assert elephant_vending_machine.views.find_experiment_stimuli(module, str(experiment_path)) == ['blank.png', 'white.JPG']
+    module.STIMULI = ['listed.png']
+    assert elephant_vending_machine.views.find_experiment_stimuli(module, str(experiment_path)) == ['listed.png']
+
+def test_calibrate_rig(client, monkeypatch):
+    def noisy_sensors(self, *args):
+        readings = iter(range(1000000))
+        self.getPositions = lambda pins: [600 + next(readings) % 5 for pin in pins]
+    monkeypatch.setattr('maestro.Controller.__init__', noisy_sensors)
+    monkeypatch.setattr('maestro.Controller.close', lambda self: None)
+    monkeypatch.setattr('elephant_vending_machine.views.CALIBRATION_FILE',
+                        '/data/test_calibration.json')
+    rig = elephant_vending_machine.views.get_rig_registry().get('default')
+    monkeypatch.setattr(rig, 'config', dict(rig.config))
+    response = client.post('/rig/default/calibrate?duration=0.05')
+    assert response.status_code == 200
+    pins = json.loads(response.data)['pins']
+    assert [pin['pin'] for pin in pins] == [0, 1, 2]
+    assert all(pin['minimum'] == 600 and pin['threshold'] < 540 for pin in pins)
+    assert rig.config['SENSOR_THRESHOLDS'] == {pin['pin']: pin['threshold'] for pin in pins}
+    path = 'elephant_vending_machine/data/test_calibration.json'
+    with open(path) as calibration_file:
+        assert json.load(calibration_file)['default'] == {
+            str(pin['pin']): pin['threshold'] for pin in pins}
+    os.remove(path)
+
+def test_calibrate_rig_malformed(client):
+    assert client.post('/rig/nowhere/calibrate').status_code == 400
+    response = client.post('/rig/default/calibrate?duration=600')
+    assert response.status_code == 400
+    # Longer than gunicorn's worker timeout
+    response = client.post('/rig/default/calibrate?duration=30')
+    assert response.status_code == 400
+    assert b'up to 20' in response.data
+    assert client.post('/rig/default/calibrate?duration=soon').status_code == 400
+
+def test_calibrate_rig_without_sensors(client, monkeypatch):
+    def no_serial_port(self, *args):
+        raise OSError('No such file or directory')
+    monkeypatch.setattr('maestro.Controller.__init__', no_serial_port)
+    response = client.post('/rig/default/calibrate?duration=0.05')
+    assert response.status_code == 500
+    assert b'No such file or directory' in response.data
+
+def test_calibrate_rig_busy(client, monkeypatch):
+    monkeypatch.setattr('elephant_vending_machine.libraries.rig_registry.Rig.busy', True)
+    assert client.post('/rig/default/calibrate?duration=0.05').status_code == 409
+
+def test_list_hosts(client, monkeypatch):
+    import socket
+    from elephant_vending_machine.libraries import host_health
+    def probe(host, port, timeout):
+        if host == '192.168.1.12':
+            raise socket.timeout()
+        return 0.0015
+    monkeypatch.setattr(host_health, 'probe', probe)
+    response = client.get('/hosts')
+    host_health.get_breaker('192.168.1.12').record_success()
+    assert response.status_code == 200
+    hosts = json.loads(response.data)['hosts']
+    assert [host['host'] for host in hosts] == elephant_vending_machine.APP.config['REMOTE_HOSTS']
+    assert [host['up'] for host in hosts] == [True, False, True]
+    assert hosts[0]['latency_ms'] == 1.5
+    assert hosts[1]['breaker'] == 'open'
+
+def test_retention_compresses_logs_in_place(monkeypatch):
+    from elephant_vending_machine import views
+    monkeypatch.setitem(elephant_vending_machine.APP.config, 'RETENTION_POLICIES', {
+        'log': {'max_age_days': 90}, 'image': {'max_age_days': 90}})
+    monkeypatch.delitem(elephant_vending_machine.APP.extensions, 'retention_job', raising=False)
+    monkeypatch.setattr('elephant_vending_machine.libraries.retention.RetentionJob.start', lambda self: None)
+    job = views.get_retention_job()
+    actions = {os.path.basename(directory): policy.get('action') for directory, policy, _ in job.targets}
+    assert actions == {'log': 'compress', 'img': None}
+
+def test_resume_experiment(client, monkeypatch):
+    from elephant_vending_machine.libraries.session_journal import ExperimentSession
+    mock_logger = MockLogger()
+    monkeypatch.setattr('elephant_vending_machine.views.create_experiment_logger', lambda file_name, rig_name: mock_logger)
+    experiment_path = "elephant_vending_machine/static/experiment/unittestResumable.py"
+    with open(experiment_path, 'w') as experiment_file:
+        experiment_file.write('def run_experiment(experiment_logger, vending_machine, session):\n'
+                              '    for trial in session.trials(5):\n'
+                              '        experiment_logger.info("Trial %s", trial + 1)\n')
+    log_filename = 'unittestResumable.csv'
+    journal = elephant_vending_machine.views.journal_path(log_filename)
+    os.makedirs(os.path.dirname(journal), exist_ok=True)
+    session = ExperimentSession.create(journal, 'unittestResumable.py', 'default')
+    for trial in range(3):
+        session.checkpoint(trial)
+
+    response = client.post(f'/resume-experiment/{log_filename}')
+    assert response.status_code == 200
+    body = json.loads(response.data)
+    assert (body['rig'], body['trial']) == ('default', 3)
+    elephant_vending_machine.views.get_rig_registry().get('default').wait()
+    assert mock_logger.args == ['Trial %s', 5]
+    assert ExperimentSession.resume(journal).finished
+
+    response = client.post(f'/resume-experiment/{log_filename}')
+    assert response.status_code == 400
+    assert b'already finished' in response.data
+    elephant_vending_machine.views.forget_log(log_filename)
+    assert not os.path.exists(journal)
+    os.remove(experiment_path)
+
+def test_resume_experiment_without_journal(client):
+    response = client.post('/resume-experiment/neverRun.csv')
+    assert response.status_code == 400
+    assert b'No session journal' in response.data
+
+def test_profile_request(client):
+    response = client.get('/rig', headers={'X-Profile': 'sampling'})
+    assert response.status_code == 200
+    name = response.headers['X-Profile']
+    assert name.startswith('request ') and name.endswith(' list_rigs')
+    profiles = json.loads(client.get('/profile').data)['profiles']
+    assert {'name': name, 'formats': ['folded', 'memory']} in profiles
+    response = client.get(f'/profile/{name}')
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'] == f'attachment; filename="{name}.folded"'
+    response = client.get(f'/profile/{name}?format=memory')
+    assert b'Peak traced memory' in response.data
+    assert client.get(f'/profile/{name}?format=prof').status_code == 404
+    assert client.get(f'/profile/{name}?format=svg').status_code == 400
+    assert 'X-Profile' not in client.get('/rig').headers
+    for suffix in ('.folded', '.memory.txt'):
+        os.remove(elephant_vending_machine.views.profile_path(name) + suffix)
+
+def test_profile_run(client, monkeypatch):
+    mock_logger = MockLogger()
+    monkeypatch.setattr('elephant_vending_machine.views.create_experiment_logger', lambda file_name, rig_name: mock_logger)
+    experiment_path = "elephant_vending_machine/static/experiment/unittestProfiled.py"
+    with open(experiment_path, 'w') as experiment_file:
+        experiment_file.write('def run_experiment(experiment_logger, vending_machine):\n'
+                              '    experiment_logger.info("Profiled")\n')
+    assert client.post('/run-experiment/unittestProfiled.py?profile=perf').status_code == 400
+    response = client.post('/run-experiment/unittestProfiled.py?profile=cprofile')
+    assert response.status_code == 200
+    log_filename = json.loads(response.data)['log_file']
+    elephant_vending_machine.views.get_rig_registry().get('default').wait()
+    response = client.get(f'/profile/{log_filename}')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/octet-stream'
+    elephant_vending_machine.views.forget_log(log_filename)
+    assert client.get(f'/profile/{log_filename}').status_code == 404
+    os.remove(experiment_path)